@@ -21,6 +21,20 @@ LANG_DIR_WITH_G="$RECIPE_DIR/data/lang_test_tg"
 # Directorio de salida para el modelo empaquetado (en tu home de WSL)
 PACKAGED_MODEL_DIR_WSL="$HOME/mi_modelo_vosk_final_wsl"
 
+# Herramienta de empaquetado: coloca los archivos con reflink/enlace duro cuando el sistema
+# de archivos lo permite (en lugar de copiarlos) y crea el ZIP en paralelo, reutilizando
+# los miembros sin cambios del ZIP anterior (ver local/package_vosk_model.py)
+PACKAGER="$RECIPE_DIR/local/package_vosk_model.py"
+LINK_MODE="auto"                        # auto | reflink | hardlink | copy
+ZIP_NJ=$(nproc 2>/dev/null || echo 1)   # Procesos de compresión
+
+# Paquetes completos/delta para despliegue (PASO 8, opcional): si BUNDLE_STORE no está vacío,
+# se mantiene ahí un almacén de componentes (am/, graph/, ivector/, conf/) y se genera
+# $PACKAGED_MODEL_DIR_WSL.bundle.zip. Con BUNDLE_BASE apuntando al paquete instalado en los
+# nodos, el paquete es un delta con solo los componentes que cambiaron.
+BUNDLE_STORE=""
+BUNDLE_BASE=""
+
 # --- PASO 1: Crear Estructura de Directorios para el Modelo Empaquetado ---
 echo "Creando estructura de directorios en $PACKAGED_MODEL_DIR_WSL..."
 mkdir -p "$PACKAGED_MODEL_DIR_WSL/am"
@@ -31,8 +45,8 @@ echo "Estructura creada."
 
 # --- PASO 2: Copiar Modelo Acústico y Árbol ---
 echo "Copiando modelo acústico y árbol..."
-cp "$MODEL_DIR_FINAL_TDNN/final.mdl" "$PACKAGED_MODEL_DIR_WSL/am/final.mdl" || { echo "Error copiando final.mdl"; exit 1; }
-cp "$TREE_CHAIN_DIR/tree" "$PACKAGED_MODEL_DIR_WSL/am/tree" || { echo "Error copiando tree"; exit 1; }
+python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$MODEL_DIR_FINAL_TDNN/final.mdl" "$PACKAGED_MODEL_DIR_WSL/am/final.mdl" || { echo "Error copiando final.mdl"; exit 1; }
+python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$TREE_CHAIN_DIR/tree" "$PACKAGED_MODEL_DIR_WSL/am/tree" || { echo "Error copiando tree"; exit 1; }
 echo "Modelo acústico y árbol copiados."
 
 # --- PASO 3: Copiar Archivos de Configuración de Características ---
@@ -71,20 +85,20 @@ if [ ! -d "$GRAPH_SOURCE_DIR" ] || [ ! -f "$GRAPH_SOURCE_DIR/HCLG.fst" ]; then
     echo "Error: Directorio de grafo $GRAPH_SOURCE_DIR o HCLG.fst no encontrado. ¿Se ejecutó mkgraph.sh?"
     exit 1
 fi
-cp "$GRAPH_SOURCE_DIR/HCLG.fst" "$PACKAGED_MODEL_DIR_WSL/graph/HCLG.fst" || exit 1
-cp "$GRAPH_SOURCE_DIR/words.txt" "$PACKAGED_MODEL_DIR_WSL/graph/words.txt" || exit 1
+python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$GRAPH_SOURCE_DIR/HCLG.fst" "$PACKAGED_MODEL_DIR_WSL/graph/HCLG.fst" || exit 1
+python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$GRAPH_SOURCE_DIR/words.txt" "$PACKAGED_MODEL_DIR_WSL/graph/words.txt" || exit 1
 
 # Copiar el directorio phones ENTERO del grafo
 if [ -d "$GRAPH_SOURCE_DIR/phones" ]; then
-    cp -r "$GRAPH_SOURCE_DIR/phones/"* "$PACKAGED_MODEL_DIR_WSL/graph/phones/" || exit 1
+    python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$GRAPH_SOURCE_DIR/phones/"* "$PACKAGED_MODEL_DIR_WSL/graph/phones/" || exit 1
 else
     echo "ADVERTENCIA: Directorio $GRAPH_SOURCE_DIR/phones no encontrado. Copiando desde $LANG_DIR_BASE/phones."
     # Fallback a copiar desde data/lang/phones si no está en el directorio del grafo
-    cp -r "$LANG_DIR_BASE/phones/"* "$PACKAGED_MODEL_DIR_WSL/graph/phones/" || exit 1
+    python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$LANG_DIR_BASE/phones/"* "$PACKAGED_MODEL_DIR_WSL/graph/phones/" || exit 1
 fi
 
 if [ -f "$LANG_DIR_WITH_G/G.fst" ]; then
-    cp "$LANG_DIR_WITH_G/G.fst" "$PACKAGED_MODEL_DIR_WSL/graph/Gr.fst" || echo "Advertencia: No se pudo copiar G.fst como Gr.fst"
+    python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$LANG_DIR_WITH_G/G.fst" "$PACKAGED_MODEL_DIR_WSL/graph/Gr.fst" || echo "Advertencia: No se pudo copiar G.fst como Gr.fst"
 else
     echo "Advertencia: $LANG_DIR_WITH_G/G.fst no encontrado, no se copiará Gr.fst."
 fi
@@ -97,12 +111,12 @@ if [ ! -d "$IVECTOR_EXTRACTOR_DIR" ] || [ ! -f "$IVECTOR_EXTRACTOR_DIR/final.ie"
     echo "Error: Directorio de extractor de i-vectors $IVECTOR_EXTRACTOR_DIR o final.ie no encontrado."
     exit 1
 fi
-cp "$IVECTOR_EXTRACTOR_DIR/final.ie" "$PACKAGED_MODEL_DIR_WSL/ivector/final.ie" || exit 1
+python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$IVECTOR_EXTRACTOR_DIR/final.ie" "$PACKAGED_MODEL_DIR_WSL/ivector/final.ie" || exit 1
 
 # Copiar archivos de configuración del extractor
 for conf_file in online_cmvn.conf splice.conf splice_opts global_cmvn.stats final.dubm final.mat; do
     if [ -f "$IVECTOR_EXTRACTOR_DIR/$conf_file" ]; then
-        cp "$IVECTOR_EXTRACTOR_DIR/$conf_file" "$PACKAGED_MODEL_DIR_WSL/ivector/" || echo "Advertencia: Falló al copiar $IVECTOR_EXTRACTOR_DIR/$conf_file"
+        python3 "$PACKAGER" place --link-mode "$LINK_MODE" "$IVECTOR_EXTRACTOR_DIR/$conf_file" "$PACKAGED_MODEL_DIR_WSL/ivector/" || echo "Advertencia: Falló al copiar $IVECTOR_EXTRACTOR_DIR/$conf_file"
     else
         echo "INFO: Archivo $conf_file no encontrado en $IVECTOR_EXTRACTOR_DIR, no se copiará."
     fi
@@ -118,11 +132,23 @@ echo "Empaquetado preliminar completado en: $PACKAGED_MODEL_DIR_WSL"
 echo "Revisa la estructura y el contenido."
 
 # --- PASO 7: Crear Archivo ZIP (Opcional) ---
+# Equivale a `zip -qr` desde el directorio padre, pero comprime en paralelo y solo vuelve a
+# comprimir los archivos cuyo contenido cambió desde el ZIP anterior (manifiesto <zip>.manifest.json)
 echo "Creando archivo ZIP..."
-cd "$(dirname "$PACKAGED_MODEL_DIR_WSL")" || exit 1 # Ir al directorio padre
-zip -qr "$(basename "$PACKAGED_MODEL_DIR_WSL").zip" "$(basename "$PACKAGED_MODEL_DIR_WSL")/" || \
-    { echo "Error creando el archivo ZIP."; cd "$RECIPE_DIR"; exit 1; }
-cd "$RECIPE_DIR" # Volver al directorio original de la receta
+python3 "$PACKAGER" zip --nj "$ZIP_NJ" "$PACKAGED_MODEL_DIR_WSL" "$PACKAGED_MODEL_DIR_WSL.zip" || \
+    { echo "Error creando el archivo ZIP."; exit 1; }
 echo "Archivo ZIP creado en: $(dirname "$PACKAGED_MODEL_DIR_WSL")/$(basename "$PACKAGED_MODEL_DIR_WSL").zip"
 
+# --- PASO 8: Paquete Completo o Delta para Despliegue (Opcional) ---
+if [ -n "$BUNDLE_STORE" ]; then
+    echo "Creando paquete de despliegue desde el almacén de componentes $BUNDLE_STORE..."
+    bundle_opts=(--store "$BUNDLE_STORE" --nj "$ZIP_NJ")
+    if [ -n "$BUNDLE_BASE" ]; then
+        bundle_opts+=(--base "$BUNDLE_BASE")
+    fi
+    python3 "$PACKAGER" bundle "${bundle_opts[@]}" "$PACKAGED_MODEL_DIR_WSL" "$PACKAGED_MODEL_DIR_WSL.bundle.zip" || \
+        { echo "Error creando el paquete de despliegue."; exit 1; }
+    echo "Instalar en los nodos con: python3 local/package_vosk_model.py apply $(basename "$PACKAGED_MODEL_DIR_WSL").bundle.zip <dir_modelos>"
+fi
+
 echo "¡EMPAQUETADO COMPLETADO!"
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Ensamblado del lexicón (pasos 4-9 de lang_prep.sh) en un único proceso.
+# Antes se hacía con varias pasadas externas de sort -u, comm -23, grep y awk de dos
+# archivos sobre el lexicón base completo. Aquí el lexicón base normalizado se carga una
+# vez en un diccionario y en una sola pasada se obtienen:
+#   - la lista de OOV (palabras del vocabulario de datos que no están en el lexicón base),
+#   - la lista de peticiones de G2P (OOV + jerga técnica normalizada),
+#   - lexicon.txt final (especiales + base para el vocabulario + G2P + resto del base),
+#     limpio y ordenado igual que `awk 'NF > 1' | LC_ALL=C sort -u`.
+# El G2P se ejecuta en el mismo proceso con la caché de g2p_epitran.py, así que solo se
+# transliteran (y solo se inicializa Epitran para) las palabras no vistas antes.
+#
+# Uso: local/assemble_lexicon.py --vocab <vocab> --base-lexicon <lexicon_base_normalized>
+#        --jargon <jerga_normalizada> --oov-out <oov.txt> --g2p-requests <combined_oov.txt>
+#        --g2p-output <lexicon_g2p_output.txt> --lexicon-out <lexicon.txt>
+#        [--g2p-cache <g2p_cache.tsv>] [--nj N]
+
+import argparse
+import os
+import re
+import resource
+import sys
+import time
+
+try:
+    from g2p_epitran import g2p_lexicon
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from g2p_epitran import g2p_lexicon
+
+SPECIAL_ENTRIES = ["!SIL sil", "<UNK> spn"]
+SPECIAL_WORDS = {"!SIL", "<UNK>"}
+
+# Separador de campos por defecto de awk. str.split() coincide con él salvo en otros
+# espacios (\r, \f, NBSP, ...), así que solo se usa la expresión regular en esas líneas.
+_AWK_FS = re.compile(r'[ \t\n]+')
+_NON_AWK_SPACE = re.compile(r'[^\S \t\n]')
+
+
+def _awk_fields(line):
+    if not _NON_AWK_SPACE.search(line):
+        return line.split()
+    stripped = line.strip(' \t\n')
+    return _AWK_FS.split(stripped) if stripped else []
+
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f_in:
+        return [line.rstrip('\n') for line in f_in]
+
+
+def load_base_lexicon(path):
+    # Devuelve (entradas, palabra -> [líneas]) conservando el orden del archivo.
+    # Cada entrada es (palabra, línea, tiene_pronunciación), con tiene_pronunciación == NF > 1.
+    entries = []
+    by_word = {}
+    for line in read_lines(path):
+        fields = _awk_fields(line)
+        word = fields[0] if fields else ''
+        entries.append((word, line, len(fields) > 1))
+        by_word.setdefault(word, []).append(line)
+    return entries, by_word
+
+
+def load_vocab(path):
+    vocab = []
+    for line in read_lines(path):
+        if line.strip():
+            vocab.append(_awk_fields(line)[0])
+    return vocab
+
+
+def assemble(vocab_words, base_entries, base_by_word, jargon_words):
+    # Paso 5: entradas del lexicón base para las palabras del vocabulario (orden del base)
+    vocab_set = set(vocab_words)
+    lexicon = [(line, True) for line in SPECIAL_ENTRIES]
+    lexicon.extend((line, has_pron) for word, line, has_pron in base_entries if word in vocab_set)
+
+    # Paso 6: OOV de los datos (comm -23 vocab palabras_base) + jerga, sin especiales
+    oov_words = sorted(set(word for word in vocab_words if word not in base_by_word))
+    g2p_requests = sorted(set(oov_words).union(jargon_words) - SPECIAL_WORDS - {''})
+    return lexicon, oov_words, g2p_requests
+
+
+def add_g2p_and_rest(lexicon, g2p_lines, base_entries):
+    # Paso 7: salida del G2P. Paso 8: resto del lexicón base cuyas palabras aún no están.
+    # lexicon es una lista de (línea, tiene_pronunciación).
+    for line in g2p_lines:
+        lexicon.append((line, len(_awk_fields(line)) > 1))
+    before_final_clean = [line for line, _ in lexicon]
+    seen = set()
+    for line in before_final_clean:
+        fields = _awk_fields(line)
+        if fields:
+            seen.add(fields[0])
+    lexicon.extend((line, has_pron) for word, line, has_pron in base_entries
+                   if word not in seen and word not in SPECIAL_WORDS)
+    # Paso 9: awk 'NF > 1' | LC_ALL=C sort -u. Las líneas vienen de UTF-8 estricto, así que
+    # el orden de code points de Python coincide con el orden de bytes de LC_ALL=C.
+    final_lexicon = sorted(set(line for line, has_pron in lexicon if has_pron))
+    return final_lexicon, before_final_clean
+
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f_out:
+        f_out.write(''.join(line + '\n' for line in lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ensambla lexicon.txt a partir del vocabulario, el lexicón base, la jerga y el G2P.")
+    parser.add_argument('--vocab', required=True, help="Vocabulario normalizado de los datos (una palabra por línea)")
+    parser.add_argument('--base-lexicon', required=True, help="Lexicón base normalizado (PALABRA fonemas)")
+    parser.add_argument('--jargon', required=True, help="Jerga técnica normalizada (una palabra por línea)")
+    parser.add_argument('--oov-out', required=True, help="Salida: OOV del vocabulario respecto al lexicón base")
+    parser.add_argument('--g2p-requests', required=True, help="Salida: palabras enviadas al G2P (OOV + jerga)")
+    parser.add_argument('--g2p-output', required=True, help="Salida: pronunciaciones generadas por el G2P")
+    parser.add_argument('--lexicon-out', required=True, help="Salida: lexicon.txt final")
+    parser.add_argument('--g2p-cache', default=None, help="Caché persistente del G2P (ver g2p_epitran.py)")
+    parser.add_argument('--nj', type=int, default=1, help="Procesos para el G2P de palabras no cacheadas")
+    args = parser.parse_args()
+
+    timings = []
+    start_time = last_time = time.time()
+
+    def _mark(phase):
+        nonlocal last_time
+        now = time.time()
+        timings.append(f"{phase} {now - last_time:.2f} s")
+        last_time = now
+
+    base_entries, base_by_word = load_base_lexicon(args.base_lexicon)
+    vocab_words = load_vocab(args.vocab)
+    jargon_words = [line for line in read_lines(args.jargon) if line]
+    _mark("carga")
+
+    lexicon, oov_words, g2p_requests = assemble(vocab_words, base_entries, base_by_word, jargon_words)
+    write_lines(args.oov_out, oov_words)
+    write_lines(args.g2p_requests, g2p_requests)
+    _mark("OOV")
+
+    prons, num_transliterated = g2p_lexicon(g2p_requests, args.g2p_cache, args.nj)
+    g2p_lines = [f"{word} {prons[word]}" for word in g2p_requests]
+    write_lines(args.g2p_output, g2p_lines)
+    _mark(f"G2P ({num_transliterated} transliteradas)")
+
+    final_lexicon, before_final_clean = add_g2p_and_rest(lexicon, g2p_lines, base_entries)
+    write_lines(args.lexicon_out + '.before_final_clean', before_final_clean)
+    write_lines(args.lexicon_out, final_lexicon)
+    _mark("ensamblado")
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(f"  assemble_lexicon: base {len(base_entries)} entradas ({len(base_by_word)} palabras), "
+          f"vocabulario {len(vocab_words)}, OOV {len(oov_words)}, G2P {len(g2p_requests)}, "
+          f"lexicon.txt {len(final_lexicon)} entradas")
+    print(f"  assemble_lexicon: {time.time() - start_time:.2f} s ({', '.join(timings)}); "
+          f"memoria máxima {peak_rss_mb:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
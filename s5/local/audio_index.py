@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Índice persistente stem -> ubicación de los audios de un corpus.
+# data_prep.sh ejecutaba `find` una o dos veces por utterance sobre todo el árbol
+# extraído (coste O(utterances x archivos)). Aquí la fuente de audio se lista una sola vez,
+# el índice se guarda junto a ella (<fuente>.audio_index.tsv) y se reutiliza en ejecuciones
+# posteriores mientras el mtime de la fuente no cambie.
+#
+# La fuente puede ser:
+#   - un directorio extraído: se recorre en el orden de `find` y las ubicaciones son rutas;
+#   - un ZIP (es_*_female.zip, ...): solo se lee el directorio central del archivo, sin
+#     extraer nada, y las ubicaciones son nombres de miembro dentro del ZIP.
+#
+# Uso como script: local/audio_index.py [--rebuild] <dir_audio|archivo_zip>
+#   (construye o valida el índice e imprime un resumen)
+
+import argparse
+import os
+import sys
+import time
+import zipfile
+
+INDEX_SUFFIX = '.audio_index.tsv'
+INDEX_HEADER = '#audio_index v1'
+
+
+# --- Recorrido del árbol en el mismo orden que `find` ---
+# Preorden en orden de readdir, de modo que el primer archivo encontrado para un nombre
+# es el mismo que devolvía `find -print -quit`.
+def _walk_like_find(base_dir, rel_dir=''):
+    try:
+        entries = list(os.scandir(os.path.join(base_dir, rel_dir) if rel_dir else base_dir))
+    except OSError:
+        return
+    for entry in entries:
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk_like_find(base_dir, rel_path)
+        else:
+            yield entry.name, rel_path
+
+
+def is_zip_source(source):
+    return os.path.isfile(source) and zipfile.is_zipfile(source)
+
+
+def index_path_for(source):
+    # El índice va AL LADO de la fuente (no dentro), para no alterar su mtime.
+    return source.rstrip('/') + INDEX_SUFFIX
+
+
+def _source_mtime_ns(source):
+    try:
+        return os.stat(source).st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_entries(base_dir):
+    # Lista de (nombre, ruta_relativa) en orden de `find`
+    return list(_walk_like_find(base_dir))
+
+
+def scan_zip_entries(zip_path):
+    # Lista de (nombre, miembro) en el orden del directorio central del ZIP
+    with zipfile.ZipFile(zip_path) as zf:
+        return [(info.filename.rsplit('/', 1)[-1], info.filename)
+                for info in zf.infolist() if not info.is_dir()]
+
+
+def save_entries(index_path, mtime_ns, entries):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape') as f_out:
+        f_out.write(f"{INDEX_HEADER}\tmtime_ns={mtime_ns}\n")
+        f_out.write(''.join(f"{rel_path}\n" for _, rel_path in entries))
+    os.replace(tmp_path, index_path)
+
+
+def load_entries(index_path, mtime_ns):
+    # Devuelve la lista de entradas, o None si el índice no existe o está desactualizado
+    try:
+        with open(index_path, 'r', encoding='utf-8', errors='surrogateescape') as f_in:
+            header = f_in.readline().rstrip('\n')
+            if header != f"{INDEX_HEADER}\tmtime_ns={mtime_ns}":
+                return None
+            entries = []
+            for line in f_in:
+                rel_path = line.rstrip('\n')
+                if rel_path:
+                    entries.append((rel_path.rsplit('/', 1)[-1], rel_path))
+            return entries
+    except OSError:
+        return None
+
+
+class AudioIndex:
+    # by_name: nombre de archivo -> ubicación; by_stem: stem (antes del primer '.') -> ubicación.
+    # Ambos conservan la primera aparición. La ubicación es una ruta en disco
+    # (<dir>/<ruta_relativa>) o, si zip_path no es None, el nombre del miembro dentro del ZIP.
+    def __init__(self, source, entries, from_cache=False, is_zip=False):
+        self.source = source
+        self.zip_path = source if is_zip else None
+        self.from_cache = from_cache
+        self.by_name = {}
+        self.by_stem = {}
+        for name, rel_path in entries:
+            location = rel_path if is_zip else f"{source}/{rel_path}"
+            self.by_name.setdefault(name, location)
+            stem, dot, _ = name.partition('.')
+            if dot:
+                self.by_stem.setdefault(stem, location)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def find(self, audio_stem):
+        # Equivalente a: find -name "<stem>.wav", y si falla, find -name "<stem>.*"
+        return self.by_name.get(audio_stem + '.wav') or self.by_stem.get(audio_stem)
+
+
+def load_or_build(source, rebuild=False):
+    mtime_ns = _source_mtime_ns(source)
+    if mtime_ns is None:
+        return AudioIndex(source, [])
+    is_zip = is_zip_source(source)
+
+    index_path = index_path_for(source)
+    if not rebuild:
+        entries = load_entries(index_path, mtime_ns)
+        if entries is not None:
+            return AudioIndex(source, entries, from_cache=True, is_zip=is_zip)
+
+    entries = scan_zip_entries(source) if is_zip else scan_entries(source)
+    try:
+        save_entries(index_path, mtime_ns, entries)
+    except OSError as e:
+        sys.stderr.write(f"Advertencia (audio_index): No se pudo guardar el índice {index_path}: {e}\n")
+    return AudioIndex(source, entries, is_zip=is_zip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye (o reutiliza) el índice de audio de un directorio extraído o de un ZIP.")
+    parser.add_argument('--rebuild', action='store_true', help="Ignorar el índice guardado y volver a listar la fuente")
+    parser.add_argument('audio_source', help="Directorio base de los audios extraídos, o archivo ZIP de audio")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    audio_index = load_or_build(args.audio_source, rebuild=args.rebuild)
+    origin = "reutilizado" if audio_index.from_cache else "construido"
+    print(f"audio_index: {len(audio_index)} archivos en {args.audio_source} ({origin} en {time.time() - start_time:.2f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,22 @@
 #!/usr/bin/env bash
 
 # data_prep.sh para OpenSLR Spanish Datasets
-# Uso: local/data_prep.sh <ruta_a_databases_txt> <directorio_descarga_corpus>
+# Uso: local/data_prep.sh [--nj N] [--seed S] [--extract-zip true|false] <ruta_a_databases_txt> <directorio_descarga_corpus>
 
 export LC_ALL=C.UTF-8
 
+# Opciones
+nj=1   # Número de procesos para preparar los conjuntos corpus/género en paralelo
+seed=  # Semilla para barajar hablantes (vacía: aleatoria). Con la misma semilla, la
+       # salida es idéntica byte a byte para cualquier valor de --nj.
+extract_zip=false # false: los audios se leen directamente de los ZIP (wav.scp con unzip -p),
+                  # sin extraerlos; true: se extraen como antes y se busca en el directorio.
+
+. utils/parse_options.sh || exit 1
+
 if [ "$#" -ne 2 ]; then
-    echo "Uso: $0 <ruta_a_databases_txt> <directorio_descarga_corpus>"
-    echo "e.g.: local/data_prep.sh local/databases.txt Corpora"
+    echo "Uso: $0 [--nj N] [--seed S] [--extract-zip true|false] <ruta_a_databases_txt> <directorio_descarga_corpus>"
+    echo "e.g.: local/data_prep.sh --nj 8 --seed 777 local/databases.txt Corpora"
     exit 1
 fi
 
@@ -25,6 +34,7 @@ train_dir="$data_dir/train"
 dev_dir="$data_dir/dev"
 test_dir="$data_dir/test"
 local_dir="$data_dir/local_prep_tmp" # Archivos temporales por corpus antes de la división
+prep_jobs_file="$local_dir/prep_jobs.tsv" # Un trabajo por conjunto corpus/género para data_prep_engine.py
 
 # Crear directorios si no existen (mkdir -p se encarga de esto)
 mkdir -p "$corpus_download_dir" "$train_dir" "$dev_dir" "$test_dir" "$local_dir"
@@ -37,14 +47,6 @@ for dir_to_clean in "$train_dir" "$dev_dir" "$test_dir" "$local_dir"; do
   fi
 done
 
-# --- Función de Limpieza de Texto ---
-
-function normalize_text {
-    local text_input="$1"
-    echo "$text_input" | local/normalize_unicode.py
-
-}
-
 # --- Función para descargar archivos si es necesario ---
 function download_file_if_needed {
     local base_url="$1"  # URL del recurso (e.g., https://www.openslr.org/resources/72)
@@ -99,16 +101,18 @@ function extract_zip_if_needed {
     return 0 # Éxito
 }
 
-# --- Función Núcleo para procesar un archivo de índice TSV ---
+# --- Función Núcleo para registrar un archivo de índice TSV ---
+# El procesamiento en sí lo hace data_prep_engine.py para todos los conjuntos a la vez
+# (ver "Preparación de los conjuntos" más abajo), posiblemente en paralelo.
 function process_index_file_core {
     local tsv_file_path="$1"          # Ruta completa al archivo TSV
     local gender_tag="$2"             # 'f', 'm', o ''
-    local audio_search_base_path="$3" # Directorio base donde buscar los archivos de audio (después de extraer el ZIP)
+    local audio_search_base_path="$3" # Directorio de audio extraído, o el propio ZIP de audio
     local current_corpus_name="$4"    # Nombre del corpus (e.g., slr72_colombian)
     local speaker_id_prefix="$5"      # Prefijo para el ID de hablante (e.g., col)
 
     # ---- DEBUG ----
-    echo "      DEBUG (process_index_file_core): Iniciando para TSV: '$tsv_file_path'"
+    echo "      DEBUG (process_index_file_core): Registrando TSV: '$tsv_file_path'"
     echo "      DEBUG (process_index_file_core): Audio Search Base Path: '$audio_search_base_path'"
     echo "      DEBUG (process_index_file_core): Género Tag: '$gender_tag', Corpus: '$current_corpus_name', Prefijo: '$speaker_id_prefix'"
     # ---- FIN DEBUG ----
@@ -118,108 +122,8 @@ function process_index_file_core {
         return
     fi
 
-    local lines_processed=0 
-    local line_content
-
-    while IFS= read -r line_content || [[ -n "$line_content" ]]; do
-        if [[ -z "$line_content" ]]; then
-            if [[ "$lines_processed" -gt 0 ]]; then break; else continue; fi
-        fi
-
-        lines_processed=$((lines_processed + 1))
-
-        local audio_filename_in_tsv # Este será el stem del archivo, e.g., "cof_02436_01372133479"
-        local transcript
-
-        # Usar parameter expansion para obtener la primera palabra (nombre de archivo)
-        audio_filename_in_tsv="${line_content%%[[:space:]]*}"
-        # Usar parameter expansion para obtener el resto después del primer grupo de espacios (transcripción)
-        transcript="${line_content#*"$audio_filename_in_tsv"}"
-        # Quitar espacios al inicio de la transcripción
-        transcript="${transcript#"${transcript%%[![:space:]]*}"}"
-
-        if [[ -z "$audio_filename_in_tsv" ]] || [[ -z "$transcript" ]]; then
-            echo "        Advertencia (process_index_file_core): No se pudo parsear audio o transcripción de la línea '$line_content'. Saltando."
-            continue
-        fi
-
-        # --- INICIO DE SECCIÓN MODIFICADA ---
-        # Basado en el formato del TSV "cof_02436_01372133479 Transcripción..."
-        # audio_filename_in_tsv es ahora "cof_02436_01372133479"
-
-        local speaker_part_from_filename   # e.g., "02436"
-        local utterance_part_from_filename # e.g., "01372133479"
-
-        # Usar cut para extraer las partes del nombre del archivo.
-        # Asumimos que el delimitador es '_' y queremos la 2da y 3ra parte.
-        # El primer `cut -d'_' -f2-` quita la primera parte (e.g., "cof") -> "02436_01372133479"
-        # Luego, de eso, tomamos la primera parte para el hablante y la segunda para la elocución.
-        local remaining_parts=$(echo "$audio_filename_in_tsv" | cut -d'_' -f2-) # -> 02436_01372133479
-
-        speaker_part_from_filename=$(echo "$remaining_parts" | cut -d'_' -f1)   # -> 02436
-        utterance_part_from_filename=$(echo "$remaining_parts" | cut -d'_' -f2) # -> 01372133479
-
-        if [[ -z "$speaker_part_from_filename" ]] || [[ -z "$utterance_part_from_filename" ]]; then
-            echo "        Advertencia (process_index_file_core): No se pudo extraer speaker_part o utterance_part de '$audio_filename_in_tsv' (remaining_parts: '$remaining_parts'). Saltando."
-            continue
-        fi
-
-        # final_raw_speaker_id será la parte numérica del hablante
-        local final_raw_speaker_id="$speaker_part_from_filename"
-
-        local speaker_id="${speaker_id_prefix}_${gender_tag}_${final_raw_speaker_id}"
-        speaker_id=$(echo "$speaker_id" | sed 's/__\+/_/g' | sed 's/_$//' | sed 's/^_//') # Limpiar guiones bajos
-
-        if ! [[ " ${corpus_speakers_list[*]} " =~ " ${speaker_id} " ]]; then
-            corpus_speakers_list+=("$speaker_id")
-        fi
-
-        # El nombre del archivo en disco será audio_filename_in_tsv (que es el stem) + ".wav"
-        local filename_on_disk_with_wav="${audio_filename_in_tsv}.wav"
-
-        # El utterance_id se forma con el speaker_id completo y la parte de la elocución.
-        local utterance_id="${speaker_id}-${utterance_part_from_filename}" # Usar utterance_part_from_filename
-        utterance_id=$(echo "$utterance_id" | tr -cd '[:alnum:]_-')        # Limpiar para Kaldi
-
-        local normalized_transcript
-        normalized_transcript=$(normalize_text "$transcript")
-        if [ -z "$normalized_transcript" ]; then
-            echo "        Advertencia (process_index_file_core): Transcripción vacía para '$audio_filename_in_tsv' (Utt: '$utterance_id'), saltando."
-            continue
-        fi
-
-        local found_audio_path
-        # Buscar el archivo de audio: primero con .wav, luego con wildcard
-        found_audio_path=$(find "$audio_search_base_path" -name "$filename_on_disk_with_wav" -print -quit)
-        if [ -z "$found_audio_path" ]; then
-            found_audio_path=$(find "$audio_search_base_path" -name "${audio_filename_in_tsv}.*" -print -quit)
-            if [ -z "$found_audio_path" ]; then
-                echo "        Advertencia (process_index_file_core): Audio '${audio_filename_in_tsv}.[wav|*]' no encontrado en '$audio_search_base_path' (Utt: '$utterance_id'), saltando."
-                continue
-            fi
-        fi
-
-        echo "$utterance_id $normalized_transcript" >>"$local_dir/${current_corpus_name}.text"
-        echo "$utterance_id sox \"$found_audio_path\" -r 16000 -b 16 -c 1 -t wav - |" >>"$local_dir/${current_corpus_name}.wav.scp"
-        echo "$utterance_id $speaker_id" >>"$local_dir/${current_corpus_name}.utt2spk"
-        if [[ -n "$gender_tag" ]]; then
-            echo "$speaker_id $gender_tag" >>"$local_dir/${current_corpus_name}.spk2gender"
-        fi
-    done <"$tsv_file_path"
-
-    if [ "$lines_processed" -eq 0 ] && [ -s "$tsv_file_path" ]; then
-        echo "      ERROR CRÍTICO (process_index_file_core): No se procesó ninguna línea del TSV '$tsv_file_path' aunque el archivo tiene contenido. Revisar formato de TSV y comando read."
-    elif [ "$lines_processed" -eq 0 ]; then
-        echo "      DEBUG (process_index_file_core): No se procesó ninguna línea del TSV '$tsv_file_path' (archivo podría estar vacío)."
-    else
-        echo "      DEBUG (process_index_file_core): Se leyeron $lines_processed líneas del TSV '$tsv_file_path'."
-    fi
-    echo "    DEBUG (process_index_file_core): Muestra de $local_dir/${current_corpus_name}.text (primeras 5):"
-    head -n 5 "$local_dir/${current_corpus_name}.text"
-    echo "    DEBUG (process_index_file_core): Muestra de $local_dir/${current_corpus_name}.utt2spk (primeras 5):"
-    head -n 5 "$local_dir/${current_corpus_name}.utt2spk"
-
-    echo "      DEBUG (process_index_file_core): Finalizado. Hablantes acumulados para $current_corpus_name: ${#corpus_speakers_list[@]}"
+    printf '%s\t%s\t%s\t%s\t%s\n' "$current_corpus_name" "$gender_tag" "$speaker_id_prefix" \
+        "$tsv_file_path" "$audio_search_base_path" >>"$prep_jobs_file"
 }
 
 # --- Función para gestionar descarga, extracción y procesamiento para un conjunto de audio (e.g., female o male) ---
@@ -251,16 +155,24 @@ function process_single_audio_set {
     # Descargar archivo de audio ZIP
     download_file_if_needed "$base_url" "$audio_zip_name" "$corpus_dataset_path/$audio_zip_name" || return 1
 
-    # Definir directorio de extracción para este ZIP específico
-    local audio_extract_target_dir="$corpus_dataset_path/extracted_audio_$(basename "$audio_zip_name" .zip)"
+    local audio_source="$corpus_dataset_path/$audio_zip_name"
+    if [ "$extract_zip" == "true" ]; then
+        # Definir directorio de extracción para este ZIP específico
+        local audio_extract_target_dir="$corpus_dataset_path/extracted_audio_$(basename "$audio_zip_name" .zip)"
 
-    # Extraer el ZIP de audio
-    extract_zip_if_needed "$corpus_dataset_path/$audio_zip_name" "$audio_extract_target_dir" || return 1
+        # Extraer el ZIP de audio
+        extract_zip_if_needed "$corpus_dataset_path/$audio_zip_name" "$audio_extract_target_dir" || return 1
+        audio_source="$audio_extract_target_dir"
+    else
+        # Sin extracción: el índice se construye con el directorio central del ZIP y
+        # wav.scp lee cada audio desde el ZIP mediante una tubería.
+        echo "    Usando $audio_source directamente (sin extraer)."
+    fi
 
-    # Procesar el archivo de índice, buscando audios en el directorio de extracción
+    # Procesar el archivo de índice, buscando audios en el directorio extraído o en el ZIP
     process_index_file_core "$corpus_dataset_path/$index_tsv_name" \
         "$gender_tag_for_spk_id" \
-        "$audio_extract_target_dir" \
+        "$audio_source" \
         "$current_corpus_name" \
         "$speaker_id_prefix"
 
@@ -280,7 +192,7 @@ function handle_corpus_section {
     local corpus_dataset_path="$corpus_download_dir/$current_corpus_name" 
 
     mkdir -p "$corpus_dataset_path"
-    corpus_speakers_list=() # IMPORTANTE: Resetear la lista de hablantes para cada corpus
+    processed_corpora+=("$current_corpus_name")
 
     echo "  URL: $url, Prefijo: $prefix, Tipo Género: $gender_type"
 
@@ -311,14 +223,35 @@ function handle_corpus_section {
         echo "  Error: Tipo de género '$gender_type' no reconocido para $current_corpus_name."
         return 1 # Indicar error
     fi
+}
+
+# --- División Train/Dev/Test por Hablante para un corpus ya preparado ---
+function split_corpus_speakers {
+    local current_corpus_name="$1"
+    local corpus_speakers_list=()
+
+    # Hablantes del corpus en orden de aparición (female y luego male)
+    if [ -f "$local_dir/${current_corpus_name}.speakers" ]; then
+        mapfile -t corpus_speakers_list <"$local_dir/${current_corpus_name}.speakers"
+    fi
+
+    if [ -f "$local_dir/${current_corpus_name}.text" ]; then
+        echo "    DEBUG (split_corpus_speakers): Muestra de $local_dir/${current_corpus_name}.text (primeras 5):"
+        head -n 5 "$local_dir/${current_corpus_name}.text"
+        echo "    DEBUG (split_corpus_speakers): Muestra de $local_dir/${current_corpus_name}.utt2spk (primeras 5):"
+        head -n 5 "$local_dir/${current_corpus_name}.utt2spk"
+    fi
 
-    # --- División Train/Dev/Test por Hablante para este corpus ---
     if [ ${#corpus_speakers_list[@]} -eq 0 ]; then
         echo "  Advertencia: No se procesaron hablantes para el corpus $current_corpus_name. Saltando división."
     else
         echo "  Dividiendo ${#corpus_speakers_list[@]} hablantes de $current_corpus_name en train/dev/test..."
         local shuffled_speakers
-        shuffled_speakers=($(shuf -e "${corpus_speakers_list[@]}"))
+        if [ -n "$seed" ]; then
+            shuffled_speakers=($(printf '%s\n' "${corpus_speakers_list[@]}" | utils/shuffle_list.pl --srand "$seed"))
+        else
+            shuffled_speakers=($(shuf -e "${corpus_speakers_list[@]}"))
+        fi
 
         local num_total_spk=${#shuffled_speakers[@]}
         local num_train_spk=$((num_total_spk * train_percent / 100))
@@ -374,9 +307,11 @@ function handle_corpus_section {
     fi
 }
 
-# --- Bucle Principal para Procesar databases.txt ---
+# --- Bucle Principal para Procesar databases.txt (descarga, extracción y registro) ---
 current_section_name=""
 declare -A db_info # Array asociativo para la información de la sección actual
+processed_corpora=() # Corpus en el orden de databases.txt
+: >"$prep_jobs_file"
 
 while IFS= read -r line || [[ -n "$line" ]]; do
     line=$(echo "$line" | tr -d '\r' | sed 's/#.*//') # Eliminar CR y comentarios
@@ -400,6 +335,22 @@ if [[ -n "$current_section_name" ]]; then
     handle_corpus_section "$current_section_name" # db_info es global aquí
 fi
 
+# --- Preparación de los conjuntos corpus/género ---
+# Cada conjunto se procesa en su propio worker (hasta --nj a la vez) y los resultados se
+# fusionan en el orden de $prep_jobs_file, de modo que $local_dir/<corpus>.* es idéntico
+# al de una ejecución secuencial.
+if [ -s "$prep_jobs_file" ]; then
+    echo "Preparando $(wc -l <"$prep_jobs_file") conjuntos corpus/género con $nj proceso(s)..."
+    python3 local/data_prep_engine.py --nj "$nj" --jobs-file "$prep_jobs_file" --output-dir "$local_dir" || {
+        echo "Error: data_prep_engine.py falló."
+        exit 1
+    }
+fi
+
+for corpus_name in "${processed_corpora[@]}"; do
+    split_corpus_speakers "$corpus_name"
+done
+
 # --- Finalización: Crear spk2utt y validar directorios ---
 echo "Finalizando archivos globales..."
 for set_dir_path in "$train_dir" "$dev_dir" "$test_dir"; do
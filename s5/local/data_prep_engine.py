@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Motor de preparación de datos para un archivo line_index TSV de OpenSLR.
+# Sustituye el bucle por línea de process_index_file_core (data_prep.sh), que lanzaba
+# un proceso de normalize_unicode.py, varios cut/sed/tr y dos find por cada utterance.
+# Aquí se lee el TSV completo en una sola pasada y se escriben text, wav.scp, utt2spk
+# y spk2gender en bloque, con la misma lógica de IDs que el script de bash. Los audios se
+# buscan en el índice persistente de local/audio_index.py (un solo recorrido por corpus);
+# si la fuente de audio es el ZIP del corpus, wav.scp lee cada audio del ZIP con unzip -p.
+#
+# Uso: local/data_prep_engine.py [--gender f|m] [--prefix col] <tsv> <dir_audio> <prefijo_salida>
+#   <prefijo_salida> es, por ejemplo, data/local_prep_tmp/slr72_colombian; se AÑADE a
+#   <prefijo_salida>.text, .wav.scp, .utt2spk, .spk2gender y .speakers (lista de hablantes
+#   en orden de aparición, usada por data_prep.sh para la división train/dev/test).
+#
+#   local/data_prep_engine.py --nj N --jobs-file <prep_jobs.tsv> --output-dir <dir>
+#   Procesa todos los conjuntos corpus/género de la lista (uno por worker) y fusiona los
+#   resultados en <dir>/<corpus>.* siguiendo el orden de la lista.
+
+import argparse
+import concurrent.futures
+import os
+import re
+import sys
+import time
+
+try:
+    from normalize_unicode import normalize_word_for_kaldi_lexicon
+    import audio_index
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from normalize_unicode import normalize_word_for_kaldi_lexicon
+    import audio_index
+
+# [[:space:]] de bash bajo LC_ALL=C.UTF-8 (solo espacios ASCII)
+_BASH_SPACE_RE = re.compile(r'[ \t\n\v\f\r]')
+_LEADING_SPACE_RE = re.compile(r'^[ \t\n\v\f\r]+')
+_MULTI_UNDERSCORE_RE = re.compile(r'__+')
+# tr -cd '[:alnum:]_-' (tr trabaja por bytes, así que [:alnum:] es solo ASCII)
+_NON_KALDI_ID_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+# --- Lógica de IDs (idéntica a process_index_file_core) ---
+def split_tsv_line(line_content):
+    # audio="${line%%[[:space:]]*}"; transcript = resto sin espacios iniciales
+    match = _BASH_SPACE_RE.search(line_content)
+    if match is None:
+        return line_content, ''
+    audio_stem = line_content[:match.start()]
+    transcript = _LEADING_SPACE_RE.sub('', line_content[match.start():])
+    return audio_stem, transcript
+
+
+def _cut_field(text, field_spec):
+    # Emula `cut -d'_' -f<N>` y `-f<N>-`: sin delimitador, cut devuelve la línea completa.
+    if '_' not in text:
+        return text
+    parts = text.split('_')
+    if field_spec.endswith('-'):
+        return '_'.join(parts[int(field_spec[:-1]) - 1:])
+    index = int(field_spec) - 1
+    return parts[index] if index < len(parts) else ''
+
+
+def speaker_and_utterance_parts(audio_stem):
+    # "cof_02436_01372133479" -> ("02436", "01372133479")
+    remaining_parts = _cut_field(audio_stem, '2-')
+    return _cut_field(remaining_parts, '1'), _cut_field(remaining_parts, '2')
+
+
+def make_speaker_id(speaker_id_prefix, gender_tag, raw_speaker_id):
+    speaker_id = f"{speaker_id_prefix}_{gender_tag}_{raw_speaker_id}"
+    speaker_id = _MULTI_UNDERSCORE_RE.sub('_', speaker_id)
+    if speaker_id.endswith('_'):
+        speaker_id = speaker_id[:-1]
+    if speaker_id.startswith('_'):
+        speaker_id = speaker_id[1:]
+    return speaker_id
+
+
+def make_utterance_id(speaker_id, utterance_part):
+    return _NON_KALDI_ID_RE.sub('', f"{speaker_id}-{utterance_part}")
+
+
+# --- Entrada de wav.scp ---
+_UNZIP_WILDCARDS = str.maketrans({'[': '[[]', '*': '[*]', '?': '[?]'})
+
+
+def wav_scp_command(audio_files, location):
+    if audio_files.zip_path is None:
+        return f"sox \"{location}\" -r 16000 -b 16 -c 1 -t wav - |"
+    # Audio leído directamente del ZIP a través de una tubería (sin extraer el archivo).
+    # unzip interpreta el nombre del miembro como patrón, así que se escapan sus comodines.
+    audio_type = location.rsplit('.', 1)[-1].lower()
+    member_pattern = location.translate(_UNZIP_WILDCARDS)
+    return (f"unzip -p \"{audio_files.zip_path}\" \"{member_pattern}\" | "
+            f"sox -t {audio_type} - -r 16000 -b 16 -c 1 -t wav - |")
+
+
+def normalize_transcript(transcript):
+    # Igual que `echo "$transcript" | local/normalize_unicode.py`
+    return normalize_word_for_kaldi_lexicon(transcript.strip())
+
+
+# --- Procesamiento de un TSV completo ---
+def process_index_file(tsv_file_path, gender_tag, audio_files, speaker_id_prefix, known_speakers=None, log=print):
+    # Devuelve (filas, hablantes_nuevos, lineas_leidas). Cada fila es
+    # (utt_id, texto_normalizado, comando_wav_scp, speaker_id).
+    known_speakers = set(known_speakers or ())
+    new_speakers = []
+    rows = []
+    lines_processed = 0
+
+    with open(tsv_file_path, 'r', encoding='utf-8', errors='surrogateescape', newline='\n') as f_in:
+        for line_content in f_in:
+            if line_content.endswith('\n'):
+                line_content = line_content[:-1]
+            if not line_content:
+                # El bucle de bash termina en la primera línea vacía tras haber leído datos
+                if lines_processed > 0:
+                    break
+                continue
+
+            lines_processed += 1
+
+            audio_stem, transcript = split_tsv_line(line_content)
+            if not audio_stem or not transcript:
+                log(f"        Advertencia (data_prep_engine): No se pudo parsear audio o transcripción de la línea '{line_content}'. Saltando.")
+                continue
+
+            speaker_part, utterance_part = speaker_and_utterance_parts(audio_stem)
+            if not speaker_part or not utterance_part:
+                log(f"        Advertencia (data_prep_engine): No se pudo extraer speaker_part o utterance_part de '{audio_stem}'. Saltando.")
+                continue
+
+            speaker_id = make_speaker_id(speaker_id_prefix, gender_tag, speaker_part)
+            if speaker_id not in known_speakers:
+                known_speakers.add(speaker_id)
+                new_speakers.append(speaker_id)
+
+            utterance_id = make_utterance_id(speaker_id, utterance_part)
+
+            normalized_transcript = normalize_transcript(transcript)
+            if not normalized_transcript:
+                log(f"        Advertencia (data_prep_engine): Transcripción vacía para '{audio_stem}' (Utt: '{utterance_id}'), saltando.")
+                continue
+
+            found_audio_path = audio_files.find(audio_stem)
+            if not found_audio_path:
+                log(f"        Advertencia (data_prep_engine): Audio '{audio_stem}.[wav|*]' no encontrado (Utt: '{utterance_id}'), saltando.")
+                continue
+
+            rows.append((utterance_id, normalized_transcript,
+                         wav_scp_command(audio_files, found_audio_path), speaker_id))
+
+    return rows, new_speakers, lines_processed
+
+
+def read_speaker_list(speakers_path):
+    if not os.path.exists(speakers_path):
+        return []
+    with open(speakers_path, 'r', encoding='utf-8', errors='surrogateescape') as f_in:
+        return [line.rstrip('\n') for line in f_in if line.strip()]
+
+
+def write_outputs(output_prefix, rows, new_speakers, gender_tag):
+    # Escritura en bloque (modo append, como los >> de data_prep.sh)
+    def _append(suffix, lines):
+        with open(output_prefix + suffix, 'a', encoding='utf-8', errors='surrogateescape') as f_out:
+            f_out.write(''.join(lines))
+
+    _append('.text', [f"{utt} {text}\n" for utt, text, _, _ in rows])
+    _append('.wav.scp', [f"{utt} {wav_command}\n" for utt, _, wav_command, _ in rows])
+    _append('.utt2spk', [f"{utt} {spk}\n" for utt, _, _, spk in rows])
+    if gender_tag:
+        # Un registro por hablante con utterances (el bash repetía uno por utterance y
+        # luego deduplicaba con sort -u)
+        speakers_with_utts = dict.fromkeys(spk for _, _, _, spk in rows)
+        _append('.spk2gender', [f"{spk} {gender_tag}\n" for spk in speakers_with_utts])
+    _append('.speakers', [f"{spk}\n" for spk in new_speakers])
+
+
+# --- Un conjunto corpus/género completo (unidad de trabajo de cada worker) ---
+class PrepJob:
+    def __init__(self, corpus, gender, prefix, tsv_file, audio_dir):
+        self.corpus = corpus
+        self.gender = gender
+        self.prefix = prefix
+        self.tsv_file = tsv_file
+        self.audio_dir = audio_dir
+
+
+def read_jobs_file(jobs_path):
+    # Formato (TSV): corpus, género, prefijo, ruta_tsv, dir_audio
+    jobs = []
+    with open(jobs_path, 'r', encoding='utf-8', errors='surrogateescape') as f_in:
+        for line in f_in:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue
+            jobs.append(PrepJob(*fields))
+    return jobs
+
+
+def prepare_set(job, rebuild_index=False):
+    # Se ejecuta en un worker: no escribe nada, devuelve filas y mensajes para que el
+    # proceso principal los vuelque en orden.
+    messages = []
+    if not os.path.isfile(job.tsv_file):
+        messages.append(f"      Advertencia (data_prep_engine): Archivo de índice no encontrado para procesar: {job.tsv_file}")
+        return [], [], messages
+
+    start_time = time.time()
+    audio_files = audio_index.load_or_build(job.audio_dir, rebuild=rebuild_index)
+    index_time = time.time() - start_time
+
+    rows, new_speakers, lines_processed = process_index_file(
+        job.tsv_file, job.gender, audio_files, job.prefix, log=messages.append)
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    if lines_processed == 0 and os.path.getsize(job.tsv_file) > 0:
+        messages.append(f"      ERROR CRÍTICO (data_prep_engine): No se procesó ninguna línea del TSV '{job.tsv_file}' aunque el archivo tiene contenido.")
+    messages.append(
+        f"      data_prep_engine [{job.corpus}/{job.gender}]: {lines_processed} líneas leídas, {len(rows)} utterances "
+        f"en {elapsed:.2f} s ({lines_processed / elapsed:.1f} líneas/s; índice de audio "
+        f"{'reutilizado' if audio_files.from_cache else 'construido'}: {len(audio_files)} archivos en {index_time:.2f} s)")
+    return rows, new_speakers, messages
+
+
+def run_jobs(jobs, output_dir, nj=1, rebuild_index=False):
+    # Prepara cada conjunto (en paralelo si nj > 1) y fusiona los resultados en el orden
+    # de la lista de trabajos: la salida no depende de nj ni del orden de finalización.
+    start_time = time.time()
+    known_speakers = {}
+    total_utts = 0
+
+    if nj > 1 and len(jobs) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(nj, len(jobs)))
+        results = executor.map(prepare_set, jobs, [rebuild_index] * len(jobs))
+    else:
+        executor = None
+        results = (prepare_set(job, rebuild_index) for job in jobs)
+
+    try:
+        for job, (rows, new_speakers, messages) in zip(jobs, results):
+            for message in messages:
+                print(message)
+            corpus_speakers = known_speakers.setdefault(job.corpus, set())
+            new_speakers = [spk for spk in new_speakers if spk not in corpus_speakers]
+            corpus_speakers.update(new_speakers)
+            write_outputs(os.path.join(output_dir, job.corpus), rows, new_speakers, job.gender)
+            total_utts += len(rows)
+            sys.stdout.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"    data_prep_engine: {len(jobs)} conjuntos, {total_utts} utterances en {elapsed:.2f} s "
+          f"({total_utts / elapsed:.1f} utterances/s, nj={nj})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Procesa un line_index TSV de OpenSLR en una sola pasada y añade "
+                    "text/wav.scp/utt2spk/spk2gender al prefijo de salida. Con --jobs-file "
+                    "procesa varios conjuntos corpus/género, opcionalmente en paralelo.")
+    parser.add_argument('--gender', default='', help="Etiqueta de género para el ID de hablante ('f', 'm' o '')")
+    parser.add_argument('--prefix', default='', help="Prefijo para el ID de hablante (e.g., col)")
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help="Ignorar el índice de audio guardado junto al directorio y volver a construirlo")
+    parser.add_argument('--jobs-file', help="Lista de conjuntos (TSV: corpus, género, prefijo, ruta_tsv, dir_audio|zip)")
+    parser.add_argument('--output-dir', help="Con --jobs-file: directorio donde se escriben <corpus>.text, etc.")
+    parser.add_argument('--nj', type=int, default=1, help="Con --jobs-file: número de procesos en paralelo")
+    parser.add_argument('tsv_file', nargs='?', help="Archivo line_index TSV")
+    parser.add_argument('audio_dir', nargs='?', help="Directorio base donde buscar los archivos de audio, o ZIP de audio")
+    parser.add_argument('output_prefix', nargs='?', help="Prefijo de los archivos de salida (e.g., data/local_prep_tmp/slr72_colombian)")
+    args = parser.parse_args()
+
+    if args.jobs_file:
+        if not args.output_dir:
+            parser.error("--jobs-file requiere --output-dir")
+        run_jobs(read_jobs_file(args.jobs_file), args.output_dir, max(args.nj, 1), args.rebuild_index)
+        return 0
+    if not (args.tsv_file and args.audio_dir and args.output_prefix):
+        parser.error("se requieren <tsv> <dir_audio> <prefijo_salida> (o --jobs-file)")
+
+    job = PrepJob(os.path.basename(args.output_prefix), args.gender, args.prefix, args.tsv_file, args.audio_dir)
+    rows, new_speakers, messages = prepare_set(job, args.rebuild_index)
+    for message in messages:
+        print(message)
+    known_speakers = set(read_speaker_list(args.output_prefix + '.speakers'))
+    new_speakers = [spk for spk in new_speakers if spk not in known_speakers]
+    write_outputs(args.output_prefix, rows, new_speakers, args.gender)
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
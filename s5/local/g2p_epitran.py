@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import epitran
+# Uso: cat palabras.txt | local/g2p_epitran.py [--cache <g2p_cache.tsv>] [--nj N] > lexicon_g2p.txt
+#   --cache: caché persistente de pronunciaciones. Cada entrada está indexada por
+#            (palabra, versión de IPA_TO_KALDI_MAP, versión de Epitran), así que al añadir
+#            jerga solo se transliteran las palabras nuevas.
+#   --nj:    reparte las palabras no cacheadas entre N procesos.
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
 import unicodedata # Necesario para normalize_word_for_epitran si se usa NFD
 import re          # Necesario para normalize_word_for_epitran si se usa sub
 import sys
+try:
+    from ipa_segmenter import IpaSegmenter
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from ipa_segmenter import IpaSegmenter
 
 # --- FUNCIÓN DE PREPARACIÓN DE PALABRA PARA EPITRAN ---
 # Esta función toma la palabra que viene de combined_oov_for_g2p.txt.
@@ -51,6 +65,15 @@ IPA_TO_KALDI_MAP = {
     '7': 's i e t e', '8': 'o ch o', '9': 'n u e b e',
 }
 
+# Segmentador compilado una sola vez (coincidencia más larga primero)
+IPA_SEGMENTER = IpaSegmenter(IPA_TO_KALDI_MAP)
+
+# Subir este número si cambian las heurísticas R/RR o la segmentación: invalida la caché
+# igual que un cambio en IPA_TO_KALDI_MAP.
+G2P_RULES_REVISION = 1
+IPA_MAP_VERSION = hashlib.sha1(
+    repr((G2P_RULES_REVISION, sorted(IPA_TO_KALDI_MAP.items()))).encode('utf-8')).hexdigest()[:12]
+
 # --- HEURÍSTICAS R/RR (DEBE SER LA MISMA QUE PERFECCIONASTE EN test_epitran.py) ---
 def apply_r_rr_kaldi_heuristics(original_word_upper, kaldi_phoneme_list):
     processed_phonemes = list(kaldi_phoneme_list)
@@ -85,67 +108,141 @@ def apply_r_rr_kaldi_heuristics(original_word_upper, kaldi_phoneme_list):
 
 # --- FUNCIÓN PRINCIPAL DE CONVERSIÓN IPA A KALDI ---
 def ipa_string_to_kaldi_phonemes(word_for_kaldi_lexicon, ipa_string, original_word_for_heuristics):
-    kaldi_phonemes = []
     if not ipa_string:
         return "spn"
 
-    sorted_ipa_keys = sorted(IPA_TO_KALDI_MAP.keys(), key=len, reverse=True)
-    
-    idx = 0
-    while idx < len(ipa_string):
-        found_match = False
-        for ipa_key in sorted_ipa_keys:
-            if ipa_string.startswith(ipa_key, idx):
-                kaldi_equivalent = IPA_TO_KALDI_MAP[ipa_key]
-                if kaldi_equivalent: 
-                    kaldi_phonemes.extend(kaldi_equivalent.split())
-                idx += len(ipa_key)
-                found_match = True
-                break
-        if not found_match:
-            unmapped_char = ipa_string[idx]
-            kaldi_phonemes.append("spn")
-            idx += 1
-            
+    kaldi_phonemes = IPA_SEGMENTER.segment(ipa_string)
+
     kaldi_phonemes_after_r_rr_heuristics = apply_r_rr_kaldi_heuristics(original_word_for_heuristics, kaldi_phonemes)
     
     final_kaldi_string = " ".join(p for p in kaldi_phonemes_after_r_rr_heuristics if p)
     return final_kaldi_string if final_kaldi_string else "spn"
 
-# --- BLOQUE MAIN ---
-if __name__ == "__main__":
+# --- EPITRAN Y CONVERSIÓN DE UNA PALABRA ---
+def epitran_version():
     try:
-        epi = epitran.Epitran('spa-Latn')
+        from importlib.metadata import version
+        return version('epitran')
+    except Exception:
+        return 'desconocida'
+
+
+def load_epitran():
+    import epitran
+    try:
+        return epitran.Epitran('spa-Latn')
     except Exception as e:
         sys.stderr.write(f"Error inicializando Epitran: {e}\n")
         sys.stderr.write("Asegúrate de haber instalado los modelos: python -m epitran_scripts.download 'spa-Latn'\n")
         sys.exit(1)
 
-    for line_stdin in sys.stdin:
-        # La palabra de entrada (word_key_for_lexicon) ya viene normalizada 
-        # (MAYÚSCULAS, sin acentos, Ñ->N, Ü->U, etc.) 
-        # desde lang_prep.sh
-        word_key_for_lexicon = line_stdin.strip()
-        if not word_key_for_lexicon:
-            continue
-        
-        # La palabra que se pasa a Epitran y a la heurística R/RR.
-        word_for_epitran_and_r_rr = prepare_word_for_epitran(word_key_for_lexicon)
-            
-        if not word_for_epitran_and_r_rr: # Si la preparación la deja vacía
-            sys.stdout.write(f"{word_key_for_lexicon} spn\n")
-            continue
-
-        try:
-            ipa_direct_string = epi.transliterate(word_for_epitran_and_r_rr)
-            kaldi_phonemes_str = ipa_string_to_kaldi_phonemes(
-                word_key_for_lexicon, 
-                ipa_direct_string, 
-                word_for_epitran_and_r_rr # Pasar la misma palabra usada para transliterar a la heurística
-            )
-            
-            sys.stdout.write(f"{word_key_for_lexicon} {kaldi_phonemes_str}\n")
 
-        except Exception as e:
-            sys.stderr.write(f"Error G2P procesando palabra '{word_key_for_lexicon}': {e}\n")
-            sys.stdout.write(f"{word_key_for_lexicon} spn\n") # Fallback
\ No newline at end of file
+def word_to_kaldi_phonemes(epi, word_key_for_lexicon):
+    # Devuelve (pronunciación, cacheable). Los fallos vuelven a 'spn' y no se cachean.
+    # La palabra que se pasa a Epitran y a la heurística R/RR.
+    word_for_epitran_and_r_rr = prepare_word_for_epitran(word_key_for_lexicon)
+    if not word_for_epitran_and_r_rr: # Si la preparación la deja vacía
+        return "spn", True
+    try:
+        ipa_direct_string = epi.transliterate(word_for_epitran_and_r_rr)
+        kaldi_phonemes_str = ipa_string_to_kaldi_phonemes(
+            word_key_for_lexicon,
+            ipa_direct_string,
+            word_for_epitran_and_r_rr # Pasar la misma palabra usada para transliterar a la heurística
+        )
+        return kaldi_phonemes_str, True
+    except Exception as e:
+        sys.stderr.write(f"Error G2P procesando palabra '{word_key_for_lexicon}': {e}\n")
+        return "spn", False # Fallback
+
+
+# --- CACHÉ PERSISTENTE ---
+# Archivo TSV de solo-añadir: palabra, versión del mapa, versión de Epitran, pronunciación.
+# Las entradas de otras versiones se ignoran al cargar.
+def load_g2p_cache(cache_path, map_version, epi_version):
+    cache = {}
+    if not cache_path or not os.path.exists(cache_path):
+        return cache
+    with open(cache_path, 'r', encoding='utf-8') as f_in:
+        for line in f_in:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 4 and fields[1] == map_version and fields[2] == epi_version:
+                cache[fields[0]] = fields[3]
+    return cache
+
+
+def append_g2p_cache(cache_path, map_version, epi_version, entries):
+    if not cache_path or not entries:
+        return
+    with open(cache_path, 'a', encoding='utf-8') as f_out:
+        f_out.write(''.join(f"{word}\t{map_version}\t{epi_version}\t{pron}\n" for word, pron in entries))
+
+
+# --- CONVERSIÓN EN PARALELO ---
+_worker_epi = None
+# Inicializar Epitran cuesta varios segundos por proceso, mientras que transliterar una
+# palabra cuesta decenas de microsegundos: solo se reparte si cada proceso recibe bastantes.
+MIN_WORDS_PER_WORKER = 20000
+
+
+def _init_worker():
+    global _worker_epi
+    _worker_epi = load_epitran()
+
+
+def _transcribe_shard(words):
+    return [(word,) + word_to_kaldi_phonemes(_worker_epi, word) for word in words]
+
+
+def transcribe_words(words, nj=1):
+    # Devuelve [(palabra, pronunciación, cacheable)] en el mismo orden que `words`
+    if not words:
+        return []
+    nj = min(nj, len(words) // MIN_WORDS_PER_WORKER)
+    if nj <= 1:
+        epi = load_epitran()
+        return [(word,) + word_to_kaldi_phonemes(epi, word) for word in words]
+    # Fragmentos contiguos, uno por proceso, para conservar el orden al reunirlos
+    shard_size = (len(words) + nj - 1) // nj
+    shards = [words[i:i + shard_size] for i in range(0, len(words), shard_size)]
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nj, initializer=_init_worker) as executor:
+        for shard_result in executor.map(_transcribe_shard, shards):
+            results.extend(shard_result)
+    return results
+
+
+def g2p_lexicon(words, cache_path=None, nj=1):
+    # Pronunciaciones para `words` (palabras únicas) usando la caché; solo se
+    # transliteran las que faltan. Devuelve (dict palabra -> pronunciación, nº transliteradas).
+    epi_version = epitran_version()
+    cache = load_g2p_cache(cache_path, IPA_MAP_VERSION, epi_version)
+    pending = [word for word in dict.fromkeys(words) if word not in cache]
+    new_entries = []
+    prons = dict(cache)
+    for word, pron, cacheable in transcribe_words(pending, nj):
+        prons[word] = pron
+        if cacheable:
+            new_entries.append((word, pron))
+    append_g2p_cache(cache_path, IPA_MAP_VERSION, epi_version, new_entries)
+    return prons, len(pending)
+
+
+# --- BLOQUE MAIN ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="G2P con Epitran: lee palabras normalizadas por stdin y escribe 'PALABRA fonemas'.")
+    parser.add_argument('--cache', default=None, help="Archivo de caché persistente de pronunciaciones (TSV)")
+    parser.add_argument('--nj', type=int, default=1, help="Número de procesos para transliterar las palabras no cacheadas")
+    args = parser.parse_args()
+
+    # La palabra de entrada (word_key_for_lexicon) ya viene normalizada
+    # (MAYÚSCULAS, sin acentos, Ñ->N, Ü->U, etc.)
+    # desde lang_prep.sh
+    input_words = [line.strip() for line in sys.stdin]
+    input_words = [word for word in input_words if word]
+
+    prons, num_transliterated = g2p_lexicon(input_words, args.cache, args.nj)
+    sys.stdout.write(''.join(f"{word} {prons[word]}\n" for word in input_words))
+    num_unique = len(set(input_words))
+    sys.stderr.write(f"g2p_epitran.py: {num_unique} palabras únicas, {num_transliterated} transliteradas, "
+                     f"{num_unique - num_transliterated} desde caché (mapa {IPA_MAP_VERSION}, Epitran {epitran_version()})\n")
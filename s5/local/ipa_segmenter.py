@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Segmentador IPA -> fonemas Kaldi compartido por g2p_epitran.py y test_epitran.py.
+# La versión anterior reordenaba las claves del mapa en cada llamada y probaba todas con
+# startswith en cada posición (O(longitud x claves) por palabra). Aquí el mapa se compila
+# una sola vez en una alternancia de expresiones regulares ordenada por longitud
+# (coincidencia más larga primero, igual que antes) más un comodín final de un carácter
+# para los símbolos no mapeados, de modo que una palabra se segmenta con un solo finditer.
+#
+# Uso como script: local/ipa_segmenter.py [--words N] [--repeat R]
+#   micro-benchmark del coste por palabra (implementación anterior vs. compilada) con el
+#   mapa de g2p_epitran.py; también comprueba que ambas salidas sean idénticas.
+
+import argparse
+import re
+import sys
+import time
+
+
+class IpaSegmenter:
+    def __init__(self, ipa_to_kaldi_map):
+        # Mismo orden de prueba que sorted(keys, key=len, reverse=True): más largas primero,
+        # y a igual longitud, el orden del diccionario.
+        sorted_ipa_keys = sorted(ipa_to_kaldi_map.keys(), key=len, reverse=True)
+        alternation = '|'.join(re.escape(ipa_key) for ipa_key in sorted_ipa_keys)
+        self._pattern = re.compile(f"(?:{alternation})|(.)", re.DOTALL)
+        # Equivalente Kaldi ya partido en fonemas ('' -> lista vacía)
+        self._phonemes = {ipa_key: kaldi.split() for ipa_key, kaldi in ipa_to_kaldi_map.items()}
+
+    def segment(self, ipa_string, on_unmapped=None):
+        # Devuelve la lista de fonemas Kaldi. Cada carácter no mapeado produce 'spn' y,
+        # si se indica, una llamada on_unmapped(carácter).
+        kaldi_phonemes = []
+        phonemes = self._phonemes
+        for match in self._pattern.finditer(ipa_string):
+            unmapped_char = match.group(1)
+            if unmapped_char is None:
+                kaldi_phonemes.extend(phonemes[match.group()])
+            else:
+                if on_unmapped is not None:
+                    on_unmapped(unmapped_char)
+                kaldi_phonemes.append("spn")
+        return kaldi_phonemes
+
+
+# --- Micro-benchmark ---
+def _segment_reference(ipa_to_kaldi_map, ipa_string):
+    # Implementación anterior, tal cual, como referencia
+    kaldi_phonemes = []
+    sorted_ipa_keys = sorted(ipa_to_kaldi_map.keys(), key=len, reverse=True)
+    idx = 0
+    while idx < len(ipa_string):
+        found_match = False
+        for ipa_key in sorted_ipa_keys:
+            if ipa_string.startswith(ipa_key, idx):
+                kaldi_equivalent = ipa_to_kaldi_map[ipa_key]
+                if kaldi_equivalent:
+                    kaldi_phonemes.extend(kaldi_equivalent.split())
+                idx += len(ipa_key)
+                found_match = True
+                break
+        if not found_match:
+            kaldi_phonemes.append("spn")
+            idx += 1
+    return kaldi_phonemes
+
+
+def _benchmark_words(ipa_to_kaldi_map, num_words):
+    # Cadenas IPA sintéticas con los símbolos del mapa y algún carácter no mapeado
+    import random
+    rng = random.Random(0)
+    symbols = list(ipa_to_kaldi_map.keys()) + ['ʔ', 'ː']
+    return [''.join(rng.choice(symbols) for _ in range(rng.randint(3, 14))) for _ in range(num_words)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del segmentador IPA -> Kaldi.")
+    parser.add_argument('--words', type=int, default=20000, help="Número de cadenas IPA sintéticas")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones (se toma la mejor)")
+    args = parser.parse_args()
+
+    from g2p_epitran import IPA_TO_KALDI_MAP
+    words = _benchmark_words(IPA_TO_KALDI_MAP, args.words)
+
+    segmenter = IpaSegmenter(IPA_TO_KALDI_MAP)
+    mismatches = sum(1 for w in words if segmenter.segment(w) != _segment_reference(IPA_TO_KALDI_MAP, w))
+
+    def _best_time(fn):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            for w in words:
+                fn(w)
+            best = min(best, time.perf_counter() - start_time)
+        return best
+
+    reference_time = _best_time(lambda w: _segment_reference(IPA_TO_KALDI_MAP, w))
+    compiled_time = _best_time(segmenter.segment)
+    print(f"{len(words)} palabras, {len(IPA_TO_KALDI_MAP)} claves IPA, diferencias: {mismatches}")
+    print(f"  anterior:  {reference_time / len(words) * 1e6:8.2f} us/palabra")
+    print(f"  compilado: {compiled_time / len(words) * 1e6:8.2f} us/palabra "
+          f"({reference_time / compiled_time:.1f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
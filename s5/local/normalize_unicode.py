@@ -1,57 +1,223 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# Normalización de palabras/frases para las claves del lexicón y el corpus del LM.
+# Todos los pasos (mayúsculas, / & - _ a espacios, NFD sin diacríticos, filtro [A-Z0-9 ])
+# actúan carácter a carácter, así que se precalculan en una tabla de str.translate que se
+# completa bajo demanda (un carácter nuevo se calcula una sola vez). Encima, las palabras
+# sueltas (lexicón, jerga) se memorizan con un lru_cache acotado. La salida es idéntica a
+# la de la implementación anterior (_normalize_reference, conservada como referencia).
+#
+# Uso como filtro: local/normalize_unicode.py < entrada > salida   (una palabra o frase por línea)
+# Uso en paralelo: local/normalize_unicode.py --jobs N --input entrada > salida
+#   el archivo se parte en rangos de bytes alineados a fin de línea que se normalizan en un
+#   pool de procesos; la salida se escribe en el orden original (idéntica a la de --jobs 1).
+# Uso como script de comprobación: local/normalize_unicode.py --benchmark <archivo>
+#   compara con la implementación anterior sobre las líneas del archivo y mide ambas.
+
+import argparse
+import os
+import re
 import sys
+import time
 import unicodedata
-import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+UNK_NORM = "UNK_SYMBOL_NORM"
+WORD_CACHE_SIZE = 1 << 16
+READ_HINT_BYTES = 1 << 20
+CHUNK_BYTES = 4 << 20  # Tamaño de cada rango de bytes en modo --jobs
+
+
+def _normalize_chars(text):
+    # Pasos de la implementación anterior que no dependen del contexto (sin strip ni espacios)
+    text = text.upper()
+    text = text.replace('/', ' ')
+    text = text.replace('&', ' Y ')
+    text = text.replace('-', ' ')
+    text = text.replace('_', ' ')
+    text_nfd = unicodedata.normalize('NFD', text)
+    text_no_diacritics = ''.join(c for c in text_nfd if unicodedata.category(c) != 'Mn')
+    text_no_diacritics = text_no_diacritics.replace('Ñ', 'N')
+    text_no_diacritics = text_no_diacritics.replace('Ü', 'U')
+    return re.sub(r'[^A-Z0-9N ]', '', text_no_diacritics)
+
+
+class _CharTable(dict):
+    # ord(carácter) -> _normalize_chars(carácter); solo quedan A-Z, 0-9 y ' ' en los valores.
+    # upper() y NFD son por carácter, y el reordenamiento canónico de NFD solo mueve marcas
+    # combinantes, que el filtro elimina; por eso traducir carácter a carácter es equivalente.
+    def __missing__(self, codepoint):
+        value = _normalize_chars(chr(codepoint))
+        self[codepoint] = value
+        return value
+
 
-def normalize_word_for_kaldi_lexicon(text_orig): # Nombre cambiado y lógica unificada
-    # Asegurarse de que text_orig es un string antes de strip()
+_CHAR_TABLE = _CharTable()
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def _normalize_word(word):
+    # Palabra sin espacios internos: los espacios que aparezcan (TCP/IP -> TCP IP) se eliminan
+    return ''.join(word.translate(_CHAR_TABLE).split())
+
+
+def normalize_word_for_kaldi_lexicon(text_orig):
+    # Asegurarse de que text_orig es un string
     if not isinstance(text_orig, str):
-        text_orig = str(text_orig) # O manejar el error como prefieras
+        text_orig = str(text_orig)
+
+    # Si la palabra original no tenía espacios internos, los espacios generados por / & - _
+    # se eliminan para tener una sola clave en el lexicón:
+    # Ej: "TCP/IP" -> "TCPIP", "R&D" -> "RYD", "BIG DATA" -> "BIG DATA"
+    stripped = text_orig.strip()
+    if ' ' not in stripped:
+        final_key = _normalize_word(stripped)
+    else:
+        # Frase: los espacios se conservan, colapsados (una línea de transcripción no se
+        # repite lo bastante para que compense memorizarla)
+        final_key = ' '.join(stripped.translate(_CHAR_TABLE).split())
+
+    # Si después de todo el procesamiento, la clave está vacía, devolver algo.
+    if not final_key:
+        return UNK_NORM
+    return final_key
+
+
+def normalize_lines(lines):
+    # Igual que el filtro de stdin: cada línea se normaliza tras strip()
+    return [normalize_word_for_kaldi_lexicon(line.strip()) for line in lines]
+
+
+def normalize_file(f_in, f_out, read_hint=READ_HINT_BYTES):
+    # Normaliza un archivo de texto completo con lecturas y escrituras por bloques grandes
+    num_lines = 0
+    while True:
+        lines = f_in.readlines(read_hint)
+        if not lines:
+            break
+        num_lines += len(lines)
+        f_out.write(''.join(normalized + '\n' for normalized in normalize_lines(lines) if normalized))
+    return num_lines
+
+
+# --- Modo paralelo por rangos de bytes ---
+def _chunk_ranges(path, chunk_bytes=CHUNK_BYTES):
+    # Rangos [inicio, fin) de ~chunk_bytes que empiezan siempre tras un '\n'
+    file_size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f_in:
+        start = 0
+        while start < file_size:
+            f_in.seek(min(start + chunk_bytes, file_size))
+            f_in.readline()
+            end = min(f_in.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _normalize_byte_range(path, start, end, encoding):
+    # Un '\n' nunca aparece dentro de un carácter multibyte, así que cada rango se decodifica
+    # por separado; las líneas se parten solo en '\n', como al leer la entrada en serie.
+    with open(path, 'rb') as f_in:
+        f_in.seek(start)
+        data = f_in.read(end - start)
+    lines = data.decode(encoding).split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    return ''.join(normalized + '\n' for normalized in normalize_lines(lines) if normalized)
+
+
+def normalize_path_parallel(path, f_out, jobs, encoding='utf-8', chunk_bytes=CHUNK_BYTES):
+    ranges = _chunk_ranges(path, chunk_bytes)
+    if jobs <= 1 or len(ranges) <= 1:
+        with open(path, 'r', encoding=encoding, newline='\n') as f_in:
+            return normalize_file(f_in, f_out)
+
+    # Como mucho 2 rangos por proceso en vuelo, para no acumular salida en memoria
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_normalize_byte_range, path, start, end, encoding))
+            if len(pending) >= 2 * jobs:
+                f_out.write(pending.popleft().result())
+        while pending:
+            f_out.write(pending.popleft().result())
+    return len(ranges)
+
+
+# --- Implementación anterior (referencia) ---
+def _normalize_reference(text_orig):
+    if not isinstance(text_orig, str):
+        text_orig = str(text_orig)
 
     text = text_orig.upper().strip()
-    
-    # Reemplazos específicos para manejar cómo se separan las palabras clave
-    text = text.replace('/', ' ') 
-    text = text.replace('&', ' Y ') 
-    text = text.replace('-', ' ') 
-    text = text.replace('_', ' ') # Guiones bajos también a espacios
+    text = text.replace('/', ' ')
+    text = text.replace('&', ' Y ')
+    text = text.replace('-', ' ')
+    text = text.replace('_', ' ')
 
     text_nfd = unicodedata.normalize('NFD', text)
     text_no_diacritics = ''.join(c for c in text_nfd if unicodedata.category(c) != 'Mn')
-    
     text_no_diacritics = text_no_diacritics.replace('Ñ', 'N')
     text_no_diacritics = text_no_diacritics.replace('Ü', 'U')
-    
-    # Mantener solo letras, números y ESPACIOS (temporalmente para palabras compuestas)
+
     processed_text = re.sub(r'[^A-Z0-9N ]', '', text_no_diacritics)
-    # Convertir múltiples espacios a uno solo y quitar al inicio/final
     processed_text = re.sub(r'\s+', ' ', processed_text).strip()
 
-    # Lógica final para la clave del lexicón:
-    # Si la palabra original (antes de reemplazar / & - _) no tenía espacios
-    # Y la processed_text ahora SÍ tiene espacios (porque / & - _ se volvieron espacios),
-    # entonces eliminamos esos espacios para tener una sola clave en el lexicón.
-    # Ej: "TCP/IP" (orig) -> "TCP IP" (proc) -> "TCPIP" (final_key)
-    # Ej: "R&D" (orig) -> "R Y D" (proc) -> "RYD" (final_key)
-    # Ej: "BIG DATA" (orig) -> "BIG DATA" (proc) -> "BIG DATA" (final_key, se mantienen espacios)
-    
     original_had_no_internal_spaces = (' ' not in text_orig.strip())
-    
     if original_had_no_internal_spaces and ' ' in processed_text:
         final_key = processed_text.replace(' ', '')
     else:
         final_key = processed_text
-    
-    # Si después de todo el procesamiento, la clave está vacía, devolver algo.
+
     if not final_key:
-        return "UNK_SYMBOL_NORM" # O simplemente una cadena vacía para ser filtrada después
+        return UNK_NORM
     return final_key
 
+
+def benchmark(path):
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f_in:
+        lines = [line.strip() for line in f_in]
+
+    start_time = time.perf_counter()
+    reference = [_normalize_reference(line) for line in lines]
+    reference_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    fast = [normalize_word_for_kaldi_lexicon(line) for line in lines]
+    fast_time = time.perf_counter() - start_time
+
+    mismatches = sum(1 for a, b in zip(reference, fast) if a != b)
+    print(f"{len(lines)} líneas, diferencias: {mismatches}")
+    print(f"  anterior: {reference_time:.2f} s")
+    print(f"  tabla + caché: {fast_time:.2f} s ({reference_time / max(fast_time, 1e-9):.1f}x)")
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normaliza palabras o frases (una por línea) de stdin para Kaldi.")
+    parser.add_argument('--benchmark', metavar='ARCHIVO', default=None,
+                        help="Comparar con la implementación anterior sobre ARCHIVO y medir ambas")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Procesos para normalizar --input por rangos de bytes (salida en el mismo orden)")
+    parser.add_argument('--input', default=None,
+                        help="Archivo de entrada (por defecto stdin); necesario para --jobs > 1")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        return benchmark(args.benchmark)
+    if args.input is None:
+        if args.jobs > 1:
+            sys.stderr.write("Advertencia (normalize_unicode): --jobs requiere --input; se normaliza stdin en serie.\n")
+        normalize_file(sys.stdin, sys.stdout)
+        return 0
+    normalize_path_parallel(args.input, sys.stdout, args.jobs)
+    return 0
+
+
 if __name__ == "__main__":
-    for line in sys.stdin:
-        # Cada línea de stdin es una palabra o frase a normalizar
-        normalized_line = normalize_word_for_kaldi_lexicon(line.strip())
-        if normalized_line: # Solo imprimir si no es vacía
-            sys.stdout.write(normalized_line + '\n')
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,749 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Empaquetado del modelo Vosk (usado por empaquetado.sh).
+# Antes cada publicación copiaba con `cp` todos los componentes (HCLG.fst ocupa GB) y los
+# comprimía de cero con un `zip -qr` de un solo hilo. Aquí:
+#   - place: coloca los archivos en el directorio del modelo con un clon copy-on-write
+#     (reflink) o un enlace duro cuando el sistema de archivos lo permite, y si no, copia.
+#     Ojo: con enlace duro el archivo empaquetado ES el de exp/; si Kaldi reescribe la
+#     fuente en el mismo inodo, el directorio empaquetado cambia con ella.
+#   - zip: crea el ZIP comprimiendo en paralelo bloques de los miembros (deflate crudo por
+#     bloques encadenables, como pigz: cada bloque usa los últimos 32 KB del anterior como
+#     diccionario). Junto al ZIP se guarda un manifiesto (<zip>.manifest.json) con sha256,
+#     CRC y tamaño por miembro; los miembros cuyo contenido no cambió se copian ya
+#     comprimidos del ZIP anterior en lugar de volver a comprimirlos.
+#
+# Uso:
+#   local/package_vosk_model.py place [--link-mode auto|reflink|hardlink|copy] <origen>... <destino>
+#       (semántica de cp -r: si hay varios orígenes o el destino es un directorio, se
+#       colocan dentro de él; los directorios se recorren recursivamente)
+#   local/package_vosk_model.py zip [--nj N] [--level L] <dir_modelo> <archivo.zip>
+#       (igual que `cd $(dirname dir); zip -qr archivo.zip $(basename dir)/`)
+#   local/package_vosk_model.py bundle --store <almacén> [--base <paquete_instalado>] <dir_modelo> <paquete.zip>
+#       paquete completo, o delta con solo los componentes (am/, graph/, ivector/, conf/, ...)
+#       que cambiaron respecto a --base; cada versión de componente se comprime una sola vez
+#   local/package_vosk_model.py apply <paquete.zip> <dir_destino>
+#       instala un paquete completo o delta en <dir_destino>/<modelo> (en los nodos de despliegue)
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+FICLONE = 0x40049409  # ioctl de Linux para clonar un archivo (btrfs, XFS, ...)
+
+BLOCK_BYTES = 8 << 20    # Tamaño de bloque para la compresión en paralelo
+DICT_BYTES = 32 << 10    # Ventana de deflate: diccionario que se pasa de un bloque al siguiente
+HASH_READ_BYTES = 1 << 20
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+
+# --- place: enlaces duros / reflinks / copia ---
+def _reflink(src, dest):
+    import fcntl
+    with open(src, 'rb') as f_src, open(dest, 'wb') as f_dest:
+        fcntl.ioctl(f_dest.fileno(), FICLONE, f_src.fileno())
+    shutil.copystat(src, dest)
+
+
+def _hardlink(src, dest):
+    os.link(src, dest)
+
+
+def _copy(src, dest):
+    shutil.copy2(src, dest)
+
+
+_PLACERS = {'reflink': _reflink, 'hardlink': _hardlink, 'copy': _copy}
+
+
+def place_file(src, dest, link_mode='auto'):
+    # Devuelve el método usado ('reflink', 'hardlink', 'copy' o 'sin cambios')
+    src = os.path.realpath(src)  # final.mdl suele ser un enlace simbólico a <iter>.mdl
+    if os.path.lexists(dest):
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return 'sin cambios'
+        # Nunca escribir encima: dest puede ser un enlace duro de otra fuente
+        os.remove(dest)
+
+    modes = ('reflink', 'hardlink', 'copy') if link_mode == 'auto' else (link_mode,)
+    last_error = None
+    for mode in modes:
+        try:
+            _PLACERS[mode](src, dest)
+            return mode
+        except (OSError, ImportError) as e:
+            last_error = e
+            if os.path.lexists(dest):
+                os.remove(dest)
+    raise OSError(f"No se pudo colocar {src} en {dest} ({link_mode}): {last_error}")
+
+
+def place(sources, dest, link_mode='auto'):
+    # Devuelve {método: número de archivos}
+    counts = {}
+    into_dir = len(sources) > 1 or os.path.isdir(dest) or dest.endswith('/')
+    if into_dir:
+        os.makedirs(dest, exist_ok=True)
+    for src in sources:
+        target = os.path.join(dest, os.path.basename(src.rstrip('/'))) if into_dir else dest
+        if os.path.isdir(src):
+            for root, dirs, files in os.walk(src):
+                dirs.sort()
+                rel_root = os.path.relpath(root, src)
+                target_root = os.path.normpath(os.path.join(target, rel_root))
+                os.makedirs(target_root, exist_ok=True)
+                for name in sorted(files):
+                    method = place_file(os.path.join(root, name), os.path.join(target_root, name), link_mode)
+                    counts[method] = counts.get(method, 0) + 1
+        else:
+            method = place_file(src, target, link_mode)
+            counts[method] = counts.get(method, 0) + 1
+    return counts
+
+
+# --- zip: manifiesto ---
+def manifest_path_for(zip_path):
+    return zip_path + MANIFEST_SUFFIX
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f_in:
+            manifest = json.load(f_in)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('members', {})
+
+
+def save_manifest(path, members):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f_out:
+        json.dump({'version': MANIFEST_VERSION, 'members': members}, f_out, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _hash_file(path):
+    # sha256 y CRC-32 en una sola lectura (ambos liberan el GIL, así que se usan hilos)
+    digest = hashlib.sha256()
+    crc = 0
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(HASH_READ_BYTES), b''):
+            digest.update(block)
+            crc = zlib.crc32(block, crc)
+    return digest.hexdigest(), crc
+
+
+def file_state(path, previous=None):
+    # Mientras (tamaño, mtime) no cambien se reutiliza el hash del manifiesto
+    st = os.stat(path)
+    if previous and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns:
+        return dict(previous)
+    sha256, crc = _hash_file(path)
+    return {'sha256': sha256, 'crc32': crc, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def list_members(model_dir):
+    # (nombre_en_zip, ruta, es_directorio) en el orden de zip -r, con nombres relativos
+    # al directorio padre del modelo
+    base_dir = os.path.dirname(os.path.abspath(model_dir))
+    members = []
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        arc_root = os.path.relpath(os.path.abspath(root), base_dir).replace(os.sep, '/')
+        members.append((arc_root + '/', root, True))
+        for name in sorted(files):
+            members.append((f"{arc_root}/{name}", os.path.join(root, name), False))
+    return members
+
+
+# --- zip: compresión por bloques ---
+def _deflate_block(path, offset, length, is_last, level):
+    # Deflate crudo de [offset, offset+length). Los bloques intermedios terminan con
+    # Z_SYNC_FLUSH (alineados a byte y sin marcar como finales), así que concatenados forman
+    # un único flujo deflate válido.
+    with open(path, 'rb') as f_in:
+        dict_start = max(0, offset - DICT_BYTES)
+        f_in.seek(dict_start)
+        zdict = f_in.read(offset - dict_start)
+        data = f_in.read(length)
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+
+def _blocks(path, size):
+    if size == 0:
+        return [(path, 0, 0, True)]
+    offsets = range(0, size, BLOCK_BYTES)
+    return [(path, off, min(BLOCK_BYTES, size - off), off + BLOCK_BYTES >= size) for off in offsets]
+
+
+def _ordered_results(tasks, level, nj):
+    # Resultados de _deflate_block en el orden de tasks, con a lo sumo 2*nj bloques en vuelo
+    if nj <= 1:
+        for task in tasks:
+            yield _deflate_block(*task, level)
+        return
+    with ProcessPoolExecutor(max_workers=nj) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_deflate_block, *task, level))
+            if len(pending) >= 2 * nj:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- zip: registros del formato ZIP ---
+# Las cabeceras locales, el directorio central y los registros de fin se escriben aquí con
+# struct (formato de la APPNOTE de PKWARE), con los mismos campos que escribe zipfile, en
+# lugar de tocar los atributos internos de zipfile.ZipFile, que cambian entre versiones de
+# Python. zipfile solo se usa para leer los ZIP y por ZipInfo (metadatos de cada miembro).
+ZIP64_LIMIT = (1 << 31) - 1         # Mismo umbral que zipfile para pasar a ZIP64
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+UTF8_FLAG = 0x800                   # Bit 11: nombre codificado en UTF-8
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+END_LOCATOR64 = struct.Struct('<4sLQL')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def _encode_name(filename):
+    # (nombre en bytes, bits de flag): ASCII si se puede, si no UTF-8 con el bit 11
+    try:
+        return filename.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return filename.encode('utf-8'), UTF8_FLAG
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+class _ZipWriter:
+    # Escribe un ZIP de forma secuencial: begin() escribe la cabecera local de un miembro,
+    # el llamador escribe sus datos comprimidos en self.fp, y end() corrige la cabecera con
+    # el tamaño comprimido final. close() escribe el directorio central.
+    def __init__(self, path):
+        self.fp = open(path, 'wb')
+        self.members = []  # [(ZipInfo, zip64)]
+
+    def _local_header(self, zinfo, zip64):
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        extra = struct.pack('<2H2Q', 1, 16, file_size, compress_size) if zip64 else b''
+        version = ZIP_VERSION
+        if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+            if not zip64:
+                raise zipfile.LargeZipFile(f"{zinfo.filename}: el tamaño comprimido necesita ZIP64")
+            file_size = compress_size = 0xffffffff
+            version = ZIP64_VERSION
+        name, flags = _encode_name(zinfo.filename)
+        dosdate, dostime = _dos_date_time(zinfo.date_time)
+        return LOCAL_HEADER.pack(LOCAL_HEADER_SIGNATURE, version, 0, flags, zinfo.compress_type,
+                                 dostime, dosdate, zinfo.CRC, compress_size, file_size,
+                                 len(name), len(extra)) + name + extra
+
+    def begin(self, zinfo):
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT
+        zinfo.header_offset = self.fp.tell()
+        self.fp.write(self._local_header(zinfo, zip64))
+        return zip64
+
+    def end(self, zinfo, zip64):
+        end_offset = self.fp.tell()
+        self.fp.seek(zinfo.header_offset)
+        self.fp.write(self._local_header(zinfo, zip64))
+        self.fp.seek(end_offset)
+        self.members.append(zinfo)
+
+    def close(self):
+        start_dir = self.fp.tell()
+        for zinfo in self.members:
+            file_size, compress_size, header_offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+            extra = []
+            if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+                extra += [file_size, compress_size]
+                file_size = compress_size = 0xffffffff
+            if header_offset > ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = 0xffffffff
+            extra_data = struct.pack(f'<2H{len(extra)}Q', 1, 8 * len(extra), *extra) if extra else b''
+            version = ZIP64_VERSION if extra else ZIP_VERSION
+            name, flags = _encode_name(zinfo.filename)
+            dosdate, dostime = _dos_date_time(zinfo.date_time)
+            self.fp.write(CENTRAL_HEADER.pack(b'PK\x01\x02', version, zinfo.create_system, version, 0,
+                                              flags, zinfo.compress_type, dostime, dosdate, zinfo.CRC,
+                                              compress_size, file_size, len(name), len(extra_data), 0,
+                                              0, 0, zinfo.external_attr, header_offset))
+            self.fp.write(name + extra_data)
+
+        end_dir = self.fp.tell()
+        count, dir_size = len(self.members), end_dir - start_dir
+        if count > ZIP_FILECOUNT_LIMIT or start_dir > ZIP64_LIMIT or dir_size > ZIP64_LIMIT:
+            self.fp.write(END_RECORD64.pack(b'PK\x06\x06', 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                                            count, count, dir_size, start_dir))
+            self.fp.write(END_LOCATOR64.pack(b'PK\x06\x07', 0, end_dir, 1))
+            count = min(count, 0xffff)
+            dir_size = min(dir_size, 0xffffffff)
+            start_dir = min(start_dir, 0xffffffff)
+        self.fp.write(END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, dir_size, start_dir, 0))
+        self.fp.close()
+
+    def abort(self):
+        self.fp.close()
+
+
+def _raw_member_data(f_zip, zinfo):
+    # Posición y tamaño de los datos comprimidos de un miembro de un ZIP existente
+    f_zip.seek(zinfo.header_offset)
+    header = LOCAL_HEADER.unpack(f_zip.read(LOCAL_HEADER.size))
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Cabecera local incorrecta para {zinfo.filename}")
+    data_offset = zinfo.header_offset + LOCAL_HEADER.size + header[10] + header[11]
+    return data_offset, zinfo.compress_size
+
+
+def _copy_range(f_src, offset, length, f_dest):
+    f_src.seek(offset)
+    while length > 0:
+        chunk = f_src.read(min(HASH_READ_BYTES, length))
+        if not chunk:
+            raise OSError("ZIP anterior truncado")
+        f_dest.write(chunk)
+        length -= len(chunk)
+
+
+def write_zip(zip_path, members, states, reuse=None, nj=1, level=6):
+    # Escribe zip_path (vía <zip>.tmp) con members = [(nombre_en_zip, ruta, es_directorio)].
+    # states[nombre] da tamaño y CRC de cada archivo; reuse[nombre] = (ZipFile, ZipInfo) de
+    # un ZIP existente cuyos datos comprimidos se copian tal cual. El resto se comprime por
+    # bloques en paralelo. Devuelve (miembros comprimidos, bytes sin comprimir enviados a deflate).
+    reuse = reuse or {}
+    to_compress = [(arcname, path) for arcname, path, is_dir in members
+                   if not is_dir and arcname not in reuse]
+    num_blocks = {}
+    tasks = []
+    for arcname, path in to_compress:
+        blocks = _blocks(path, states[arcname]['size'])
+        num_blocks[arcname] = len(blocks)
+        tasks.extend(blocks)
+
+    tmp_path = zip_path + '.tmp'
+    results = _ordered_results(tasks, level, nj)
+    source_files = {}  # ZIP de origen -> archivo abierto para copiar sus datos comprimidos
+    writer = _ZipWriter(tmp_path)
+    try:
+        for arcname, path, is_dir in members:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            if is_dir:
+                zinfo.compress_type = zipfile.ZIP_STORED
+                zinfo.CRC = zinfo.compress_size = 0
+                writer.end(zinfo, writer.begin(zinfo))
+                continue
+            state = states[arcname]
+            zinfo.file_size = state['size']
+            zinfo.CRC = state['crc32']
+            zinfo.compress_size = 0
+            source = reuse.get(arcname)
+            zinfo.compress_type = source[1].compress_type if source else zipfile.ZIP_DEFLATED
+            zip64 = writer.begin(zinfo)
+            if source is not None:
+                source_zip, source_zinfo = source
+                if source_zip.filename not in source_files:
+                    source_files[source_zip.filename] = open(source_zip.filename, 'rb')
+                f_source = source_files[source_zip.filename]
+                data_offset, length = _raw_member_data(f_source, source_zinfo)
+                _copy_range(f_source, data_offset, length, writer.fp)
+                zinfo.compress_size = length
+            else:
+                for _ in range(num_blocks[arcname]):
+                    chunk = next(results)
+                    writer.fp.write(chunk)
+                    zinfo.compress_size += len(chunk)
+            writer.end(zinfo, zip64)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        os.remove(tmp_path)
+        raise
+    finally:
+        results.close()
+        for f_source in source_files.values():
+            f_source.close()
+    os.replace(tmp_path, zip_path)
+    return len(to_compress), sum(states[arcname]['size'] for arcname, _ in to_compress)
+
+
+def _reusable_member(source_zip, arcname, state, source_arcname=None):
+    # ZipInfo del miembro de source_zip si contiene exactamente este contenido (CRC y tamaño),
+    # sin cifrar y guardado o con deflate (los métodos que declara _ZipWriter)
+    try:
+        zinfo = source_zip.getinfo(source_arcname or arcname)
+    except KeyError:
+        return None
+    if (zinfo.CRC == state['crc32'] and zinfo.file_size == state['size'] and not zinfo.flag_bits & 0x1
+            and zinfo.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)):
+        return zinfo
+    return None
+
+
+def _hash_states(file_members, previous, nj):
+    # Estado (hash) de cada archivo; solo se leen los que cambiaron de tamaño o mtime
+    with ThreadPoolExecutor(max_workers=max(1, nj)) as executor:
+        return dict(zip((key for key, _ in file_members),
+                        executor.map(lambda m: file_state(m[1], previous.get(m[0])), file_members)))
+
+
+def build_zip(model_dir, zip_path, nj=1, level=6):
+    manifest_path = manifest_path_for(zip_path)
+    previous = load_manifest(manifest_path)
+    members = list_members(model_dir)
+    file_members = [(arcname, path) for arcname, path, is_dir in members if not is_dir]
+    states = _hash_states(file_members, previous, nj)
+
+    # Miembros reutilizables del ZIP anterior: mismo sha256 y mismo CRC/tamaño en el ZIP
+    old_zip = None
+    reuse = {}
+    if previous and os.path.isfile(zip_path):
+        try:
+            old_zip = zipfile.ZipFile(zip_path)
+            for arcname, _ in file_members:
+                old_state = previous.get(arcname)
+                if not old_state or old_state['sha256'] != states[arcname]['sha256']:
+                    continue
+                zinfo = _reusable_member(old_zip, arcname, states[arcname])
+                if zinfo is not None:
+                    reuse[arcname] = (old_zip, zinfo)
+        except (OSError, zipfile.BadZipFile):
+            old_zip, reuse = None, {}
+
+    try:
+        num_compressed, compressed_bytes = write_zip(zip_path, members, states, reuse, nj, level)
+    finally:
+        if old_zip is not None:
+            old_zip.close()
+    save_manifest(manifest_path, states)
+    return {'miembros': len(file_members), 'reutilizados': len(reuse),
+            'comprimidos': num_compressed, 'bytes_comprimidos': compressed_bytes}
+
+
+# --- Almacén de componentes y paquetes completos / delta ---
+# Cada directorio de primer nivel del modelo (am/, conf/, graph/, ivector/) es un
+# componente; los archivos sueltos de primer nivel (README.md, LICENSE) forman el
+# componente ROOT_COMPONENT. El hash de un componente es el sha256 de la lista ordenada
+# (ruta, sha256) de sus archivos, y cada versión se guarda comprimida una sola vez en
+# <almacén>/objects/<hash>.zip (con <hash>.json listando sus archivos). Al crear una versión
+# nueva, los archivos que no cambiaron respecto a la última versión de ese componente
+# (p. ej., HCLG.fst cuando solo cambió words.txt) se copian ya comprimidos. Un paquete se arma copiando los miembros ya comprimidos de
+# esos objetos: completo (todos los componentes) o delta (solo los que cambiaron respecto
+# a un paquete base). Ambos llevan <modelo>/bundle_manifest.json con el estado completo.
+ROOT_COMPONENT = 'root'
+BUNDLE_MANIFEST_NAME = 'bundle_manifest.json'
+STORE_STATES_NAME = 'file_states.json'
+STORE_LATEST_NAME = 'latest.json'
+
+
+def component_files(model_dir):
+    # {componente: [(ruta_relativa, ruta)]}, sin incluir el propio bundle_manifest.json
+    components = {}
+    for entry in sorted(os.scandir(model_dir), key=lambda e: e.name):
+        if entry.is_dir():
+            files = []
+            for root, dirs, names in os.walk(entry.path):
+                dirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    files.append((os.path.relpath(path, model_dir).replace(os.sep, '/'), path))
+            components[entry.name] = files
+        elif entry.name != BUNDLE_MANIFEST_NAME:
+            components.setdefault(ROOT_COMPONENT, []).append((entry.name, entry.path))
+    return components
+
+
+def _component_hash(file_hashes):
+    digest = hashlib.sha256()
+    for rel_path in sorted(file_hashes):
+        digest.update(f"{rel_path}\t{file_hashes[rel_path]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ComponentStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._states_path = os.path.join(store_dir, STORE_STATES_NAME)
+
+    def object_path(self, component_hash):
+        return os.path.join(self.objects_dir, component_hash + '.zip')
+
+    def _object_files(self, component_hash):
+        try:
+            with open(os.path.join(self.objects_dir, component_hash + '.json'), 'r', encoding='utf-8') as f_in:
+                return json.load(f_in)['files']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def snapshot(self, model_dir, nj=1):
+        # Devuelve ({componente: {'hash', 'files': {ruta: sha256}}}, {ruta: estado})
+        components = component_files(model_dir)
+        file_members = [(os.path.abspath(path), path)
+                        for files in components.values() for _, path in files]
+        previous = load_manifest(self._states_path)
+        abs_states = _hash_states(file_members, previous, nj)
+        previous.update(abs_states)
+        save_manifest(self._states_path, previous)
+
+        snapshot, states = {}, {}
+        for component, files in components.items():
+            file_hashes = {}
+            for rel_path, path in files:
+                states[rel_path] = abs_states[os.path.abspath(path)]
+                file_hashes[rel_path] = states[rel_path]['sha256']
+            snapshot[component] = {'hash': _component_hash(file_hashes), 'files': file_hashes}
+        return snapshot, states
+
+    def ensure_objects(self, model_dir, snapshot, states, nj=1, level=6):
+        # Comprime solo las versiones de componente que aún no están en el almacén
+        components = component_files(model_dir)
+        latest_path = os.path.join(self.store_dir, STORE_LATEST_NAME)
+        try:
+            with open(latest_path, 'r', encoding='utf-8') as f_in:
+                latest = json.load(f_in)
+        except (OSError, ValueError):
+            latest = {}
+
+        created = []
+        for component, info in snapshot.items():
+            object_path = self.object_path(info['hash'])
+            if not os.path.isfile(object_path):
+                self._write_object(object_path, components[component], info, states,
+                                   latest.get(component), nj, level)
+                created.append(component)
+            latest[component] = info['hash']
+
+        tmp_path = latest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f_out:
+            json.dump(latest, f_out, indent=1, sort_keys=True)
+        os.replace(tmp_path, latest_path)
+        return created
+
+    def _write_object(self, object_path, files, info, states, previous_hash, nj, level):
+        members = [(rel_path, path, False) for rel_path, path in files]
+        previous_files = self._object_files(previous_hash) if previous_hash else None
+        previous_zip = None
+        reuse = {}
+        if previous_files and os.path.isfile(self.object_path(previous_hash)):
+            previous_zip = zipfile.ZipFile(self.object_path(previous_hash))
+            for rel_path, _ in files:
+                if previous_files.get(rel_path) != info['files'][rel_path]:
+                    continue
+                zinfo = _reusable_member(previous_zip, rel_path, states[rel_path])
+                if zinfo is not None:
+                    reuse[rel_path] = (previous_zip, zinfo)
+        try:
+            write_zip(object_path, members, states, reuse, nj, level)
+        finally:
+            if previous_zip is not None:
+                previous_zip.close()
+        files_path = object_path[:-len('.zip')] + '.json'
+        with open(files_path + '.tmp', 'w', encoding='utf-8') as f_out:
+            json.dump({'files': info['files']}, f_out, indent=1, sort_keys=True)
+        os.replace(files_path + '.tmp', files_path)
+
+
+def read_bundle_manifest(path):
+    # Manifiesto de un paquete (.zip) o un bundle_manifest.json suelto
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            name = next((n for n in zf.namelist() if n.rsplit('/', 1)[-1] == BUNDLE_MANIFEST_NAME), None)
+            if name is None:
+                raise ValueError(f"{path} no contiene {BUNDLE_MANIFEST_NAME}")
+            return json.loads(zf.read(name).decode('utf-8'))
+    with open(path, 'r', encoding='utf-8') as f_in:
+        return json.load(f_in)
+
+
+def build_bundle(model_dir, bundle_path, store_dir, base=None, nj=1, level=6):
+    # Paquete completo (base=None) o delta respecto al manifiesto/paquete base
+    store = ComponentStore(store_dir)
+    snapshot, states = store.snapshot(model_dir, nj)
+    created = store.ensure_objects(model_dir, snapshot, states, nj, level)
+
+    base_manifest = read_bundle_manifest(base) if base else None
+    base_hashes = ({component: info['hash'] for component, info in base_manifest['components'].items()}
+                   if base_manifest else {})
+    included = [component for component, info in snapshot.items()
+                if base_manifest is None or base_hashes.get(component) != info['hash']]
+    model_name = os.path.basename(os.path.abspath(model_dir))
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'model': model_name,
+        'type': 'delta' if base_manifest else 'full',
+        'components': snapshot,
+        'included': included,
+        'removed': sorted(set(base_hashes) - set(snapshot)),
+        'base': base_hashes,
+    }
+
+    components = component_files(model_dir)
+    members, bundle_states, reuse, object_zips = [], {}, {}, []
+    try:
+        for component in included:
+            object_zip = zipfile.ZipFile(store.object_path(snapshot[component]['hash']))
+            object_zips.append(object_zip)
+            for rel_path, path in components[component]:
+                arcname = f"{model_name}/{rel_path}"
+                members.append((arcname, path, False))
+                bundle_states[arcname] = states[rel_path]
+                zinfo = _reusable_member(object_zip, arcname, states[rel_path], rel_path)
+                if zinfo is not None:
+                    reuse[arcname] = (object_zip, zinfo)
+        num_compressed, _ = write_zip(bundle_path, members, bundle_states, reuse, nj, level)
+    finally:
+        for object_zip in object_zips:
+            object_zip.close()
+
+    # El manifiesto va como último miembro del paquete
+    with zipfile.ZipFile(bundle_path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"{model_name}/{BUNDLE_MANIFEST_NAME}", json.dumps(manifest, indent=1, sort_keys=True))
+    return {'tipo': manifest['type'], 'incluidos': included, 'eliminados': manifest['removed'],
+            'nuevos_en_almacen': created, 'miembros': len(members), 'recomprimidos': num_compressed}
+
+
+def _remove_empty_parents(path, stop_dir):
+    # Borra los directorios vacíos desde path hacia arriba, sin llegar a stop_dir
+    stop_dir = os.path.abspath(stop_dir)
+    path = os.path.abspath(path)
+    while path.startswith(stop_dir + os.sep) and os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+
+def apply_bundle(bundle_path, dest_parent):
+    # Instala un paquete completo o delta en <dest_parent>/<modelo>. Un delta solo se aplica
+    # si el modelo instalado coincide con su base (según el bundle_manifest.json instalado).
+    with zipfile.ZipFile(bundle_path) as zf:
+        manifest = read_bundle_manifest(bundle_path)
+        model_dir = os.path.join(dest_parent, manifest['model'])
+        installed_path = os.path.join(model_dir, BUNDLE_MANIFEST_NAME)
+        installed = None
+        if os.path.isfile(installed_path):
+            with open(installed_path, 'r', encoding='utf-8') as f_in:
+                installed = json.load(f_in)
+        if manifest['type'] == 'delta':
+            installed_hashes = ({component: info['hash'] for component, info in installed['components'].items()}
+                                if installed else None)
+            if installed_hashes != manifest['base']:
+                raise ValueError(f"El modelo instalado en {model_dir} no coincide con la base del paquete delta")
+
+        # Borrar los archivos de las versiones anteriores de los componentes que se reemplazan
+        replaced = manifest['included'] + manifest['removed'] if manifest['type'] == 'delta' else (
+            list(installed['components']) if installed else [])
+        for component in replaced:
+            old_files = installed['components'].get(component, {}).get('files', {}) if installed else {}
+            for rel_path in old_files:
+                path = os.path.join(model_dir, rel_path)
+                if os.path.lexists(path):
+                    os.remove(path)
+                _remove_empty_parents(os.path.dirname(path), model_dir)
+        zf.extractall(dest_parent)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Empaquetado del modelo Vosk: colocación con enlaces y ZIP incremental en paralelo.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    place_parser = subparsers.add_parser('place', help="Colocar archivos en el directorio del modelo (como cp -r)")
+    place_parser.add_argument('--link-mode', choices=LINK_MODES, default='auto',
+                              help="auto: reflink, si no enlace duro, si no copia")
+    place_parser.add_argument('sources', nargs='+', help="Archivos o directorios de origen")
+    place_parser.add_argument('dest', help="Archivo o directorio de destino")
+
+    zip_parser = subparsers.add_parser('zip', help="Crear (o actualizar) el ZIP del directorio del modelo")
+    zip_parser.add_argument('--nj', type=int, default=os.cpu_count() or 1, help="Procesos de compresión")
+    zip_parser.add_argument('--level', type=int, default=6, help="Nivel de deflate (por defecto 6, como zip)")
+    zip_parser.add_argument('model_dir', help="Directorio del modelo empaquetado")
+    zip_parser.add_argument('zip_path', help="Archivo ZIP de salida")
+
+    bundle_parser = subparsers.add_parser('bundle', help="Crear un paquete completo o delta desde el almacén de componentes")
+    bundle_parser.add_argument('--store', required=True, help="Directorio del almacén de componentes")
+    bundle_parser.add_argument('--base', default=None,
+                               help="Paquete (o bundle_manifest.json) instalado en destino; si se indica, se crea un delta")
+    bundle_parser.add_argument('--nj', type=int, default=os.cpu_count() or 1, help="Procesos de compresión")
+    bundle_parser.add_argument('--level', type=int, default=6, help="Nivel de deflate")
+    bundle_parser.add_argument('model_dir', help="Directorio del modelo empaquetado")
+    bundle_parser.add_argument('bundle_path', help="Archivo ZIP del paquete de salida")
+
+    apply_parser = subparsers.add_parser('apply', help="Instalar un paquete completo o delta")
+    apply_parser.add_argument('bundle_path', help="Paquete (.zip) creado con 'bundle'")
+    apply_parser.add_argument('dest_parent', help="Directorio donde está (o estará) el modelo")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.command == 'place':
+        try:
+            counts = place(args.sources, args.dest, args.link_mode)
+        except OSError as e:
+            sys.stderr.write(f"Error (package_vosk_model): {e}\n")
+            return 1
+        summary = ', '.join(f"{method}: {count}" for method, count in sorted(counts.items()))
+        print(f"  {args.dest}: {summary}")
+        return 0
+
+    if args.command == 'apply':
+        try:
+            manifest = apply_bundle(args.bundle_path, args.dest_parent)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            sys.stderr.write(f"Error (package_vosk_model): {e}\n")
+            return 1
+        print(f"Paquete {manifest['type']} aplicado en {os.path.join(args.dest_parent, manifest['model'])}: "
+              f"componentes {', '.join(manifest['included']) or 'ninguno'}")
+        return 0
+
+    if not os.path.isdir(args.model_dir):
+        sys.stderr.write(f"Error (package_vosk_model): {args.model_dir} no es un directorio.\n")
+        return 1
+    if args.command == 'bundle':
+        try:
+            stats = build_bundle(args.model_dir, args.bundle_path, args.store, args.base, nj=args.nj, level=args.level)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            sys.stderr.write(f"Error (package_vosk_model): {e}\n")
+            return 1
+        print(f"Paquete {stats['tipo']} {args.bundle_path}: componentes {', '.join(stats['incluidos']) or 'ninguno'}"
+              f"{' (eliminados: ' + ', '.join(stats['eliminados']) + ')' if stats['eliminados'] else ''}, "
+              f"{stats['miembros']} archivos; nuevos en el almacén: {', '.join(stats['nuevos_en_almacen']) or 'ninguno'} "
+              f"({time.time() - start_time:.2f} s)")
+        return 0
+
+    stats = build_zip(args.model_dir, args.zip_path, nj=args.nj, level=args.level)
+    print(f"ZIP {args.zip_path}: {stats['miembros']} archivos, {stats['reutilizados']} reutilizados del ZIP anterior, "
+          f"{stats['comprimidos']} comprimidos ({stats['bytes_comprimidos'] / 1e6:.1f} MB) "
+          f"en {time.time() - start_time:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
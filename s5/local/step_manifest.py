@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Manifiesto de hashes de contenido para saltar pasos de lang_prep.sh cuyas entradas
+# no han cambiado. Para cada paso se guardan los sha256 de sus entradas (incluidos los
+# scripts que lo implementan) y de sus salidas; el paso está al día si todas coinciden
+# con lo que hay en disco.
+#
+# Uso:
+#   local/step_manifest.py check  <manifiesto.json> <paso> --inputs a b ... --outputs x y ...
+#       -> código de salida 0 si el paso está al día, 1 si hay que rehacerlo
+#   local/step_manifest.py record <manifiesto.json> <paso> --inputs a b ... --outputs x y ...
+#       -> registra los hashes actuales tras ejecutar el paso
+#
+# Para no releer archivos grandes, el hash se reutiliza mientras (tamaño, mtime) no cambien.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+MISSING = 'ausente'
+
+
+def _file_state(path, previous=None):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {'sha256': MISSING}
+    if previous and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns:
+        return previous
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(1 << 20), b''):
+            digest.update(block)
+    return {'sha256': digest.hexdigest(), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f_in:
+            return json.load(f_in)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f_out:
+        json.dump(manifest, f_out, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _states(paths, previous):
+    return {path: _file_state(path, previous.get(path)) for path in paths}
+
+
+def _same_hashes(recorded, current):
+    return (recorded.keys() == current.keys()
+            and all(recorded[p]['sha256'] == current[p]['sha256'] for p in current))
+
+
+def step_is_up_to_date(manifest, step, inputs, outputs):
+    recorded = manifest.get(step)
+    if not recorded:
+        return False
+    current_outputs = _states(outputs, recorded.get('outputs', {}))
+    if any(state['sha256'] == MISSING for state in current_outputs.values()):
+        return False
+    return (_same_hashes(recorded.get('inputs', {}), _states(inputs, recorded.get('inputs', {})))
+            and _same_hashes(recorded.get('outputs', {}), current_outputs))
+
+
+def record_step(manifest, step, inputs, outputs):
+    previous = manifest.get(step, {})
+    manifest[step] = {
+        'inputs': _states(inputs, previous.get('inputs', {})),
+        'outputs': _states(outputs, previous.get('outputs', {})),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manifiesto de hashes de contenido por paso.")
+    parser.add_argument('action', choices=['check', 'record'])
+    parser.add_argument('manifest', help="Archivo JSON del manifiesto")
+    parser.add_argument('step', help="Nombre del paso (e.g., lm_corpus)")
+    parser.add_argument('--inputs', nargs='*', default=[], help="Archivos de entrada del paso (incluidos sus scripts)")
+    parser.add_argument('--outputs', nargs='*', default=[], help="Archivos de salida del paso")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    if args.action == 'check':
+        return 0 if step_is_up_to_date(manifest, args.step, args.inputs, args.outputs) else 1
+
+    record_step(manifest, args.step, args.inputs, args.outputs)
+    save_manifest(args.manifest, manifest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
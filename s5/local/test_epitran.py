@@ -3,8 +3,14 @@
 
 import epitran
 import unicodedata
+import os
 import re
 import sys
+try:
+    from ipa_segmenter import IpaSegmenter
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from ipa_segmenter import IpaSegmenter
 
 # --- NORMALIZACIÓN PARA LA PRIMERA COLUMNA DEL LEXICÓN DE KALDI ---
 def normalize_word_for_kaldi_lexicon(text_orig):
@@ -105,6 +111,9 @@ IPA_TO_KALDI_MAP = {
     'ʝ': 'y', # Sonido /ʝ/ (letra y) -> y (en dialectos yeístas)
 }
 
+# Segmentador compilado una sola vez (coincidencia más larga primero)
+IPA_SEGMENTER = IpaSegmenter(IPA_TO_KALDI_MAP)
+
 # --- HEURÍSTICAS R/RR (sin cambios por ahora) ---
 def apply_r_rr_kaldi_heuristics(original_word_upper, kaldi_phoneme_list):
     # ... (tu función apply_r_rr_kaldi_heuristics como estaba) ...
@@ -139,31 +148,16 @@ def ipa_string_to_kaldi_phonemes(word_for_kaldi_lexicon, ipa_string, original_wo
     Toma una cadena continua de fonemas IPA y la convierte a fonemas Kaldi.
     Esto requiere una segmentación inteligente de la cadena IPA.
     """
-    kaldi_phonemes = []
     if not ipa_string:
         return "spn"
 
-    sorted_ipa_keys = sorted(IPA_TO_KALDI_MAP.keys(), key=len, reverse=True)
-    
-    idx = 0
-    while idx < len(ipa_string):
-        found_match = False
-        for ipa_key in sorted_ipa_keys:
-            if ipa_string.startswith(ipa_key, idx):
-                kaldi_equivalent = IPA_TO_KALDI_MAP[ipa_key]
-                if kaldi_equivalent: # Si no es un mapeo a cadena vacía
-                    kaldi_phonemes.extend(kaldi_equivalent.split())
-                idx += len(ipa_key)
-                found_match = True
-                break
-        if not found_match:
-            # Si no se encontró ningún fonema IPA del mapa, tenemos un problema.
-            # Podría ser un carácter no cubierto o un error de segmentación.
-            unmapped_char = ipa_string[idx]
-            print(f"Advertencia G2P: Carácter/secuencia IPA no mapeado '{unmapped_char}' en '{ipa_string}' (palabra: '{word_for_kaldi_lexicon}'). Usando spn.", file=sys.stderr)
-            kaldi_phonemes.append("spn")
-            idx += 1
-            
+    # Si no se encontró ningún fonema IPA del mapa, tenemos un problema.
+    # Podría ser un carácter no cubierto o un error de segmentación.
+    def warn_unmapped(unmapped_char):
+        print(f"Advertencia G2P: Carácter/secuencia IPA no mapeado '{unmapped_char}' en '{ipa_string}' (palabra: '{word_for_kaldi_lexicon}'). Usando spn.", file=sys.stderr)
+
+    kaldi_phonemes = IPA_SEGMENTER.segment(ipa_string, on_unmapped=warn_unmapped)
+
     kaldi_phonemes_after_r_rr_heuristics = apply_r_rr_kaldi_heuristics(original_word_for_heuristics.upper(), kaldi_phonemes)
     
     final_kaldi_string = " ".join(p for p in kaldi_phonemes_after_r_rr_heuristics if p)
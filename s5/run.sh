@@ -40,7 +40,7 @@ CORPUS_DOWNLOAD_DIR="CorporaOpenSLR"
 # --- Etapa 0: Data Prep ---
 if [ $stage -le 0 ] && [ $stop_stage -ge 0 ]; then
   echo "=== Etapa 0: Preparación de Datos ==="
-  local/data_prep.sh local/databases.txt "$CORPUS_DOWNLOAD_DIR" || {
+  local/data_prep.sh --nj "$nj" local/databases.txt "$CORPUS_DOWNLOAD_DIR" || {
     echo "Error en data_prep.sh"
     exit 1
   }
@@ -2,15 +2,16 @@
 
 from __future__ import print_function
 import sys
+import os
 import argparse
 import math
-import subprocess
+import io
+import shlex
 from collections import defaultdict
+from multiprocessing import Pool
 
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
-sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'internal'))
+import make_one_biased_lm
 
 parser = argparse.ArgumentParser(description="""
 This script is a wrapper for make_one_biased_lm.py that reads a Kaldi archive
@@ -18,7 +19,9 @@ of (integerized) text data from the standard input and writes a Kaldi archive of
 backoff-language-model FSTs to the standard-output.  It takes care of
 grouping utterances to respect the --min-words-per-graph option.  It writes
 the graphs to the standard output and also outputs a map from input utterance-ids
-to the per-group utterance-ids that index the output graphs.""")
+to the per-group utterance-ids that index the output graphs.  The LMs are
+built in this process (or in --num-jobs worker processes), using the code of
+make_one_biased_lm.py.""")
 
 parser.add_argument("--lm-opts", type = str, default = "",
                     help = "Options to pass in to make_one_biased_lm.py (which "
@@ -27,24 +30,54 @@ parser.add_argument("--min-words-per-graph", type = int, default = 100,
                     help = "Minimum number of words per utterance group; this program "
                     "will try to arrange the input utterances into groups such that each "
                     "one has at least this many words in total.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes that build the LMs of different "
+                    "utterance groups at the same time; the graphs are still "
+                    "written in the order of the input.")
+parser.add_argument("--groups-per-batch", type = int, default = 20,
+                    help = "Number of utterance groups sent to a worker process "
+                    "at a time (only relevant if --num-jobs > 1).")
 parser.add_argument("utterance_map", type = str,
                     help = "Filename to which a map from input utterances to grouped "
                     "utterances, is written")
 
-args = parser.parse_args()
-
-
-
-try:
-    utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
-except:
-    sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
-            args.utterance_map))
-
-# This processes one group of input lines; 'group_of_lines' is
+# The parsed --lm-opts and the contents of their --top-words file.  They are
+# set by Main(), and in the worker processes of the pool by InitWorker(), so
+# the workers get them whatever the multiprocessing start method is.
+lm_args = None
+top_words = None
+
+def InitWorker(worker_lm_args, worker_top_words):
+    global lm_args, top_words
+    lm_args = worker_lm_args
+    top_words = worker_top_words
+
+# This builds the LM of one group of lines, given as the lines of integerized
+# text without the utterance-ids, and returns it as a text-form FST.
+def MakeLmForGroup(texts):
+    fst = io.StringIO()
+    make_one_biased_lm.MakeBiasedLm(lm_args, texts, fst, top_words)
+    return fst.getvalue()
+
+# This builds the LMs of a batch of groups, given as a list of
+# (group-utterance-id, texts), and returns a list of (group-utterance-id, fst).
+# It runs in the worker processes of the pool.
+def MakeLmsForBatch(batch):
+    try:
+        return [ (group_utterance_id, MakeLmForGroup(texts))
+                 for group_utterance_id, texts in batch ]
+    except SystemExit as e:
+        # sys.exit() would kill the worker process, so turn it into an
+        # exception that is passed on to the parent process.
+        raise RuntimeError(str(e.code))
+
+# This splits one group of input lines; 'group_of_lines' is
 # an array of lines of input integerized text, e.g.
 # [ 'utt1 67 89 432', 'utt2 89 48 62' ]
-def ProcessGroupOfLines(group_of_lines):
+# It writes the lines of the utterance-map file for the group, and returns
+# (group-utterance-id, texts), where texts are the lines without the
+# utterance-ids, which are the input to make_one_biased_lm.py.
+def SplitGroupOfLines(group_of_lines, utterance_map_file):
     num_lines = len(group_of_lines)
     try:
         first_utterance_id = group_of_lines[0].split()[0]
@@ -52,53 +85,102 @@ def ProcessGroupOfLines(group_of_lines):
         sys.exit("make_biased_lms.py: empty input line")
 
     group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id, num_lines)
-    # print the group utterance-id to the stdout; it forms the name in
-    # the text-form archive.
-    print(group_utterance_id)
+    texts = []
+    for line in group_of_lines:
+        a = line.split()
+        if len(a) == 0:
+            sys.exit("make_biased_lms.py: empty input line")
+        utterance_id = a[0]
+        # print <utt> <utt-group> to utterance-map file
+        print(utterance_id, group_utterance_id, file = utterance_map_file)
+        texts.append(' '.join(a[1:]) + '\n') # get rid of utterance id.
+    return group_utterance_id, texts
+
+# This prints the FST of one group; the group utterance-id forms the name in
+# the text-form archive, and a blank line terminates the FST in the Kaldi
+# fst-archive format.
+def PrintGroup(group_utterance_id, fst):
+    sys.stdout.write(group_utterance_id + '\n' + fst + '\n')
     sys.stdout.flush()
 
-    try:
-        command = "steps/cleanup/internal/make_one_biased_lm.py " + args.lm_opts
-        p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
-                             stdout = sys.stdout, stderr = sys.stderr)
-        for line in group_of_lines:
-            a = line.split()
-            if len(a) == 0:
-                sys.exit("make_biased_lms.py: empty input line")
-            utterance_id = a[0]
-            # print <utt> <utt-group> to utterance-map file
-            print(utterance_id, group_utterance_id, file = utterance_map_file)
-            rest_of_line = ' '.join(a[1:]) + '\n' # get rid of utterance id.
-            p.stdin.write(rest_of_line.encode('utf-8'))
-        p.stdin.close()
-        assert p.wait() == 0
-    except Exception:
-        sys.stderr.write(
-            "make_biased_lms.py: error calling subprocess, command was: " +
-            command)
-        raise
-    # Print a blank line; this terminates the FST in the Kaldi fst-archive
-    # format.
-    print("")
-    sys.stdout.flush()
-
-
+# This yields the groups of input lines, respecting --min-words-per-graph.
+def GroupsOfLines(min_words_per_graph):
+    num_words_this_group = 0
+    this_group_of_lines = []  # An array of strings, one per line
+
+    while True:
+        line = sys.stdin.readline();
+        num_words_this_group += len(line.split())
+        if line != '':
+            this_group_of_lines.append(line)
+        if num_words_this_group >= min_words_per_graph or \
+            (line == '' and len(this_group_of_lines) != 0):
+            yield this_group_of_lines
+            num_words_this_group = 0
+            this_group_of_lines = []
+        if line == '':
+            break
+
+# This yields batches of --groups-per-batch groups, as lists of
+# (group-utterance-id, texts).
+def BatchesOfGroups(args, utterance_map_file):
+    batch = []
+    for group_of_lines in GroupsOfLines(args.min_words_per_graph):
+        batch.append(SplitGroupOfLines(group_of_lines, utterance_map_file))
+        if len(batch) == args.groups_per_batch:
+            yield batch
+            batch = []
+    if len(batch) != 0:
+        yield batch
+
+
+def Main():
+    global lm_args, top_words
+
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
+
+    args = parser.parse_args()
 
-num_words_this_group = 0
-this_group_of_lines = []  # An array of strings, one per line
+    try:
+        lm_args = make_one_biased_lm.parser.parse_args(shlex.split(args.lm_opts))
+    except SystemExit:
+        sys.exit("make_biased_lms.py: bad --lm-opts: " + args.lm_opts)
+    if lm_args.verbose >= 1:
+        print("make_one_biased_lm.py " + args.lm_opts, file = sys.stderr)
+    # read the --top-words file once, rather than once per group.
+    top_words = (make_one_biased_lm.ReadTopWords(lm_args.top_words)
+                 if lm_args.top_words != None else None)
 
-while True:
-    line = sys.stdin.readline();
-    num_words_this_group += len(line.split())
-    if line != '':
-        this_group_of_lines.append(line)
-    if num_words_this_group >= args.min_words_per_graph or \
-        (line == '' and len(this_group_of_lines) != 0):
-        ProcessGroupOfLines(this_group_of_lines)
-        num_words_this_group = 0
-        this_group_of_lines = []
-    if line == '':
-        break
+    try:
+        utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
+    except:
+        sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
+                args.utterance_map))
+
+    if args.num_jobs <= 1:
+        for group_of_lines in GroupsOfLines(args.min_words_per_graph):
+            group_utterance_id, texts = SplitGroupOfLines(group_of_lines,
+                                                          utterance_map_file)
+            PrintGroup(group_utterance_id, MakeLmForGroup(texts))
+    else:
+        # The batches are built in parallel, but imap() returns them in input
+        # order, so the archive is the same as with --num-jobs=1.
+        pool = Pool(args.num_jobs, initializer = InitWorker,
+                    initargs = (lm_args, top_words))
+        for batch in pool.imap(MakeLmsForBatch,
+                               BatchesOfGroups(args, utterance_map_file)):
+            for group_utterance_id, fst in batch:
+                PrintGroup(group_utterance_id, fst)
+        pool.close()
+        pool.join()
+
+    utterance_map_file.close()
+
+
+if __name__ == "__main__":
+    Main()
 
 
 # test comand [to be run from ../..]
@@ -4,7 +4,10 @@
 # Apache 2.0
 
 from __future__ import print_function
-import sys, gzip, re
+import sys, gzip, re, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'libs'))
+import arpa as arpa_lib
 
 # Parse options,
 if len(sys.argv) != 4:
@@ -20,14 +23,16 @@ words = [ l.split() for l in open(words_txt) ]
 
 # Load the unigram probabilities in 10log from ARPA,
 wrd_log10 = dict()
-with gzip.open(arpa_gz,'r') as f:
-  read = False
-  for l in f:
-    if l.strip() == '\\1-grams:': read = True
-    if l.strip() == '\\2-grams:': break
-    if read and len(l.split())>=2:
-      log10_p_unigram, wrd = re.split('[\t ]+',l.strip(),2)[:2]
-      wrd_log10[wrd] = float(log10_p_unigram)
+with gzip.open(arpa_gz,'rt') as f:
+  reader = arpa_lib.ArpaReader(f)
+  if reader.read_header():
+    for order, lines in reader.sections():
+      if order == 1:
+        for l in lines:
+          if len(l.split())>=2:
+            log10_p_unigram, wrd = re.split('[\t ]+',l.strip(),2)[:2]
+            wrd_log10[wrd] = float(log10_p_unigram)
+      break # only the unigrams are needed,
 
 # Create list, 'wrd id log_p_unigram',
 words_unigram = [[wrd, id, (wrd_log10[wrd] if wrd in wrd_log10 else -99)] for wrd,id in words ]
@@ -0,0 +1,356 @@
+
+
+# Apache 2.0.
+
+""" This module contains a reader and a writer for language models in the ARPA
+format, shared by the scripts that need to read ARPA files (e.g.
+utils/lang/ngram_entropy_pruning.py, utils/lang/compute_sentence_probs_arpa.py,
+utils/lang/internal/arpa2fst_constrained.py, utils/lang/limit_arpa_unk_history.py,
+utils/reverse_arpa.py and steps/conf/parse_arpa_unigrams.py).  These scripts
+put steps/libs itself on sys.path and import this module as 'arpa',
+so that the libs package (and the nnet3 code that its __init__ loads) is not
+imported.  So this module and arpa_cache.py must only import each other, the
+standard library and numpy.
+
+The reader streams the file: it reads the '\\data\\' section, and then gives
+the lines (or the parsed entries) of one '\\N-grams:' section at a time, so a
+script only keeps what it needs.  E.g.:
+
+  with open_arpa(path) as f:
+      reader = ArpaReader(f)
+      if not reader.read_header():
+          sys.exit("no \\data\\ section in " + path)
+      for order, entries in reader.sections(parse=True):
+          for logprob, words, backoff in entries:
+              ...
+
+ArrayArpaModel stores a whole model in a few numpy arrays, which takes much
+less memory than Python dicts and tuples.
+"""
+
+from __future__ import print_function
+import gzip
+import io
+import re
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_count_regex = re.compile(r'^ngram\s+(\d+)\s*=\s*(\d+)$')
+_section_regex = re.compile(r'^\\(\d+)-grams:$')
+
+
+class ArpaFormatError(Exception):
+    pass
+
+
+def open_arpa(path, mode='r', encoding='utf-8', errors=None, newline=None):
+    """ Opens an ARPA file in text mode for reading (mode 'r') or writing
+    (mode 'w').  '-' (or '') means stdin or stdout, and files whose name ends
+    in '.gz' are (de)compressed.  encoding=None means the locale's encoding,
+    and errors and newline are as for open(). """
+    if mode not in ('r', 'w'):
+        raise ValueError("mode must be 'r' or 'w'")
+    if path == '-' or path == '':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        if mode == 'w':
+            stream.flush()
+        return io.open(stream.fileno(), mode, encoding=encoding, errors=errors,
+                       newline=newline, closefd=False)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding=encoding, errors=errors,
+                         newline=newline)
+    return io.open(path, mode, encoding=encoding, errors=errors, newline=newline)
+
+
+def _iter_lines(f, batch_size):
+    while True:
+        lines = f.readlines(batch_size)
+        if not lines:
+            return
+        for line in lines:
+            yield line
+
+
+class ArpaReader(object):
+    """ Reads an ARPA file as a stream from the file object 'f' (in text
+    mode), or from any iterable over the lines of the file (e.g. a list).
+    read_header() reads the '\\data\\' section into self.counts; then
+    sections() gives the '\\N-grams:' sections in file order.  To read a file
+    with several models, call read_header() again after sections() has
+    finished.
+
+    value_type converts the log-probabilities and backoff weights of the
+    parsed entries from strings (e.g. float, the default).
+
+    If track_positions is True, self.line is the last line read (e.g. the
+    line of the entry just given by sections()), self.line_number its index
+    (from 0) and self.line_offset its offset in the file, counted in
+    characters: that is in bytes if each byte is read as one character
+    (e.g. with encoding='latin-1', or 'ascii' with errors='surrogateescape'),
+    and newline='\\n'.
+    """
+    def __init__(self, f, value_type=float, batch_size=1 << 20,
+                 track_positions=False):
+        self.value_type = value_type
+        self.counts = None
+        if hasattr(f, 'readlines'):
+            self._lines = _iter_lines(f, batch_size)
+        else:
+            self._lines = iter(f)
+        if track_positions:
+            self.line = None
+            self.line_number = -1
+            self.line_offset = 0
+            self._lines = self._track_positions(self._lines)
+        # the line that ended the last section (a section header or '\end\'),
+        # which belongs to what follows it.
+        self._pending_line = None
+
+    def _track_positions(self, lines):
+        offset = 0
+        for line_number, line in enumerate(lines):
+            self.line = line
+            self.line_number = line_number
+            self.line_offset = offset
+            offset += len(line)
+            yield line
+
+    def _next_line(self):
+        if self._pending_line is not None:
+            line = self._pending_line
+            self._pending_line = None
+            return line
+        return next(self._lines, None)
+
+    def read_header(self):
+        """ Skips everything before the next '\\data\\' line, and reads the
+        'ngram N=count' lines that follow it into self.counts, as a list of
+        (N, count).  Returns False if the end of the file was reached
+        before a '\\data\\' line. """
+        while True:
+            line = self._next_line()
+            if line is None:
+                return False
+            if line.strip() == '\\data\\':
+                break
+        self.counts = []
+        while True:
+            line = self._next_line()
+            if line is None:
+                raise ArpaFormatError("end of file in the \\data\\ section")
+            stripped = line.strip()
+            if not stripped:
+                if self.counts:
+                    return True
+                continue
+            match = _count_regex.match(stripped)
+            if match:
+                self.counts.append((int(match.group(1)), int(match.group(2))))
+            elif stripped[0] == '\\':
+                # a section header or \end\ without an empty line before it.
+                self._pending_line = line
+                return True
+            else:
+                raise ArpaFormatError("bad line in the \\data\\ section: " + stripped)
+
+    def sections(self, parse=False):
+        """ Yields (order, items) for each '\\N-grams:' section, up to the
+        '\\end\\' line.  If parse is False, items iterates over the lines of
+        the section as they are in the file (with their newline); if it is
+        True, it iterates over the entries of the section, as tuples
+        (logprob, words, backoff), where words is a tuple of strings and
+        backoff is None if the entry has no backoff weight.  A section ends at
+        an empty line or at the next section header.  Whatever the caller
+        does not read of a section is skipped. """
+        while True:
+            line = self._next_line()
+            if line is None:
+                raise ArpaFormatError("end of file before \\end\\")
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped == '\\end\\':
+                return
+            match = _section_regex.match(stripped)
+            if not match:
+                raise ArpaFormatError("expected a section header or \\end\\, got: " + stripped)
+            order = int(match.group(1))
+            items = self._entries(order) if parse else self._section_lines()
+            yield order, items
+            for _ in items:
+                pass
+
+    def remaining_lines(self):
+        """ Yields the lines that have not been read yet, e.g. what follows
+        '\\end\\' once sections() has finished. """
+        while True:
+            line = self._next_line()
+            if line is None:
+                return
+            yield line
+
+    def entries(self):
+        """ Yields (order, logprob, words, backoff) for all the entries of the
+        model; see sections(). """
+        for order, entries in self.sections(parse=True):
+            for logprob, words, backoff in entries:
+                yield order, logprob, words, backoff
+
+    def _section_lines(self):
+        while True:
+            line = self._next_line()
+            if line is None:
+                return
+            stripped = line.strip()
+            if not stripped:
+                return
+            if stripped[0] == '\\':
+                self._pending_line = line
+                return
+            yield line
+
+    def _entries(self, order):
+        value_type = self.value_type
+        without_backoff = order + 1
+        with_backoff = order + 2
+        if self._pending_line is not None:
+            lines = [self._next_line()]
+        else:
+            lines = ()
+        for lines in (lines, self._lines):
+            for line in lines:
+                fields = line.split()
+                num_fields = len(fields)
+                if num_fields == without_backoff:
+                    yield value_type(fields[0]), tuple(fields[1:]), None
+                elif num_fields == with_backoff:
+                    yield (value_type(fields[0]), tuple(fields[1:without_backoff]),
+                           value_type(fields[without_backoff]))
+                elif num_fields == 0:
+                    return
+                elif fields[0][0] == '\\':
+                    self._pending_line = line
+                    return
+                else:
+                    raise ArpaFormatError("bad line in the {0}-grams section: {1}".format(
+                        order, line.strip()))
+
+
+def write_arpa(f, counts, sections, batch_size=100000):
+    """ Writes a model in ARPA format to the file object 'f', in the same
+    layout as SRILM (starting with an empty line).  counts is a list of
+    (order, count), and sections an iterable of (order, entries), where
+    entries is an iterable of (logprob, words, backoff) like the ones
+    given by ArpaReader; words may be a tuple of strings or a string, and
+    backoff None.  The numbers are written with '{}'.format(). """
+    f.write('\n\\data\\\n')
+    for order, count in counts:
+        f.write('ngram {0}={1}\n'.format(order, count))
+    f.write('\n')
+    for order, entries in sections:
+        f.write('\\{0}-grams:\n'.format(order))
+        lines = []
+        for logprob, words, backoff in entries:
+            if not isinstance(words, str):
+                words = ' '.join(words)
+            if backoff is None:
+                lines.append('{0}\t{1}\n'.format(logprob, words))
+            else:
+                lines.append('{0}\t{1}\t{2}\n'.format(logprob, words, backoff))
+            if len(lines) >= batch_size:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+        f.write('\n')
+    f.write('\\end\\\n')
+
+
+class _WordIds(dict):
+    def __init__(self):
+        super(_WordIds, self).__init__()
+        self.words = []
+
+    def __missing__(self, word):
+        word_id = len(self.words)
+        self[word] = word_id
+        self.words.append(word)
+        return word_id
+
+
+class ArrayArpaModel(object):
+    """ A model read from an ARPA file and stored in numpy arrays:
+
+    words       list of the words, in order of first appearance
+    word_ids    dict from word to its index in 'words'
+    counts      list of (order, count) from the '\\data\\' section
+    orders      the orders of the sections, in file order
+    ids         dict from order N to an int32 array of shape (num_entries, N)
+                with the word ids of the entries, in file order
+    logprobs    dict from order to a float64 array with the log-probabilities
+    backoffs    dict from order to a float64 array with the backoff weights
+                (NaN for entries without one)
+
+    The entries are read into compact arrays as the file is read, so this
+    needs far less memory than a dict of tuples.
+    """
+    def __init__(self, f, chunk_size=65536):
+        assert np is not None, "ArrayArpaModel requires numpy"
+        reader = ArpaReader(f)
+        if not reader.read_header():
+            raise ArpaFormatError("no \\data\\ section")
+        self.counts = reader.counts
+        self.orders = []
+        self.ids = {}
+        self.logprobs = {}
+        self.backoffs = {}
+        word_ids = _WordIds()
+        get_id = word_ids.__getitem__
+        nan = float('nan')
+        for order, entries in reader.sections(parse=True):
+            ids = array('i')
+            logprobs = array('d')
+            backoffs = array('d')
+            # the entries are gathered in small lists, which are moved to the
+            # arrays in bulk.
+            words = []
+            chunk_logprobs = []
+            chunk_backoffs = []
+            for logprob, ngram, backoff in entries:
+                words.extend(ngram)
+                chunk_logprobs.append(logprob)
+                chunk_backoffs.append(backoff)
+                if len(chunk_logprobs) == chunk_size:
+                    ids.extend(map(get_id, words))
+                    logprobs.extend(chunk_logprobs)
+                    backoffs.extend([nan if b is None else b for b in chunk_backoffs])
+                    words = []
+                    chunk_logprobs = []
+                    chunk_backoffs = []
+            ids.extend(map(get_id, words))
+            logprobs.extend(chunk_logprobs)
+            backoffs.extend([nan if b is None else b for b in chunk_backoffs])
+            self.orders.append(order)
+            self.ids[order] = np.frombuffer(ids, dtype=np.int32).reshape(-1, order)
+            self.logprobs[order] = np.frombuffer(logprobs, dtype=np.float64)
+            self.backoffs[order] = np.frombuffer(backoffs, dtype=np.float64)
+        self.words = word_ids.words
+        self.word_ids = dict(word_ids)
+
+    def entries(self, order):
+        """ Yields the entries of an order as (logprob, words, backoff) tuples,
+        as ArpaReader does. """
+        words = self.words
+        for ids, logprob, backoff in zip(self.ids[order].tolist(),
+                                         self.logprobs[order].tolist(),
+                                         self.backoffs[order].tolist()):
+            yield (logprob, tuple(words[i] for i in ids),
+                   None if backoff != backoff else backoff)
+
+    def write(self, f):
+        write_arpa(f, [(order, len(self.logprobs[order])) for order in self.orders],
+                   ((order, self.entries(order)) for order in self.orders))
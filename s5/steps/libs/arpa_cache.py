@@ -0,0 +1,255 @@
+
+
+# Apache 2.0.
+
+""" This module implements a binary, memory-mappable cache of parsed ARPA
+language models, shared by utils/lang/ngram_entropy_pruning.py,
+utils/lang/compute_sentence_probs_arpa.py and
+utils/lang/limit_arpa_unk_history.py.
+
+The first time a model is loaded, the ARPA text is parsed once and stored in
+<cache-dir>/<sha256 of the ARPA file>/ as numpy arrays (one set per n-gram
+order) plus a small JSON header; after that, loading the same file only hashes
+it and memory-maps the arrays, which is much faster than parsing the text.
+
+The file is read with arpa.ArpaReader, and only cached if all its entries
+are in the canonical layout 'logprob<TAB>w1 w2 ...' with an optional
+'<TAB>backoff', and it has '\\n' line endings (no '\\r' anywhere).
+load_arpa_cache() raises ArpaCacheError for anything else, and the callers
+then parse the text as they did before, so using the cache never changes
+their output.
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+try:
+    from . import arpa as arpa_lib
+except ImportError:
+    # loaded as a top-level module, from the steps/libs directory
+    import arpa as arpa_lib
+
+CACHE_VERSION = 1
+
+# flags stored for each entry
+LOGP_IS_INT = 1     # the log-prob is written as an integer, e.g. "-99"
+BOW_IS_INT = 2      # the backoff weight is written as an integer
+HAS_BOW = 4         # the entry has a backoff weight
+
+_number_regex = re.compile(r'^-?\d+(?:\.\d+)?(?:[eE]-?\d+)?$')
+
+# The files are read with each byte as one character, so that the offsets
+# counted by ArpaReader are byte offsets; bytes above 127 become lone
+# surrogates, which (unlike e.g. a latin-1 no-break space) never count as
+# whitespace.  Lines are only split at '\n'.
+_TEXT_OPTIONS = {'encoding': 'ascii', 'errors': 'surrogateescape', 'newline': '\n'}
+
+
+class ArpaCacheError(Exception):
+    """ Raised when an ARPA file cannot be represented in the cache (or the
+    cache cannot be used); callers fall back to parsing the text. """
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_int_text(text):
+    # same test as ArpaParser._float_or_int() in ngram_entropy_pruning.py
+    return str(int(float(text))) == text
+
+
+def _lines_without_cr(lines):
+    for line_index, line in enumerate(lines):
+        if '\r' in line:
+            raise ArpaCacheError("line {0}: '\\r' in line".format(line_index + 1))
+        yield line
+
+
+def parse_arpa(f):
+    """ Parses an ARPA model with arpa.ArpaReader, from a text file object
+    opened with _TEXT_OPTIONS.  Returns a tuple (header, words, sections),
+    where 'words' is the list of distinct words (bytes) in order of first
+    appearance and 'sections' maps each order to a dict of arrays with one
+    element per entry, in file order:
+      'ids'     (num_entries, order) int32 word ids
+      'logp'    float64 log10-probabilities
+      'bow'     float64 log10-backoff weights (0 where there is none)
+      'flags'   uint8 combination of LOGP_IS_INT, BOW_IS_INT and HAS_BOW
+      'line'    int64 index of the line in the file
+      'offset'  int64 byte offset of the line in the file
+    Every entry must be in the canonical layout 'logprob<TAB>w1 w2 ...' with an
+    optional '<TAB>backoff', so that it is read the same way by any parser.
+    """
+    first_line = f.readline()
+    reader = arpa_lib.ArpaReader(
+        _lines_without_cr(itertools.chain([first_line], f)),
+        value_type=str, track_positions=True)
+    word_ids = arpa_lib._WordIds()
+    sections = []
+    arrays = {}
+    try:
+        if not reader.read_header():
+            raise ArpaCacheError("no \\data\\ section")
+        counts = reader.counts
+        for order, entries in reader.sections(parse=True):
+            if order in arrays or order not in dict(counts):
+                raise ArpaCacheError("line {0}: unexpected section".format(
+                    reader.line_number + 1))
+            sections.append([order, reader.line_number])
+            ids, logps, bows, lines, offsets = [], [], [], [], []
+            for logp, words, bow in entries:
+                layout = logp + '\t' + ' '.join(words)
+                if bow is not None:
+                    layout += '\t' + bow
+                if (reader.line != layout + '\n' or not _number_regex.match(logp) or
+                        (bow is not None and not _number_regex.match(bow))):
+                    raise ArpaCacheError("line {0}: bad entry".format(
+                        reader.line_number + 1))
+                ids.extend(map(word_ids.__getitem__, words))
+                logps.append(logp)
+                bows.append(bow)
+                lines.append(reader.line_number)
+                offsets.append(reader.line_offset)
+            flags = np.array([(LOGP_IS_INT if _is_int_text(p) else 0) |
+                              (0 if b is None else HAS_BOW | (BOW_IS_INT if _is_int_text(b) else 0))
+                              for p, b in zip(logps, bows)], dtype=np.uint8)
+            arrays[order] = {
+                'ids': np.array(ids, dtype=np.int32).reshape(-1, order),
+                'logp': np.array(list(map(float, logps)), dtype=np.float64),
+                'bow': np.array([0.0 if b is None else float(b) for b in bows], dtype=np.float64),
+                'flags': flags,
+                'line': np.array(lines, dtype=np.int64),
+                'offset': np.array(offsets, dtype=np.int64),
+            }
+        for _ in reader.remaining_lines():
+            pass
+    except arpa_lib.ArpaFormatError as e:
+        raise ArpaCacheError(str(e))
+
+    header = {
+        'version': CACHE_VERSION,
+        'counts': counts,
+        'sections': sections,
+        'first_line': first_line.encode('ascii', 'surrogateescape').decode('latin-1'),
+        'num_lines': reader.line_number + 1,
+    }
+    words = [w.encode('ascii', 'surrogateescape') for w in word_ids.words]
+    return header, words, arrays
+
+
+class CachedArpa(object):
+    """ A parsed ARPA model, as loaded from the cache.
+
+    counts      list of (order, count) from the '\\data\\' section
+    sections    list of (order, index of the '\\N-grams:' line), in file order
+    first_line  the first line of the file (decoded as latin-1)
+    num_lines   number of lines in the file
+    words       list of the distinct words, as bytes
+    ngrams      dict order -> dict of (memory-mapped) arrays; see parse_arpa()
+    """
+    def __init__(self, header, words, ngrams):
+        self.counts = [tuple(c) for c in header['counts']]
+        self.sections = [tuple(s) for s in header['sections']]
+        self.first_line = header['first_line']
+        self.num_lines = header['num_lines']
+        self.words = words
+        self.ngrams = ngrams
+
+    def decoded_words(self, encoding):
+        """ Returns the words decoded with 'encoding'.  Raises ArpaCacheError if
+        a word cannot be decoded or contains whitespace once decoded (e.g. a
+        no-break space), as text parsers would then split it differently. """
+        try:
+            words = [w.decode(encoding) for w in self.words]
+        except (UnicodeDecodeError, LookupError) as e:
+            raise ArpaCacheError(str(e))
+        for w in words:
+            if not w or any(c.isspace() for c in w):
+                raise ArpaCacheError("word {0!r} contains whitespace".format(w))
+        return words
+
+
+def _write_cache(entry_dir, header, words, arrays):
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp.')
+    try:
+        with open(os.path.join(tmp_dir, 'words.txt'), 'wb') as f:
+            f.write(b'\n'.join(words))
+        for order, fields in arrays.items():
+            for name, array in fields.items():
+                np.save(os.path.join(tmp_dir, '{0}.{1}.npy'.format(order, name)), array)
+        # the header is written last: an entry is complete iff it has one.
+        with open(os.path.join(tmp_dir, 'header.json'), 'w') as f:
+            json.dump(header, f)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            pass  # someone else stored the same model meanwhile
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_cache(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, 'header.json')) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if header.get('version') != CACHE_VERSION:
+        return None
+    with open(os.path.join(entry_dir, 'words.txt'), 'rb') as f:
+        data = f.read()
+    words = data.split(b'\n') if data else []
+    ngrams = {}
+    for order, _ in header['sections']:
+        ngrams[order] = {
+            name: np.load(os.path.join(entry_dir, '{0}.{1}.npy'.format(order, name)), mmap_mode='r')
+            for name in ('ids', 'logp', 'bow', 'flags', 'line', 'offset')}
+    return CachedArpa(header, words, ngrams)
+
+
+def load_arpa_cache(arpa_path, cache_dir, data=None):
+    """ Returns the CachedArpa for the ARPA file 'arpa_path' (plain or .gz),
+    parsing it and storing it in 'cache_dir' if it is not cached yet.  If
+    'data' is given, it is the content of the file (e.g. read from stdin) and
+    'arpa_path' is not used.  Raises ArpaCacheError if the model cannot be
+    cached. """
+    if data is not None:
+        key = hashlib.sha256(data).hexdigest()
+    else:
+        key = file_sha256(arpa_path)
+    entry_dir = os.path.join(cache_dir, key)
+    model = _read_cache(entry_dir)
+    if model is not None:
+        return model
+
+    if data is not None:
+        f = io.TextIOWrapper(io.BytesIO(data), **_TEXT_OPTIONS)
+    else:
+        f = arpa_lib.open_arpa(arpa_path, **_TEXT_OPTIONS)
+    with f:
+        header, words, arrays = parse_arpa(f)
+    try:
+        _write_cache(entry_dir, header, words, arrays)
+    except OSError:
+        pass  # could not write the cache; the parsed model is still usable
+    model = _read_cache(entry_dir)
+    if model is None:
+        model = CachedArpa(header, words, arrays)
+    return model
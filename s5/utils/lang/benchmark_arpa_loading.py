@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Apache 2.0.
+
+# This script measures the time and the peak memory (RSS) needed to load an
+# ARPA language model in different ways, each in a fresh process:
+#   none        nothing is loaded (the memory of the interpreter and imports)
+#   readlines   the whole file is read with readlines() and every n-gram line is
+#               split into a dict from the joined words to (logprob, backoff),
+#               which is how the scripts used to read ARPA files
+#   stream      the entries are parsed with steps/libs/arpa.py and discarded
+#   dict        the entries are parsed with steps/libs/arpa.py into a dict from
+#               tuples of words to (logprob, backoff)
+#   arrays      the model is read into an ArrayArpaModel (needs numpy)
+#
+# E.g.: utils/lang/benchmark_arpa_loading.py data/local/lm/lm.arpa.gz
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'steps', 'libs'))
+import arpa as arpa_lib
+
+LOADERS = ['none', 'readlines', 'stream', 'dict', 'arrays']
+
+parser = argparse.ArgumentParser(
+    description="Prints the time and peak RSS of loading an ARPA language model "
+    "with each loader (" + ", ".join(LOADERS) + "), each in a new process.")
+parser.add_argument("arpa", type=str,
+                    help="The ARPA file (may be gzipped)")
+parser.add_argument("--loaders", type=str, default=",".join(LOADERS),
+                    help="Comma-separated list of the loaders to measure")
+parser.add_argument("--loader", type=str, default=None, choices=LOADERS,
+                    help=argparse.SUPPRESS)  # used internally, for one measurement
+
+
+def load(loader, path):
+    """ Loads the model in 'path' with 'loader'; returns the number of entries
+    loaded and the model (which is kept alive until the measurement ends). """
+    if loader == 'none':
+        return 0, None
+    with arpa_lib.open_arpa(path) as f:
+        if loader == 'readlines':
+            model = {}
+            for line in f.readlines():
+                fields = line.split()
+                if len(fields) >= 2 and fields[0][0] == '-':
+                    model[' '.join(fields[1:])] = float(fields[0])
+            return len(model), model
+        if loader == 'arrays':
+            model = arpa_lib.ArrayArpaModel(f)
+            return sum(len(model.logprobs[order]) for order in model.orders), model
+        reader = arpa_lib.ArpaReader(f)
+        if not reader.read_header():
+            sys.exit("benchmark_arpa_loading.py: no \\data\\ section in " + path)
+        if loader == 'stream':
+            num_entries = 0
+            for order, entries in reader.sections(parse=True):
+                for _ in entries:
+                    num_entries += 1
+            return num_entries, None
+        model = {}
+        for order, entries in reader.sections(parse=True):
+            for logprob, words, backoff in entries:
+                model[words] = (logprob, backoff)
+        return len(model), model
+
+
+def main():
+    args = parser.parse_args()
+    if args.loader is not None:
+        start_time = time.time()
+        num_entries, model = load(args.loader, args.arpa)
+        elapsed = time.time() - start_time
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("{0} {1:.3f} {2}".format(num_entries, elapsed, peak_rss_kb))
+        return
+
+    loaders = [l for l in args.loaders.split(',') if l]
+    for loader in loaders:
+        if loader not in LOADERS:
+            sys.exit("benchmark_arpa_loading.py: unknown loader " + loader)
+    print("{0:<10}  {1:>10}  {2:>8}  {3:>13}".format(
+        "loader", "entries", "time(s)", "peak RSS(MB)"))
+    for loader in loaders:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "--loader", loader, args.arpa],
+            universal_newlines=True)
+        num_entries, elapsed, peak_rss_kb = output.split()
+        print("{0:<10}  {1:>10}  {2:>8}  {3:>13.1f}".format(
+            loader, num_entries, elapsed, int(peak_rss_kb) / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
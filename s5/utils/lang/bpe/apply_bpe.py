@@ -19,6 +19,11 @@ import codecs
 import io
 import argparse
 import re
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from multiprocessing import Pool
 
 # hack for python2/3 compatibility
 from io import open
@@ -26,7 +31,7 @@ argparse.open = open
 
 class BPE(object):
 
-    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None):
+    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None, cache_size=1000000):
 
         codes.seek(0)
 
@@ -57,7 +62,69 @@ class BPE(object):
 
         self.glossaries = glossaries if glossaries else []
 
-        self.cache = {}
+        # cache of segmented words (word -> output string), with at most cache_size entries
+        self.cache = LRUCache(cache_size)
+
+        # words segmented since the last call to take_new_cache_entries(), if it is a list
+        self.new_cache_entries = None
+
+        self._compile_codes()
+
+    def _compile_codes(self):
+        """precompute the merge operations as a table indexed by integer symbol ids:
+        key (id(first) << 32 | id(second)) -> value (rank << 32 | id(first+second)),
+        so the smallest value among the pairs of a word is the next merge"""
+        self._symbol_ids = {}
+        self._symbols = []
+        self._merge_table = {}
+        for (first, second), rank in sorted(self.bpe_codes.items(), key=lambda x: x[1]):
+            key = self._symbol_id(first) << 32 | self._symbol_id(second)
+            self._merge_table[key] = rank << 32 | self._symbol_id(first + second)
+
+    def _symbol_id(self, symbol):
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self._symbols)
+            self._symbol_ids[symbol] = symbol_id
+            self._symbols.append(symbol)
+        return symbol_id
+
+    def fingerprint(self):
+        """hash of everything the segmentation of a word depends on"""
+        h = hashlib.sha1()
+        h.update(repr((self.version,
+                       sorted(self.bpe_codes.items(), key=lambda x: x[1]),
+                       self.separator,
+                       sorted(self.vocab) if self.vocab else None,
+                       self.glossaries)).encode('utf-8'))
+        return h.hexdigest()
+
+    def load_cache(self, path):
+        """load segmented words saved by save_cache(), if they were segmented with the same codes and options"""
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('fingerprint') != self.fingerprint():
+            return
+        for word, output in data['entries']:
+            self.cache[word] = output
+
+    def save_cache(self, path):
+        """save the cached words (least recently used first)"""
+        data = {'fingerprint': self.fingerprint(),
+                'entries': list(self.cache.items())}
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False))
+        os.rename(tmp_path, path)
+
+    def take_new_cache_entries(self):
+        """return the (word, output) pairs segmented since the last call"""
+        entries = self.new_cache_entries
+        self.new_cache_entries = []
+        return entries
 
     def process_line(self, line):
         """segment line, dealing with leading and trailing whitespace"""
@@ -79,26 +146,103 @@ class BPE(object):
     def segment(self, sentence):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
         output = []
+        cache = self.cache
         for word in sentence.strip().split(' '):
             # eliminate double spaces
             if not word:
                 continue
-            new_word = [out for segment in self._isolate_glossaries(word)
-                        for out in encode(segment,
-                                          self.bpe_codes,
-                                          self.bpe_codes_reverse,
-                                          self.vocab,
-                                          self.separator,
-                                          self.version,
-                                          self.cache,
-                                          self.glossaries)]
-
-            for item in new_word[:-1]:
-                output.append(item + self.separator)
-            output.append(new_word[-1])
+            try:
+                output.append(cache[word])
+            except KeyError:
+                segmented = self.segment_word(word)
+                cache[word] = segmented
+                if self.new_cache_entries is not None:
+                    self.new_cache_entries.append((word, segmented))
+                output.append(segmented)
 
         return ' '.join(output)
 
+    def segment_word(self, word):
+        """segment a single word; non-final subword units are followed by the separator"""
+        new_word = [out for segment in self._isolate_glossaries(word)
+                    for out in self._encode(segment)]
+        return (self.separator + ' ').join(new_word)
+
+    def _encode(self, orig):
+        """same as encode(), with the merge operations applied on integer symbol ids"""
+        if orig in self.glossaries:
+            return (orig,)
+
+        if self.version == (0, 1):
+            symbols = list(orig) + ['</w>']
+        elif self.version == (0, 2): # more consistent handling of word-final segments
+            symbols = list(orig[:-1]) + [orig[-1] + '</w>']
+        else:
+            raise NotImplementedError
+
+        if len(symbols) == 1:
+            return (orig,)
+
+        symbol_id = self._symbol_id
+        merge_table = self._merge_table
+        ids = [symbol_id(symbol) for symbol in symbols]
+        while len(ids) > 1:
+            best = None
+            for i in range(len(ids) - 1):
+                key = ids[i] << 32 | ids[i+1]
+                value = merge_table.get(key)
+                if value is not None and (best is None or value < best):
+                    best = value
+                    best_key = key
+            if best is None:
+                break
+            first = best_key >> 32
+            second = best_key & 0xffffffff
+            merged = best & 0xffffffff
+            new_ids = []
+            i = 0
+            while i < len(ids):
+                if ids[i] == first and i < len(ids)-1 and ids[i+1] == second:
+                    new_ids.append(merged)
+                    i += 2
+                else:
+                    new_ids.append(ids[i])
+                    i += 1
+            ids = new_ids
+
+        word = [self._symbols[i] for i in ids]
+
+        # don't print end-of-word symbols
+        if word[-1] == '</w>':
+            word = word[:-1]
+        elif word[-1].endswith('</w>'):
+            word = word[:-1] + [word[-1].replace('</w>','')]
+
+        if self.vocab:
+            word = check_vocab_and_split(word, self.bpe_codes_reverse, self.vocab, self.separator)
+
+        return word
+
+    def segment_file(self, infile, outfile, num_workers=1, chunk_size=10000):
+        """segment every line of infile into outfile, like process_line();
+        with num_workers > 1, chunks of chunk_size lines are segmented in worker processes
+        (the output keeps the order of the input)"""
+        if num_workers <= 1:
+            for line in infile:
+                outfile.write(self.process_line(line))
+            return
+
+        pool = Pool(num_workers, _init_worker, (self,))
+        try:
+            for output, new_entries in pool.imap(_process_chunk, _read_chunks(infile, chunk_size)):
+                outfile.write(''.join(output))
+                cache = self.cache
+                for word, segmented in new_entries:
+                    cache[word] = segmented
+        finally:
+            pool.close()
+            pool.join()
+
     def _isolate_glossaries(self, word):
         word_segments = [word]
         for gloss in self.glossaries:
@@ -106,6 +250,46 @@ class BPE(object):
                                  for out_segments in isolate_glossary(segment, gloss)]
         return word_segments
 
+class LRUCache(OrderedDict):
+    """dict with at most max_size entries, which drops the least recently used entry when full"""
+
+    def __init__(self, max_size):
+        super(LRUCache, self).__init__()
+        self.max_size = max_size
+
+    def __getitem__(self, key):
+        value = super(LRUCache, self).__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super(LRUCache, self).__setitem__(key, value)
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+
+_worker_bpe = None
+
+def _init_worker(bpe):
+    global _worker_bpe
+    _worker_bpe = bpe
+    _worker_bpe.new_cache_entries = []
+
+def _process_chunk(lines):
+    output = [_worker_bpe.process_line(line) for line in lines]
+    return output, _worker_bpe.take_new_cache_entries()
+
+def _read_chunks(infile, chunk_size):
+    chunk = []
+    for line in infile:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 def create_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -144,6 +328,19 @@ def create_parser():
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--cache-file', type=str, default=None,
+        metavar="PATH",
+        help="File where the segmented words are kept across runs. It is read at start-up "+
+             "(and ignored if it was made with other codes or options) and rewritten at the end")
+    parser.add_argument(
+        '--cache-size', type=int, default=1000000,
+        metavar="INT",
+        help="Maximum number of segmented words kept in memory (default: %(default)s)")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        metavar="INT",
+        help="Number of processes that segment the input (default: %(default)s)")
 
     return parser
 
@@ -334,7 +531,11 @@ if __name__ == '__main__':
     else:
         vocabulary = None
 
-    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries)
+    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries, args.cache_size)
+    if args.cache_file:
+        bpe.load_cache(args.cache_file)
+
+    bpe.segment_file(args.input, args.output, args.num_workers)
 
-    for line in args.input:
-        args.output.write(bpe.process_line(line))
+    if args.cache_file:
+        bpe.save_cache(args.cache_file)
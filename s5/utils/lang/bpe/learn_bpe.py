@@ -19,7 +19,7 @@ from __future__ import print_function
 import sys
 import codecs
 import re
-import copy
+import heapq
 import argparse
 from collections import defaultdict, Counter
 
@@ -68,16 +68,18 @@ def get_vocabulary(fobj, is_dict=False):
                 sys.exit(1)
             vocab[word] += int(count)
         else:
-            for word in line.strip().split(' '):
-                if word:
-                    vocab[word] += 1
+            vocab.update(line.strip().split(' '))
+    # empty strings come from repeated spaces and empty lines
+    if not is_dict:
+        del vocab['']
     return vocab
 
-def update_pair_statistics(pair, changed, stats, indices):
+def update_pair_statistics(pair, changed, stats, indices, updated=None):
     """Minimally update the indices and frequency of symbol pairs
 
     if we merge a pair of symbols, only pairs that overlap with occurrences
     of this pair are affected, and need to be updated.
+    if updated is a set, the pairs whose frequency changed are added to it.
     """
     stats[pair] = 0
     indices[pair] = defaultdict(int)
@@ -99,6 +101,8 @@ def update_pair_statistics(pair, changed, stats, indices):
                 if i:
                     prev = old_word[i-1:i+1]
                     stats[prev] -= freq
+                    if updated is not None:
+                        updated.add(prev)
                     indices[prev][j] -= 1
                 if i < len(old_word)-2:
                     # assuming a symbol sequence "A B C B", if "B C" is merged, reduce the frequency of "C B".
@@ -106,6 +110,8 @@ def update_pair_statistics(pair, changed, stats, indices):
                     if old_word[i+2] != first or i >= len(old_word)-3 or old_word[i+3] != second:
                         nex = old_word[i+1:i+3]
                         stats[nex] -= freq
+                        if updated is not None:
+                            updated.add(nex)
                         indices[nex][j] -= 1
                 i += 2
             else:
@@ -122,12 +128,16 @@ def update_pair_statistics(pair, changed, stats, indices):
             if i:
                 prev = word[i-1:i+1]
                 stats[prev] += freq
+                if updated is not None:
+                    updated.add(prev)
                 indices[prev][j] += 1
             # assuming a symbol sequence "A BC B", if "B C" is merged, increase the frequency of "BC B"
             # however, if the sequence is A BC BC, skip this step because the count of "BC BC" will be incremented by the previous code block
             if i < len(word)-1 and word[i+1] != new_pair:
                 nex = word[i:i+2]
                 stats[nex] += freq
+                if updated is not None:
+                    updated.add(nex)
                 indices[nex][j] += 1
             i += 1
 
@@ -151,13 +161,18 @@ def get_pair_statistics(vocab):
     return stats, indices
 
 
-def replace_pair(pair, vocab, indices):
-    """Replace all occurrences of a symbol pair ('A', 'B') with a new symbol 'AB'"""
+def replace_pair(pair, vocab, indices, plain_symbols=False):
+    """Replace all occurrences of a symbol pair ('A', 'B') with a new symbol 'AB'
+
+    if plain_symbols is True (no symbol contains whitespace), the symbols are replaced
+    in the word tuples directly, which gives the same result as the regular expression
+    """
     first, second = pair
     pair_str = ''.join(pair)
-    pair_str = pair_str.replace('\\','\\\\')
     changes = []
-    pattern = re.compile(r'(?<!\S)' + re.escape(first + ' ' + second) + r'(?!\S)')
+    if not plain_symbols:
+        pattern = re.compile(r'(?<!\S)' + re.escape(first + ' ' + second) + r'(?!\S)')
+        escaped_pair_str = pair_str.replace('\\','\\\\')
     if sys.version_info < (3, 0):
         iterator = indices[pair].iteritems()
     else:
@@ -166,29 +181,84 @@ def replace_pair(pair, vocab, indices):
         if freq < 1:
             continue
         word, freq = vocab[j]
-        new_word = ' '.join(word)
-        new_word = pattern.sub(pair_str, new_word)
-        new_word = tuple(new_word.split(' '))
+        if plain_symbols:
+            new_word = []
+            i = 0
+            while True:
+                try:
+                    k = word.index(first, i)
+                except ValueError:
+                    break
+                if k < len(word)-1 and word[k+1] == second:
+                    new_word.extend(word[i:k])
+                    new_word.append(pair_str)
+                    i = k + 2
+                else:
+                    new_word.extend(word[i:k+1])
+                    i = k + 1
+            new_word.extend(word[i:])
+            new_word = tuple(new_word)
+        else:
+            new_word = ' '.join(word)
+            new_word = pattern.sub(escaped_pair_str, new_word)
+            new_word = tuple(new_word.split(' '))
 
         vocab[j] = (new_word, freq)
         changes.append((j, new_word, word, freq))
 
     return changes
 
-def prune_stats(stats, big_stats, threshold):
-    """Prune statistics dict for efficiency of max()
+class ReversedPair(tuple):
+    """A symbol pair that compares in reverse order, so that among pairs of
+    equal frequency the min-heap pops the largest one, as max() would pick it
+    """
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return tuple.__gt__(self, other)
+
 
-    The frequency of a symbol pair never increases, so pruning is generally safe
-    (until we the most frequent pair is less frequent than a pair we previously pruned)
-    big_stats keeps full statistics for when we need to access pruned items
+class PairHeap(object):
+    """Priority queue of symbol pairs by frequency, with lazy deletion
+
+    an entry (-frequency, pair) is pushed whenever the frequency of a pair changes;
+    entries whose frequency is no longer the one in stats are skipped when they reach
+    the top. Pairs less frequent than min_frequency are not queued.
     """
-    for item,freq in list(stats.items()):
-        if freq < threshold:
-            del stats[item]
-            if freq < 0:
-                big_stats[item] += freq
-            else:
-                big_stats[item] = freq
+    def __init__(self, stats, min_frequency):
+        self.stats = stats
+        self.min_frequency = min_frequency
+        self.rebuild()
+
+    def rebuild(self):
+        self.heap = [(-freq, ReversedPair(pair)) for pair, freq in self.stats.items()
+                     if freq >= self.min_frequency]
+        heapq.heapify(self.heap)
+
+    def update(self, pairs):
+        """Queue the current frequency of pairs"""
+        stats = self.stats
+        heap = self.heap
+        for pair in pairs:
+            freq = stats[pair]
+            if freq >= self.min_frequency:
+                heapq.heappush(heap, (-freq, ReversedPair(pair)))
+        # drop the outdated entries once they outnumber the pairs
+        if len(heap) > 2 * len(stats) + 1000:
+            self.rebuild()
+
+    def most_frequent(self):
+        """Return the most frequent pair (the largest one among ties),
+        or None if no pair has frequency >= min_frequency
+        """
+        stats = self.stats
+        heap = self.heap
+        while heap:
+            neg_freq, pair = heap[0]
+            if stats[pair] == -neg_freq:
+                return tuple(pair)
+            heapq.heappop(heap)
+        return None
 
 
 def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
@@ -204,34 +274,26 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
     stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
-    # threshold is inspired by Zipfian assumption, but should only affect speed
-    threshold = max(stats.values()) / 10
+    # words with whitespace other than ' ' (e.g. tabs) need the regular expression in replace_pair()
+    plain_symbols = not any(re.search(r'\s', ''.join(word)) for word, _ in sorted_vocab)
+    # the pairs are kept in a heap by frequency, so each merge costs O(log n)
+    # instead of a scan over all pairs
+    pair_heap = PairHeap(stats, min_frequency)
     for i in range(num_symbols):
-        if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-
-        # we probably missed the best pair because of pruning; go back to full statistics
-        if not stats or (i and stats[most_frequent] < threshold):
-            prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-            # threshold is inspired by Zipfian assumption, but should only affect speed
-            threshold = stats[most_frequent] * i/(i+10000.0)
-            prune_stats(stats, big_stats, threshold)
-
-        if stats[most_frequent] < min_frequency:
+        most_frequent = pair_heap.most_frequent()
+        if most_frequent is None:
             sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
             break
 
         if verbose:
             sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
         outfile.write('{0} {1}\n'.format(*most_frequent))
-        changes = replace_pair(most_frequent, sorted_vocab, indices)
-        update_pair_statistics(most_frequent, changes, stats, indices)
+        changes = replace_pair(most_frequent, sorted_vocab, indices, plain_symbols)
+        updated = set()
+        update_pair_statistics(most_frequent, changes, stats, indices, updated)
         stats[most_frequent] = 0
-        if not i % 100:
-            prune_stats(stats, big_stats, threshold)
+        updated.discard(most_frequent)
+        pair_heap.update(updated)
 
 
 if __name__ == '__main__':
@@ -6,9 +6,21 @@
 
 from __future__ import print_function
 import argparse
+from collections import defaultdict
+from itertools import chain, islice
+import locale
+import os
 import sys
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "steps", "libs"))
+import arpa as arpa_lib
+
 parser = argparse.ArgumentParser(description="This script evaluates the log probabilty (default log base is e) of each sentence "
                                              "from data (in text form), given a language model in arpa form "
                                              "and a specific ngram order.",
@@ -18,17 +30,44 @@ parser.add_argument("arpa_lm", type=str,
                     help="Input language model in arpa form.")
 parser.add_argument("ngram_order", type=int,
                     help="Order of ngram")
-parser.add_argument("text_in", type=str,
+parser.add_argument("text_in", type=str, nargs="?",
                     help="Filename of input text file (each line will be interpreted as a sentence).")
-parser.add_argument("prob_file", type=str,
+parser.add_argument("prob_file", type=str, nargs="?",
                     help="Filename of output probability file.")
 parser.add_argument("--log-base", type=float, default=math.exp(1),
                     help="Log base for log porbability")
+parser.add_argument("--arpa-cache", type=str, default=None,
+                    help="Directory of a binary cache of parsed arpa files, keyed by the hash "
+                    "of the file (see steps/libs/arpa_cache.py); repeated runs on the same "
+                    "language model skip parsing the text.")
+parser.add_argument("--text-list", type=str, default=None,
+                    help="File with one pair <text-in> <prob-file> per line; each text file is "
+                    "scored into its probability file with the same model, which is loaded only "
+                    "once.  The positional text_in and prob_file can then be omitted.")
 args = parser.parse_args()
 
+def open_text_and_prob_file(text_in, prob_file):
+    text_in_handle = sys.stdin if text_in == "-" else open(text_in, "r")
+    prob_file_handle = sys.stdout if prob_file == "-" else open(prob_file, "w")
+    return text_in_handle, prob_file_handle
+
 def check_args(args):
-    args.text_in_handle = sys.stdin if args.text_in == "-" else open(args.text_in, "r")
-    args.prob_file_handle = sys.stdout if args.prob_file == "-" else open(args.prob_file, "w")
+    args.text_and_prob_files = []
+    if args.text_in is not None or args.prob_file is not None:
+        if args.text_in is None or args.prob_file is None:
+            sys.exit("compute_sentence_probs_arpa.py: Both text_in and prob_file must be given")
+        args.text_and_prob_files.append((args.text_in, args.prob_file))
+    if args.text_list is not None:
+        with open(args.text_list) as text_list:
+            for line in text_list:
+                fields = line.split()
+                if not fields:
+                    continue
+                if len(fields) != 2:
+                    sys.exit("compute_sentence_probs_arpa.py: Bad line in --text-list file: {}".format(line.strip()))
+                args.text_and_prob_files.append(tuple(fields))
+    if not args.text_and_prob_files:
+        sys.exit("compute_sentence_probs_arpa.py: No text to score (give text_in and prob_file, or --text-list)")
     if args.log_base <= 0:
         sys.exit("compute_sentence_probs_arpa.py: Invalid log base (must be greater than 0)")
 
@@ -42,114 +81,412 @@ def is_logprob(input):
     else:
         return False
 
-def check_number(model_file, tot_num):
-    cur_num = 0
-    max_ngram_order = 0
-    with open(model_file) as model:
-        lines = model.readlines()
-        for line in lines[1:]:
-            if "=" not in line:
-                return (cur_num == tot_num), max_ngram_order
-            cur_num += int(line.split("=")[-1])
-            max_ngram_order = int(line.split("=")[0].split()[-1])
+# This function parses an ngram line of the arpa file (a line that starts with "-")
+# into its key and a tuple with its log-probability and, if any, its backoff weight.
+def parse_ngram_line(line):
+    line_split = line.split()
+    if is_logprob(line_split[-1]):
+        return " ".join(line_split[1:-1]), (-float(line_split[0][1:]), -float(line_split[-1][1:]))
+    else:
+        return " ".join(line_split[1:]), (-float(line_split[0][1:]),)
+
+def add_ngram(ngram_dict, ngram_key, value):
+    if ngram_key in ngram_dict:
+        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(ngram_key))
+    ngram_dict[ngram_key] = value
 
 # This function load language model in arpa form and save in a dictionary for
-# computing sentence probabilty of input text file.
+# computing sentence probabilty of input text file.  It also returns whether the
+# dictionary has as many ngrams as the header of the model says, and the highest
+# order in the header.
 def load_model(model_file):
-    with open(model_file) as model:
-        ngram_dict = {}
-        lines = model.readlines()
-
+    with arpa_lib.open_arpa(model_file, encoding=None) as model:
         # check arpa form
-        if lines[0][:-1] != "\\data\\":
+        if model.readline()[:-1] != "\\data\\":
             sys.exit("compute_sentence_probs_arpa.py: Please make sure that language model is in arpa form.")
+        model.seek(0)
 
-        # read line
-        for line in lines:
-            if line[0] == "-":
-                line_split = line.split()
-                if is_logprob(line_split[-1]):
-                    ngram_key = " ".join(line_split[1:-1])
-                    if ngram_key in ngram_dict:
-                        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(ngram_key))
-                    ngram_dict[ngram_key] = (line_split[0], line_split[-1])
-                else:
-                    ngram_key = " ".join(line_split[1:])
-                    if ngram_key in ngram_dict:
-                        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(ngram_key))
-                    ngram_dict[ngram_key] = (line_split[0],)
-
-    return ngram_dict, len(ngram_dict)
-
-def compute_sublist_prob(sub_list):
-    if len(sub_list) == 0:
-        sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
-
-    sub_string = " ".join(sub_list)
-    if sub_string in ngram_dict:
-        return -float(ngram_dict[sub_string][0][1:])
-    else:
-        backoff_substring = " ".join(sub_list[:-1])
-        backoff_weight = 0.0 if (backoff_substring not in ngram_dict or len(ngram_dict[backoff_substring]) < 2) \
-                         else -float(ngram_dict[backoff_substring][1][1:])
-        return compute_sublist_prob(sub_list[1:]) + backoff_weight
+        ngram_dict = {}
+        reader = arpa_lib.ArpaReader(model)
+        try:
+            reader.read_header()
+            for order, lines in reader.sections():
+                for line in lines:
+                    if line[0] == "-":
+                        ngram_key, value = parse_ngram_line(line)
+                        add_ngram(ngram_dict, ngram_key, value)
+        except arpa_lib.ArpaFormatError as e:
+            sys.exit("compute_sentence_probs_arpa.py: Please make sure that language model is in arpa form ({}).".format(e))
+
+    tot_num = sum(count for order, count in reader.counts)
+    max_ngram_order = reader.counts[-1][0] if reader.counts else 0
+    return ngram_dict, len(ngram_dict) == tot_num, max_ngram_order
 
-def compute_begin_prob(sub_list):
-    logprob = 0
-    for i in range(1, len(sub_list) - 1):
-        logprob += compute_sublist_prob(sub_list[:i + 1])
-    return logprob
+# This function returns a dictionary from the (0-based) line numbers in
+# 'line_numbers' to those lines of the arpa file, read and decoded like in
+# load_model(), so that it works for gzipped models too.
+def read_lines(model_file, line_numbers):
+    import arpa_cache as arpa_cache_lib
 
+    line_texts = {}
+    if not line_numbers:
+        return line_texts
+    with arpa_lib.open_arpa(model_file, encoding=None) as model:
+        position = 0
+        for line_number in sorted(set(line_numbers)):
+            line = next(islice(model, line_number - position, None), None)
+            if line is None:
+                raise arpa_cache_lib.ArpaCacheError("the file has fewer lines than its cache entry")
+            line_texts[line_number] = line
+            position = line_number + 1
+    return line_texts
+
+# Same as load_model(), but the model is read through
+# the binary cache of parsed arpa files in cache_dir.  Raises arpa_cache.ArpaCacheError
+# if the file cannot be cached, in which case the text should be parsed as usual.
+def load_model_from_cache(model_file, cache_dir):
+    import arpa_cache as arpa_cache_lib
+    import numpy as np
+
+    cached = arpa_cache_lib.load_arpa_cache(model_file, cache_dir)
+    if cached.first_line[:-1] != "\\data\\":
+        sys.exit("compute_sentence_probs_arpa.py: Please make sure that language model is in arpa form.")
+    encoding = locale.getpreferredencoding(False)  # as used by open() in load_model()
+    words = np.array(cached.decoded_words(encoding), dtype=object)
+    word_is_logprob = np.array([is_logprob(w) for w in words.tolist()], dtype=bool)
+
+    sections = []
+    irregular_lines = []
+    for order, _ in cached.sections:
+        entries = cached.ngrams[order]
+        ids = np.asarray(entries["ids"])
+        logprobs = np.asarray(entries["logp"])
+        backoffs = np.asarray(entries["bow"])
+        has_backoff = (np.asarray(entries["flags"]) & arpa_cache_lib.HAS_BOW) != 0
+        # load_model() only reads lines that start with "-", and takes the last
+        # field as backoff weight iff it looks like a negative number; the
+        # entries where that is not the actual backoff weight (if any) are
+        # parsed from their line, like there.
+        is_ngram_line = np.signbit(logprobs)
+        is_regular = np.where(has_backoff, np.signbit(backoffs), ~word_is_logprob[ids[:, -1]])
+        line_numbers = np.asarray(entries["line"])
+        irregular_lines.extend(line_numbers[is_ngram_line & ~is_regular].tolist())
+        sections.append((order, ids, logprobs, backoffs, has_backoff, is_ngram_line, is_regular, line_numbers))
+    line_texts = read_lines(model_file, irregular_lines)
+
+    ngram_dict = {}
+    for order, ids, logprobs, backoffs, has_backoff, is_ngram_line, is_regular, line_numbers in sections:
+        columns = [words[ids[is_ngram_line, i]].tolist() for i in range(order)]
+        for key, logprob, backoff, with_backoff, regular, line_number in zip(
+                [" ".join(ngram) for ngram in zip(*columns)],
+                logprobs[is_ngram_line].tolist(), backoffs[is_ngram_line].tolist(),
+                has_backoff[is_ngram_line].tolist(), is_regular[is_ngram_line].tolist(),
+                line_numbers[is_ngram_line].tolist()):
+            if regular:
+                add_ngram(ngram_dict, key, (logprob, backoff) if with_backoff else (logprob,))
+            else:
+                add_ngram(ngram_dict, *parse_ngram_line(line_texts[line_number]))
+
+    tot_num = sum(count for order, count in cached.counts)
+    max_ngram_order = cached.counts[-1][0] if cached.counts else 0
+    return ngram_dict, len(ngram_dict) == tot_num, max_ngram_order
+
+# This class scores sentences with the model in ngram_dict (see load_model()).
 # The probability is computed in this way:
 # p(word_N | word_N-1 ... word_1) = ngram_dict[word_1 ... word_N][0].
 # Here gram_dict is a dictionary stores a tuple corresponding to ngrams.
-# The first element of tuple is probablity and the second is backoff probability (if exists).
+# The first element of tuple is the log-probablity and the second is the log-backoff weight (if exists).
 # If the particular ngram (word_1 ... word_N) is not in the dictionary, then
 # p(word_N | word_N-1 ... word_1) = p(word_N | word_(N-1) ... word_2) * backoff_weight(word_(N-1) | word_(N-2) ... word_1)
 # If the sequence (word_(N-1) ... word_1) is not in the dictionary, then the backoff_weight gets replaced with 0.0 (log1)
 # More details can be found in https://cmusphinx.github.io/wiki/arpaformat/
-def compute_sentence_prob(sentence, ngram_order):
-    sentence_split = sentence.split()
-    for i in range(len(sentence_split)):
-        if sentence_split[i] not in ngram_dict:
-            sentence_split[i] = "<unk>"
-    sen_length = len(sentence_split)
-
-    if sen_length < ngram_order:
-        return compute_begin_prob(sentence_split)
-    else:
+#
+# Instead of space-joined strings, ngrams are stored as integers: words get ids
+# 1 ... V, and the ngram (w_1 ... w_N) gets the key id(w_1) * M^(N-1) + ... + id(w_N)
+# with M = V + 2, so ngrams of different lengths never share a key, and the key of
+# (w_k ... w_N) is key % M^(N-k+1) and the key of (w_1 ... w_(N-1)) is key // M.  Words
+# of the text that are not unigrams of the model are replaced with "<unk>" (which
+# gets the id V + 1 if it is not in the model either).
+class NgramScorer(object):
+    def __init__(self, ngram_dict):
+        word_ids = {}
+        keys = []
+        for ngram in ngram_dict:
+            words = ngram.split()
+            if not words:
+                continue  # the empty ngram is never looked up
+            for word in words:
+                if word not in word_ids:
+                    word_ids[word] = len(word_ids) + 1
+            keys.append((ngram, words))
+        self.radix = len(word_ids) + 2
+        max_len = max([len(words) for ngram, words in keys] + [0])
+        self.powers = [self.radix ** n for n in range(max_len + 2)]
+        self.probs = {}
+        self.backoffs = {}
+        for ngram, words in keys:
+            key = self.pack(word_ids[word] for word in words)
+            value = ngram_dict[ngram]
+            self.probs[key] = value[0]
+            if len(value) >= 2:
+                self.backoffs[key] = value[1]
+        self.unk_id = word_ids.get("<unk>", len(word_ids) + 1)
+        self.unigram_ids = dict((word, word_id) for word, word_id in word_ids.items()
+                                if word in ngram_dict)
+
+    def pack(self, ids):
+        key = 0
+        for word_id in ids:
+            key = key * self.radix + word_id
+        return key
+
+    # Same as compute_sublist_prob(sub_list) was: the log-probability of the last
+    # word of the ngram with this key, which has 'length' words.
+    def ngram_logprob(self, key, length):
+        powers = self.powers
+        probs = self.probs
+        for k in range(length):
+            logprob = probs.get(key % powers[length - k])
+            if logprob is not None:
+                break
+        else:
+            sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
+        if k > 0:
+            # add the backoff weights of (w_j ... w_(N-1)), for j = k ... 1
+            backoffs = self.backoffs
+            history = key // self.radix
+            for j in range(k - 1, -1, -1):
+                logprob = logprob + backoffs.get(history % powers[length - 1 - j], 0.0)
+        return logprob
+
+    # The log-probability (base 10) of a sentence, as a list of words including
+    # <s> and </s>.  Like before, the first word and, for sentences shorter than
+    # ngram_order, the last word are not scored.
+    def sentence_logprob(self, words, ngram_order):
+        unigram_ids = self.unigram_ids
+        unk_id = self.unk_id
+        ids = [unigram_ids.get(word, unk_id) for word in words]
+        sen_length = len(ids)
+
+        begin_length = sen_length - 1 if sen_length < ngram_order else ngram_order - 1
+        begin_logprob = 0
+        key = ids[0] if sen_length > 0 else 0
+        for i in range(1, begin_length):
+            key = key * self.radix + ids[i]
+            begin_logprob += self.ngram_logprob(key, i + 1)
+        if sen_length < ngram_order:
+            return begin_logprob
+
         logprob = 0
-        begin_sublist = sentence_split[:ngram_order]
-        logprob += compute_begin_prob(begin_sublist)
+        logprob += begin_logprob
+        if begin_length > 0:
+            key = key * self.radix + ids[begin_length]
+        else:
+            key = ids[0]
+        history_power = self.powers[ngram_order - 1]
+        logprob += self.ngram_logprob(key, ngram_order)
+        for i in range(ngram_order, sen_length):
+            key = (key % history_power) * self.radix + ids[i]
+            logprob += self.ngram_logprob(key, ngram_order)
+        return logprob
+
+    def score_lines(self, lines, ngram_order):
+        return [self.sentence_logprob(("<s> " + line[:-1] + " </s>").split(), ngram_order)
+                for line in lines]
+
+
+class _UnkIds(dict):
+    def __init__(self, word_ids, unk_id):
+        super(_UnkIds, self).__init__(word_ids)
+        self.unk_id = unk_id
+
+    def __missing__(self, word):
+        return self.unk_id
+
+
+# Returns the sum of each segment values[start:start+length], with the elements
+# added strictly left to right, like the 'logprob += ...' loop of
+# NgramScorer.sentence_logprob() (numpy's own reductions use pairwise summation).
+def _sequential_segment_sums(values, seg_starts, seg_lengths):
+    sums = np.zeros(len(seg_starts))
+    if len(seg_starts) == 0:
+        return sums
+    order = np.argsort(-seg_lengths, kind="stable")
+    starts_sorted = seg_starts[order]
+    lengths_sorted = seg_lengths[order]
+    # segments still active at step j are a prefix of the sorted ones
+    num_active = np.searchsorted(-lengths_sorted, -np.arange(lengths_sorted[0]), side="left")
+    acc = np.zeros(len(seg_starts))
+    for j, k in enumerate(num_active.tolist()):
+        acc[:k] += values[starts_sorted[:k] + j]
+    sums[order] = acc
+    return sums
+
+
+# Same as NgramScorer, but it scores all the ngrams of a batch of sentences at
+# once with numpy.  Every ngram of the model and every suffix of one is a node,
+# identified by its position ('rank') in the sorted array self.keys[N] of the keys
+# rank(w_2 ... w_N) * M + id(w_1), where N is the length of the ngram, so the
+# suffixes of an ngram of the text (the ngram itself and the ones it backs off to)
+# and its histories (w_j ... w_(N-1)) are found one word at a time, from the last
+# one.  self.probs[N] (NaN if the node is not in the model) and self.backoffs[N]
+# (0.0 if it has no backoff weight) are indexed by rank.  The results are the same
+# as the ones of NgramScorer.
+class ArrayNgramScorer(object):
+    def __init__(self, ngram_dict):
+        word_ids = {}
+        entries = defaultdict(lambda: ([], [], []))
+        for ngram, value in ngram_dict.items():
+            words = ngram.split()
+            if not words:
+                continue  # the empty ngram is never looked up
+            ids, probs, backoffs = entries[len(words)]
+            for word in words:
+                if word not in word_ids:
+                    word_ids[word] = len(word_ids) + 1
+                ids.append(word_ids[word])
+            probs.append(value[0])
+            backoffs.append(value[1] if len(value) >= 2 else 0.0)
+        self.radix = len(word_ids) + 2
+        self.max_length = max(list(entries.keys()) + [1])
+        unk_id = word_ids.get("<unk>", len(word_ids) + 1)
+        self.word_ids = _UnkIds(((word, word_id) for word, word_id in word_ids.items()
+                                 if word in ngram_dict), unk_id)
 
-        for i in range(sen_length - ngram_order + 1):
-            cur_sublist = sentence_split[i : i + ngram_order]
-            logprob += compute_sublist_prob(cur_sublist)
+        # the nodes of each length: the ngrams and the suffixes of longer nodes
+        entry_ids = {}
+        nodes = {}
+        suffixes = np.zeros((0, self.max_length), dtype=np.int64)
+        for length in range(self.max_length, 0, -1):
+            ids = entries[length][0] if length in entries else []
+            entry_ids[length] = np.array(ids, dtype=np.int64).reshape(-1, length)
+            nodes[length] = np.unique(np.vstack([entry_ids[length], suffixes]), axis=0)
+            suffixes = nodes[length][:, 1:]
 
-    return logprob
+        self.keys = {}
+        self.probs = {}
+        self.backoffs = {}
+        for length in range(1, self.max_length + 1):
+            self.keys[length] = np.unique(self._node_keys(nodes[length]))
+            ranks = np.searchsorted(self.keys[length], self._node_keys(entry_ids[length]))
+            self.probs[length] = np.full(len(self.keys[length]), np.nan)
+            self.backoffs[length] = np.zeros(len(self.keys[length]))
+            if length in entries:
+                self.probs[length][ranks] = entries[length][1]
+                self.backoffs[length][ranks] = entries[length][2]
 
+    def _node_keys(self, ids):
+        # keys of the ngrams in the rows of ids, whose suffixes are nodes
+        ranks = np.zeros(len(ids), dtype=np.int64)
+        for j in range(ids.shape[1] - 1, 0, -1):
+            ranks = np.searchsorted(self.keys[ids.shape[1] - j], ranks * self.radix + ids[:, j])
+        return ranks * self.radix + ids[:, 0]
 
-def output_result(text_in_handle, output_file_handle, ngram_order):
-    lines = text_in_handle.readlines()
+    def _extend(self, length, ranks, ids):
+        # ranks of the nodes (ids, <the node of length - 1 with rank 'ranks'>), or -1
+        keys = self.keys[length]
+        query = ranks * self.radix + ids
+        pos = np.searchsorted(keys, query)
+        found = pos < len(keys)
+        found[found] = keys[pos[found]] == query[found]
+        return np.where(found, pos, -1)
+
+    def score_lines(self, lines, ngram_order):
+        sentences = [("<s> " + line[:-1] + " </s>").split() for line in lines]
+        sen_lengths = np.array([len(words) for words in sentences], dtype=np.int64)
+        ids = np.fromiter(map(self.word_ids.__getitem__, chain.from_iterable(sentences)),
+                          dtype=np.int64, count=int(sen_lengths.sum()))
+        sen_starts = np.cumsum(sen_lengths) - sen_lengths
+
+        # The ngrams scored for each sentence (see NgramScorer.sentence_logprob()),
+        # by the position of their last word: 1 ... n-2 if the sentence is shorter
+        # than ngram_order, else 1 ... n-1 (0 ... n-1 for unigrams).
+        is_short = sen_lengths < ngram_order
+        first_end = np.where(is_short | (ngram_order > 1), 1, 0)
+        num_ngrams = np.maximum(np.where(is_short, sen_lengths - 2, sen_lengths - first_end), 0)
+        ngram_starts = np.cumsum(num_ngrams) - num_ngrams
+        sentence = np.repeat(np.arange(len(sentences)), num_ngrams)
+        end = np.arange(int(num_ngrams.sum())) - ngram_starts[sentence] + first_end[sentence]
+        length = np.minimum(end + 1, ngram_order)
+        end += sen_starts[sentence]
+
+        # the longest suffix of each ngram that is in the model; 'active' are the
+        # ngrams whose suffix of length n may be a node.
+        logprob = np.full(len(end), np.nan)
+        found_length = np.zeros(len(end), dtype=np.int64)
+        active = np.arange(len(end))
+        ranks = np.zeros(len(end), dtype=np.int64)
+        for n in range(1, min(ngram_order, self.max_length) + 1):
+            ranks = self._extend(n, ranks, ids[end[active] - n + 1])
+            keep = ranks >= 0
+            active, ranks = active[keep], ranks[keep]
+            prob = self.probs[n][ranks]
+            has_prob = ~np.isnan(prob)
+            logprob[active[has_prob]] = prob[has_prob]
+            found_length[active[has_prob]] = n
+            keep = length[active] > n
+            active, ranks = active[keep], ranks[keep]
+        if np.any(found_length == 0):
+            sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
+
+        # plus the backoff weights of the histories of length found_length ... length - 1,
+        # shortest first (the ones that are not in the model add 0.0, which changes nothing
+        # here as the sums below start from 0.0)
+        active = np.flatnonzero(found_length < length)
+        ranks = np.zeros(len(active), dtype=np.int64)
+        for n in range(1, min(ngram_order - 1, self.max_length) + 1):
+            ranks = self._extend(n, ranks, ids[end[active] - n])
+            keep = ranks >= 0
+            active, ranks = active[keep], ranks[keep]
+            add = found_length[active] <= n
+            logprob[active[add]] += self.backoffs[n][ranks[add]]
+            keep = length[active] - 1 > n
+            active, ranks = active[keep], ranks[keep]
+
+        return _sequential_segment_sums(logprob, ngram_starts, num_ngrams).tolist()
+
+
+def output_result(scorer, text_in_handle, output_file_handle, ngram_order, batch_size=1 << 20):
     logbase_modifier = math.log(10, args.log_base)
-    for line in lines:
-        new_line = "<s> " + line[:-1] + " </s>"
-        logprob = compute_sentence_prob(new_line, ngram_order)
-        new_logprob = logprob * logbase_modifier
-        output_file_handle.write("{}\n".format(new_logprob))
-    text_in_handle.close()
-    output_file_handle.close()
+    while True:
+        lines = text_in_handle.readlines(batch_size)
+        if not lines:
+            break
+        output_file_handle.write("".join(
+            "{}\n".format(logprob * logbase_modifier)
+            for logprob in scorer.score_lines(lines, ngram_order)))
+    if text_in_handle is not sys.stdin:
+        text_in_handle.close()
+    if output_file_handle is sys.stdout:
+        output_file_handle.flush()
+    else:
+        output_file_handle.close()
 
 
 if __name__ == "__main__":
     check_args(args)
-    ngram_dict, tot_num = load_model(args.arpa_lm)
-
-    num_valid, max_ngram_order = check_number(args.arpa_lm, tot_num)
+    ngram_dict = None
+    if args.arpa_cache is not None:
+        try:
+            import arpa_cache as arpa_cache_lib
+            ngram_dict, num_valid, max_ngram_order = load_model_from_cache(args.arpa_lm, args.arpa_cache)
+        except ImportError as e:
+            # the cache needs numpy
+            print("compute_sentence_probs_arpa.py: cannot use the arpa cache ({}); "
+                  "parsing the text".format(e), file=sys.stderr)
+        except arpa_cache_lib.ArpaCacheError as e:
+            print("compute_sentence_probs_arpa.py: cannot use the arpa cache ({}); "
+                  "parsing the text".format(e), file=sys.stderr)
+    if ngram_dict is None:
+        ngram_dict, num_valid, max_ngram_order = load_model(args.arpa_lm)
     if not num_valid:
         sys.exit("compute_sentence_probs_arpa.py: Wrong loading model.")
     if args.ngram_order <= 0 or args.ngram_order > max_ngram_order:
         sys.exit("compute_sentence_probs_arpa.py: " +
             "Invalid ngram_order (either negative or greater than maximum ngram number ({}) allowed)".format(max_ngram_order))
 
-    output_result(args.text_in_handle, args.prob_file_handle, args.ngram_order)
+    scorer = ArrayNgramScorer(ngram_dict) if np is not None else NgramScorer(ngram_dict)
+    del ngram_dict
+    for text_in, prob_file in args.text_and_prob_files:
+        text_in_handle, prob_file_handle = open_text_and_prob_file(text_in, prob_file)
+        output_result(scorer, text_in_handle, prob_file_handle, args.ngram_order)
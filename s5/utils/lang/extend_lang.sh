@@ -229,9 +229,9 @@ if "$silprob"; then
       fstarcsort --sort_type=olabel > $dir/L.fst || exit 1;
 else
   utils/lang/make_lexicon_fst.py $grammar_opts --sil-prob=$sil_prob --sil-phone=$silphone \
+           --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
            $tmpdir/lexiconp.txt | \
-      fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
-        --keep_isymbols=false --keep_osymbols=false | \
+      fstcompile | \
       fstarcsort --sort_type=olabel > $dir/L.fst || exit 1;
 fi
 
@@ -248,9 +248,9 @@ if "$silprob"; then
 else
   utils/lang/make_lexicon_fst.py $grammar_opts \
     --sil-prob=$sil_prob --sil-phone=$silphone --sil-disambig='#'$ndisambig \
+    --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
        $tmpdir/lexiconp_disambig.txt | \
-     fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
-                --keep_isymbols=false --keep_osymbols=false | \
+     fstcompile | \
      fstaddselfloops $dir/phones/wdisambig_phones.int $dir/phones/wdisambig_words.int | \
      fstarcsort --sort_type=olabel > $dir/L_disambig.fst || exit 1;
 fi
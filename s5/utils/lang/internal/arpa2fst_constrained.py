@@ -8,8 +8,13 @@ from __future__ import division
 import sys
 import argparse
 import math
+import os
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, os.pardir, 'steps', 'libs'))
+import arpa as arpa_lib
+
 # note, this was originally based
 
 parser = argparse.ArgumentParser(description="""
@@ -31,7 +36,7 @@ parser.add_argument('--disambig-symbol', type = str, default = "#0",
                     'that is printed on the input side only of backoff '
                     'arcs (output side would be epsilon)')
 parser.add_argument('arpa_in', type = str,
-                    help = 'The input ARPA file (must not be gzipped)')
+                    help = 'The input ARPA file (may be gzipped)')
 parser.add_argument('allowed_bigrams_in', type = str,
                     help = "A file containing the list of allowed bigram pairs.  "
                     "Must include pairs like '<s> foo' and 'foo </s>', as well as "
@@ -71,86 +76,50 @@ class ArpaModel(object):
     def Read(self, arpa_in):
         assert len(self.orders) == 0
         log10 = math.log(10.0)
-        if arpa_in == "" or arpa_in == "-":
-            arpa_in = "/dev/stdin"
         try:
-            f = open(arpa_in, "r")
+            f = arpa_lib.open_arpa(arpa_in, encoding=None)
         except:
             sys.exit("{0}: error opening ARPA file {1}".format(
                      sys.argv[0], arpa_in))
-        # first read till the \data\ marker.
-        while True:
-            line = f.readline()
-            if line == '':
+        # the probabilities and backoff weights are converted from log10 as
+        # they are read.
+        reader = arpa_lib.ArpaReader(f, value_type=lambda x: math.exp(float(x) * log10))
+        try:
+            # first read till the \data\ marker, and the lines like
+            # 'ngram 1=1264' after it.
+            if not reader.read_header():
                 sys.exit("{0}: reading {1}, got EOF looking for \\data\\ marker.".format(
                     sys.argv[0], arpa_in))
-            if line[0:6] == '\\data\\':
-                break
-        while True:
-            # read, and ignore, the lines like 'ngram 1=1264'...
-            line = f.readline()
-            if line == '\n' or line == '\r\n':
-                break
-            if line[0:5] != 'ngram':
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            rest=line[5:]
-            a = rest.split('=')  # e.g. a = [ '1', '1264] ]
-            if len(a) != 2:
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            max_order = int(a[0])
-
-
-        for n in range(max_order):
-            # self.orders[n], indexed by history-length (length of the
-            # history-vector, == order-1), is a map from history as a tuple
-            # of strings, to class HistoryState.
-            self.orders.append(defaultdict(lambda: HistoryState()))
-
-        cur_order = 0
-        while True:
-            line = f.readline()
-            if line == '':
-                sys.exit("{0}: reading {1}, found EOF while looking for \\end\\ marker.".format(
-                    sys.argv[0], arpa_in))
-            elif line[0:5] == '\\end\\':
-                if len(self.orders) == 0:
-                    sys.exit("{0}: reading {1}, read no n-grams.".format(sys.argv[0], arpa_in))
-                break
-            else:
+            if len(reader.counts) == 0:
+                sys.exit("{0}: reading {1}, read no n-grams.".format(sys.argv[0], arpa_in))
+            max_order = reader.counts[-1][0]
+
+            for n in range(max_order):
+                # self.orders[n], indexed by history-length (length of the
+                # history-vector, == order-1), is a map from history as a tuple
+                # of strings, to class HistoryState.
+                self.orders.append(defaultdict(lambda: HistoryState()))
+
+            cur_order = 0
+            for order, entries in reader.sections(parse=True):
                 cur_order += 1
-                expected_line = '\\{0}-grams:'.format(cur_order)
-                if not expected_line in line:  # e.g. allow trailing whitespace and newline
-                    sys.exit("{0}: reading {1}, expected line {1}, got {2}".format(arpa_in, expected_line, line[:-1]))
+                if order != cur_order:
+                    sys.exit("{0}: reading {1}, expected line \\{2}-grams:, got \\{3}-grams:".format(
+                        sys.argv[0], arpa_in, cur_order, order))
                 if args.verbose >= 2:
                     print("{0}: reading {1}-grams".format(
                         sys.argv[0], cur_order), file = sys.stderr)
 
                 # now read all the n-grams from this order.
-                while True:
-                    line = f.readline()
-                    # the section of n-grams is terminated by a blank line.
-                    if line == '\n' or line == '\r\n':
-                        break
-                    a = line.split()
-                    l = len(a)
-                    if l != cur_order + 1 and l != cur_order + 2:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad line: {3}".format(
-                            sys.argv[0], arpa_in, cur_order, line[:-1]))
-                    try:
-                        prob = math.exp(float(a[0]) * log10)
-                        hist = tuple(a[1:cur_order])  # tuple of strings
-                        word = a[cur_order]  # a string
-                        backoff_prob = math.exp(float(a[cur_order+1]) * log10) if l == cur_order + 2 else None
-                    except Exception as e:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad "
-                                 "line (exception is: {3}): {4}".format(
-                                     sys.argv[0], arpa_in, cur_order,
-                                     str(type(e)) + ',' + str(e), line[:-1]))
+                for prob, ngram, backoff_prob in entries:
+                    hist = ngram[:-1]  # tuple of strings
+                    word = ngram[-1]  # a string
                     self.orders[cur_order-1][hist].word_to_prob[word] = prob
                     if backoff_prob != None:
                         self.orders[cur_order][hist + (word,)].backoff_prob = backoff_prob
+        except (arpa_lib.ArpaFormatError, ValueError) as e:
+            sys.exit("{0}: reading {1}: {2}".format(sys.argv[0], arpa_in, str(e)))
+        f.close()
 
         if args.verbose >= 2:
             print("{0}: read {1}-gram model from {2}".format(
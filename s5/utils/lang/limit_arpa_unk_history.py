@@ -14,10 +14,14 @@ This keeps the graph compact after adding the unk model.
 
 import argparse
 import io
+import os
 import re
 import sys
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'steps', 'libs'))
+import arpa as arpa_lib
 
 parser = argparse.ArgumentParser(
     description='''This script takes an existing ARPA lanugage model
@@ -32,16 +36,23 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     'oov_dict_entry',
     help='oov identifier, for example "<unk>"', type=str)
+parser.add_argument(
+    '--arpa-cache', type=str, default=None,
+    help='''Directory of a binary cache of parsed ARPA files, keyed by the
+    hash of the input (see steps/libs/arpa_cache.py). With it, only the lines
+    that contain the oov identifier or <unk> are matched against the patterns.''')
 args = parser.parse_args()
 
 
 def get_ngram_stats(old_lm_lines):
     ngram_counts = defaultdict(int)
 
-    for i in range(10):
-        g = re.search(r"ngram (\d)=(\d+)", old_lm_lines[i])
-        if g:
-            ngram_counts[int(g.group(1))] = int(g.group(2))
+    reader = arpa_lib.ArpaReader(old_lm_lines)
+    try:
+        if reader.read_header():
+            ngram_counts.update(reader.counts)
+    except arpa_lib.ArpaFormatError:
+        pass
 
     if len(ngram_counts) == 0:
         sys.exit("""Couldn't get counts per ngram section.
@@ -56,7 +67,9 @@ def get_ngram_stats(old_lm_lines):
     return max_ngrams, skip_rows, ngram_counts
 
 
-def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
+def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows, is_plain=None):
+    ''' is_plain, if given, flags the lines that are known to match no pattern
+    and to be no section header; they are only stripped. '''
     ngram_diffs = defaultdict(int)
     whitespace_pattern = re.compile("[ \t]+")
     unk_pattern = re.compile(
@@ -71,6 +84,9 @@ def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
     new_lm_lines = old_lm_lines[:skip_rows]
 
     for i in range(skip_rows, len(old_lm_lines)):
+            if is_plain is not None and is_plain[i]:
+                new_lm_lines.append(old_lm_lines[i].strip(" \t\r\n") + "\n")
+                continue
             line = old_lm_lines[i].strip(" \t\r\n")
 
             if "\{}-grams:".format(3) in line:
@@ -122,14 +138,39 @@ def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
 def read_old_lm():
     print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
 
-    with io.TextIOWrapper(
-            sys.stdin.buffer,
-            encoding="latin-1") as input_stream:
+    with arpa_lib.open_arpa('-', encoding="latin-1") as input_stream:
         old_lm_lines = input_stream.readlines()
 
     return old_lm_lines
 
 
+def get_plain_lines(data, num_lines, cache_dir):
+    ''' Uses the cache of parsed ARPA files to flag the n-gram lines that
+    contain neither the oov identifier nor <unk>; find_and_replace_unks()
+    copies them without matching them against the patterns. '''
+    import arpa_cache as arpa_cache_lib
+    import numpy as np
+
+    oov = args.oov_dict_entry
+    if re.escape(oov) != oov or oov.split() != [oov]:
+        raise arpa_cache_lib.ArpaCacheError(
+            "oov identifier {} is not a plain word".format(oov))
+    cached = arpa_cache_lib.load_arpa_cache(None, cache_dir, data=data)
+    if cached.num_lines != num_lines:
+        raise arpa_cache_lib.ArpaCacheError("line count mismatch")
+    words = cached.decoded_words("latin-1")
+    if any("-grams:" in w for w in words):
+        raise arpa_cache_lib.ArpaCacheError("a word looks like a section header")
+    is_special = np.array([w == oov or w == "<unk>" for w in words], dtype=bool)
+
+    is_plain = np.zeros(num_lines, dtype=bool)
+    for order, _ in cached.sections:
+        entries = cached.ngrams[order]
+        has_special = is_special[np.asarray(entries['ids'])].any(axis=1)
+        is_plain[np.asarray(entries['line'])[~has_special]] = True
+    return is_plain.tolist()
+
+
 def write_new_lm(new_lm_lines, ngram_counts, ngram_diffs):
     ''' Update n-gram counts that go in the header of the arpa lm '''
 
@@ -143,17 +184,27 @@ def write_new_lm(new_lm_lines, ngram_counts, ngram_diffs):
                 new_lm_lines[i] = "ngram {}={}\n".format(
                     n, new_num_ngrams)
 
-    with io.TextIOWrapper(
-            sys.stdout.buffer,
-            encoding="latin-1") as output_stream:
+    with arpa_lib.open_arpa('-', 'w', encoding="latin-1") as output_stream:
         output_stream.writelines(new_lm_lines)
 
 
 def main():
-    old_lm_lines = read_old_lm()
+    is_plain = None
+    if args.arpa_cache is None:
+        old_lm_lines = read_old_lm()
+    else:
+        print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
+        data = sys.stdin.buffer.read()
+        old_lm_lines = io.TextIOWrapper(
+            io.BytesIO(data), encoding="latin-1").readlines()
+        try:
+            is_plain = get_plain_lines(data, len(old_lm_lines), args.arpa_cache)
+        except Exception as e:
+            print("Cannot use the ARPA cache ({}); matching all lines.".format(e),
+                  file=sys.stderr)
     max_ngrams, skip_rows,  ngram_counts = get_ngram_stats(old_lm_lines)
     new_lm_lines, ngram_diffs = find_and_replace_unks(
-        old_lm_lines, max_ngrams, skip_rows)
+        old_lm_lines, max_ngrams, skip_rows, is_plain)
     write_new_lm(new_lm_lines, ngram_counts, ngram_diffs)
 
 
@@ -21,7 +21,14 @@ import re
 import io
 import math
 import argparse
+from array import array
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 parser = argparse.ArgumentParser(description="""
@@ -32,6 +39,14 @@ parser.add_argument("-ngram-order", type=int, default=4, choices=[2, 3, 4, 5, 6,
 parser.add_argument("-text", type=str, default=None, help="Path to the corpus file")
 parser.add_argument("-lm", type=str, default=None, help="Path to output arpa file for language models")
 parser.add_argument("-verbose", type=int, default=0, choices=[0, 1, 2, 3, 4, 5], help="Verbose level")
+parser.add_argument("-count-store", type=str, default=None, choices=["array", "dict"],
+                    help="How n-gram counts are stored: 'array' (integer word ids and sorted numpy "
+                         "arrays; the default when numpy is available) or 'dict' (one Python object "
+                         "per history).  Both produce exactly the same ARPA output.")
+parser.add_argument("-num-jobs", "--num-jobs", type=int, default=1,
+                    help="Number of worker processes used to count n-grams: the -text file is split "
+                         "into this many shards, which are counted in parallel and then merged.  "
+                         "Requires -count-store array; the output does not depend on it.")
 args = parser.parse_args()
 
 default_encoding = "latin-1"  # For encoding-agnostic scripts, we assume byte stream as input.
@@ -358,15 +373,385 @@ class NgramCounts:
         print('\\end\\', file=fout)
 
 
+class _Vocab(dict):
+    # Maps words to consecutive integer ids, assigned in order of first appearance.
+    def __init__(self, symbols):
+        super().__init__()
+        self.words = []
+        for symbol in symbols:
+            self[symbol]
+
+    def __missing__(self, word):
+        word_id = len(self.words)
+        self[word] = word_id
+        self.words.append(word)
+        return word_id
+
+
+def _segments(sorted_ids):
+    # Start index and length of each run of equal values in a sorted array.
+    if len(sorted_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    lengths = np.diff(np.r_[starts, len(sorted_ids)])
+    return starts, lengths
+
+
+def _sequential_segment_sums(values, seg_starts, seg_lengths):
+    # Returns the sum of each segment values[start:start+length], with the elements
+    # added strictly left to right (like a Python 'total += x' loop), so the results
+    # are bit-identical to the ones of NgramCounts; numpy's own reductions use
+    # pairwise summation.  Segments are visited in decreasing order of length, so
+    # the ones still active at step j are a prefix.
+    num_segs = len(seg_starts)
+    sums = np.zeros(num_segs)
+    if num_segs == 0:
+        return sums
+    order = np.argsort(-seg_lengths, kind='stable')
+    starts_sorted = seg_starts[order]
+    lengths_sorted = seg_lengths[order]
+    num_active = np.searchsorted(-lengths_sorted, -np.arange(lengths_sorted[0]), side='left')
+    acc = np.zeros(num_segs)
+    for j, k in enumerate(num_active.tolist()):
+        acc[:k] += values[starts_sorted[:k] + j]
+    sums[order] = acc
+    return sums
+
+
+def _split_file(filename, num_shards):
+    # Splits the file into at most num_shards byte ranges [start, end) of similar
+    # size that end just after a newline (or at the end of the file).
+    file_size = os.path.getsize(filename)
+    shards = []
+    with open(filename, 'rb') as fp:
+        start = 0
+        for i in range(1, num_shards + 1):
+            if start >= file_size:
+                break
+            fp.seek(max(start, file_size * i // num_shards))
+            fp.readline()
+            end = min(fp.tell(), file_size) if i < num_shards else file_size
+            if end > start:
+                shards.append((start, end))
+                start = end
+    return shards
+
+
+def _count_shard(filename, start, end, ngram_order):
+    # Worker process of ArrayNgramCounts.add_raw_counts_from_file_sharded().  The
+    # bytes are decoded like add_raw_counts_from_file() reads the file (latin-1 and
+    # universal newlines), and no line can span two shards.
+    with open(filename, 'rb') as fp:
+        fp.seek(start)
+        data = fp.read(end - start)
+    ngram_counts = ArrayNgramCounts(ngram_order)
+    num_lines = ngram_counts._add_lines(io.TextIOWrapper(io.BytesIO(data), encoding=default_encoding))
+    ngram_counts.count_ngrams(keep_context_pairs=True)
+    return {
+        'words': ngram_counts.vocab.words,
+        'num_tokens': len(ngram_counts.tokens),
+        'num_lines': num_lines,
+        'orders': ngram_counts.orders,
+    }
+
+
+class ArrayNgramCounts:
+    # A compact alternative to NgramCounts that produces exactly the same ARPA
+    # output.  Words are mapped to integer ids and the training text is kept as a
+    # flat array of ids.  For each order n, the distinct n-grams are stored as a
+    # sorted numpy array of packed keys
+    #     key = (rank of the history among the distinct (n-1)-grams) * V + word,
+    # where V is the vocabulary size; the ranks are lexicographic, so the keys are
+    # too, and the n-grams that share a history form one contiguous segment.  Next
+    # to the keys we keep the raw count, the position of the first occurrence
+    # (which reproduces the dict insertion order of NgramCounts when printing) and
+    # the number of unique left-context words, obtained by sort/unique over
+    # (n-gram, context) pairs instead of per-n-gram Python sets.
+    def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
+        assert ngram_order >= 2
+        assert np is not None, "ArrayNgramCounts requires numpy"
+
+        self.ngram_order = ngram_order
+        self.bos_symbol = bos_symbol
+        self.eos_symbol = eos_symbol
+        self.vocab = _Vocab([bos_symbol, eos_symbol])
+        self.bos_id = self.vocab[bos_symbol]
+        self.eos_id = self.vocab[eos_symbol]
+
+        self.tokens = array('i')  # all sentences, each one as <s> w1 ... wk </s>
+        self.sentence_lengths = array('i')
+        self.orders = None  # set by count_ngrams()
+        self.d = []
+
+    def add_raw_counts_from_line(self, line):
+        if line == '':
+            words = []
+        else:
+            words = whitespace.split(line)
+        self.tokens.append(self.bos_id)
+        self.tokens.extend(map(self.vocab.__getitem__, words))
+        self.tokens.append(self.eos_id)
+        self.sentence_lengths.append(len(words) + 2)
+
+    def _add_lines(self, lines):
+        lines_processed = 0
+        for line in lines:
+            line = line.strip(strip_chars)
+            self.add_raw_counts_from_line(line)
+            lines_processed += 1
+        return lines_processed
+
+    def add_raw_counts_from_lines(self, lines):
+        lines_processed = self._add_lines(lines)
+        if lines_processed == 0 or args.verbose > 0:
+            print("make_kn_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
+
+    def add_raw_counts_from_standard_input(self):
+        self.add_raw_counts_from_lines(io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding))
+
+    def add_raw_counts_from_file(self, filename):
+        with open(filename, encoding=default_encoding) as fp:
+            self.add_raw_counts_from_lines(fp)
+
+    def add_raw_counts_from_file_sharded(self, filename, num_jobs):
+        # Map: each shard of the file is counted by a worker process (see
+        # _count_shard()).  Reduce: the partial counts are merged by merge_shards().
+        shards = _split_file(filename, num_jobs)
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            results = list(executor.map(_count_shard, [filename] * len(shards),
+                                        [start for start, end in shards], [end for start, end in shards],
+                                        [self.ngram_order] * len(shards)))
+        lines_processed = sum(result['num_lines'] for result in results)
+        if lines_processed == 0 or args.verbose > 0:
+            print("make_kn_lm.py: processed {0} lines of input in {1} shards".format(
+                lines_processed, len(shards)), file=sys.stderr)
+        self.merge_shards(results)
+
+    def count_ngrams(self, keep_context_pairs=False):
+        # Sets self.orders[n], for n = 1 .. ngram_order, to a dict of arrays indexed
+        # by the rank of each distinct n-gram:
+        #   'hist'     rank of its history among the (n-1)-grams (0 for unigrams)
+        #   'word'     id of its last word
+        #   'count'    raw count
+        #   'first'    position in self.tokens of its first occurrence
+        #   'context'  number of unique left-context words (n < ngram_order)
+        #   'suffix'   rank of its last n-1 words among the (n-1)-grams (n > 1)
+        # If keep_context_pairs is true, 'context_pairs' also holds the unique
+        # (n-gram, left-context word) pairs, packed as rank * V + word, that
+        # merge_shards() needs to combine the unique-context counts of shards.
+        vocab_size = len(self.vocab.words)
+        tokens = np.frombuffer(self.tokens, dtype=np.int32).astype(np.int64)
+        lengths = np.frombuffer(self.sentence_lengths, dtype=np.int32).astype(np.int64)
+        num_tokens = len(tokens)
+        ends = np.cumsum(lengths)
+        positions = np.arange(num_tokens)
+        remaining = np.repeat(ends, lengths) - positions  # tokens left in the sentence
+        prev_word = np.empty(num_tokens, dtype=np.int64)
+        prev_word[1:] = tokens[:-1]
+        prev_word[ends - lengths] = -1  # <s> at the start of a sentence has no context
+
+        self.orders = [None]
+        prev_rank = np.zeros(num_tokens, dtype=np.int64)  # rank of the (n-1)-gram at each position
+        for n in range(1, self.ngram_order + 1):
+            pos = positions[remaining >= n]
+            keys = prev_rank[pos] * vocab_size + tokens[pos + n - 1]
+            uniq_keys, first_index, inverse, counts = np.unique(
+                keys, return_index=True, return_inverse=True, return_counts=True)
+            inverse = inverse.reshape(-1)
+            order = {
+                'hist': uniq_keys // vocab_size,
+                'word': uniq_keys % vocab_size,
+                'count': counts.astype(np.int64),
+                'first': pos[first_index],
+            }
+            if n > 1:
+                order['suffix'] = prev_rank[order['first'] + 1]
+            if n < self.ngram_order:
+                context = prev_word[pos]
+                has_context = context >= 0
+                pairs = np.unique(inverse[has_context] * vocab_size + context[has_context])
+                order['context'] = np.bincount(pairs // vocab_size, minlength=len(uniq_keys))
+                if keep_context_pairs:
+                    order['context_pairs'] = pairs
+            self.orders.append(order)
+
+            prev_rank = np.zeros(num_tokens, dtype=np.int64)
+            prev_rank[pos] = inverse
+
+    def merge_shards(self, shards):
+        # Sets self.orders (see count_ngrams()) from the counts of consecutive shards
+        # of the text, as returned by _count_shard().  Each shard has its own word
+        # ids and n-gram ranks: words are mapped to ids in self.vocab, and the ranks
+        # of each order are mapped to the merged ranks before building the keys of
+        # the next order.  Counts are added, first-occurrence positions are offset
+        # by the tokens of the preceding shards, and the context pairs are merged
+        # with sort/unique, so the result is the same as counting the whole text.
+        word_maps = [np.array([self.vocab[w] for w in shard['words']], dtype=np.int64)
+                     for shard in shards]
+        vocab_size = len(self.vocab.words)
+        offsets = np.cumsum([0] + [shard['num_tokens'] for shard in shards[:-1]])
+
+        self.orders = [None]
+        rank_maps = [np.zeros(1, dtype=np.int64) for shard in shards]  # the empty history
+        for n in range(1, self.ngram_order + 1):
+            parts = [shard['orders'][n] for shard in shards]
+            keys = np.concatenate([rank_map[part['hist']] * vocab_size + word_map[part['word']]
+                                   for part, rank_map, word_map in zip(parts, rank_maps, word_maps)])
+            sort = np.argsort(keys, kind='stable')
+            starts, lengths = _segments(keys[sort])
+            uniq_keys = keys[sort][starts]
+            order = {
+                'hist': uniq_keys // vocab_size,
+                'word': uniq_keys % vocab_size,
+                'count': np.add.reduceat(np.concatenate([part['count'] for part in parts])[sort], starts),
+                'first': np.minimum.reduceat(np.concatenate(
+                    [part['first'] + offset for part, offset in zip(parts, offsets)])[sort], starts),
+            }
+            if n > 1:
+                suffix = np.concatenate([rank_map[part['suffix']] for part, rank_map in zip(parts, rank_maps)])
+                order['suffix'] = suffix[sort][starts]
+
+            merged_rank = np.empty(len(keys), dtype=np.int64)
+            merged_rank[sort] = np.repeat(np.arange(len(starts)), lengths)
+            rank_maps = np.split(merged_rank, np.cumsum([len(part['word']) for part in parts])[:-1])
+
+            if n < self.ngram_order:
+                pairs = []
+                for part, rank_map, word_map, shard in zip(parts, rank_maps, word_maps, shards):
+                    shard_vocab_size = len(shard['words'])
+                    pairs.append(rank_map[part['context_pairs'] // shard_vocab_size] * vocab_size +
+                                 word_map[part['context_pairs'] % shard_vocab_size])
+                pairs = np.unique(np.concatenate(pairs))
+                order['context'] = np.bincount(pairs // vocab_size, minlength=len(uniq_keys))
+            self.orders.append(order)
+
+    def cal_discounting_constants(self):
+        # Same as NgramCounts.cal_discounting_constants(): D = n1 / (n1 + 2 * n2)
+        if self.orders is None:
+            self.count_ngrams()
+        self.d = [0]
+        for n in range(1, self.ngram_order):
+            counts = self.orders[n + 1]['count']
+            n1 = int(np.count_nonzero(counts == 1))
+            n2 = int(np.count_nonzero(counts == 2))
+            assert n1 + 2 * n2 > 0
+            self.d.append(max(0.001, n1 * 1.0) / (n1 + 2 * n2))
+
+    def cal_f(self):
+        # Same formulas (and floating-point operations) as NgramCounts.cal_f().
+        for n in range(1, self.ngram_order + 1):
+            order = self.orders[n]
+            d = self.d[n - 1]
+            starts, lengths = _segments(order['hist'])
+            total_count = np.repeat(np.add.reduceat(order['count'], starts), lengths)
+            raw_f = np.maximum(order['count'] - d, 0) * 1.0 / total_count
+            if n == self.ngram_order:
+                order['f'] = raw_f
+                continue
+            # lower order: use the modified counts, unless the history is only ever
+            # seen after a sentence start (e.g. <s> a), where there are no contexts
+            n_star_star = np.repeat(np.add.reduceat(order['context'], starts), lengths)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                kn_f = np.maximum(order['context'] - d, 0) * 1.0 / n_star_star
+            order['f'] = np.where(n_star_star != 0, kn_f, raw_f)
+
+    def cal_bow(self):
+        # bow(a_) = (1 - Sum_Z1 f(a_z)) / (1 - Sum_Z1 f(_z)), with both sums taken
+        # over the children of a_ in the same order as NgramCounts.cal_bow().
+        for n in range(1, self.ngram_order):
+            order = self.orders[n]
+            children = self.orders[n + 1]
+            child_order = np.lexsort((children['first'], children['hist']))
+            child_hist = children['hist'][child_order]
+            starts, lengths = _segments(child_hist)
+            sum_z1_f_a_z = _sequential_segment_sums(children['f'][child_order], starts, lengths)
+            sum_z1_f_z = _sequential_segment_sums(order['f'][children['suffix'][child_order]], starts, lengths)
+
+            # every n-gram but the ones ending in </s> needs a bow, and has children
+            parents = child_hist[starts]
+            has_bow = order['word'] != self.eos_id
+            assert np.all(np.isin(np.flatnonzero(has_bow), parents))
+            keep = has_bow[parents]
+            denominator = 1.0 - sum_z1_f_z[keep]
+            if np.any(denominator == 0):
+                raise ZeroDivisionError("float division by zero")
+            order['bow'] = np.full(len(has_bow), np.nan)  # NaN: no bow
+            order['bow'][parents[keep]] = (1.0 - sum_z1_f_a_z[keep]) / denominator
+        self.orders[self.ngram_order]['bow'] = None
+
+    def print_as_arpa(self, fout=None):
+        # print as ARPA format, in the same order as NgramCounts.print_as_arpa():
+        # histories, and the words of each history, in order of first occurrence.
+        if fout is None:
+            # a wrapper of our own, detached when done so that it does not close
+            # sys.stdout.buffer (NgramCounts.print_as_arpa() already holds one).
+            stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='latin-1')
+            self.print_as_arpa(fout=stdout)
+            stdout.flush()
+            stdout.detach()
+            return
+        words = self.vocab.words
+        print('\\data\\', file=fout)
+        for n in range(1, self.ngram_order + 1):
+            print('ngram {0}={1}'.format(n, len(self.orders[n]['word'])), file=fout)
+        print('', file=fout)
+
+        log10 = math.log10
+        prev_text = None
+        for n in range(1, self.ngram_order + 1):
+            order = self.orders[n]
+            print('\\{0}-grams:'.format(n), file=fout)
+
+            if n == 1:
+                text = [words[w] for w in order['word'].tolist()]
+            else:
+                text = [prev_text[h] + ' ' + words[w]
+                        for h, w in zip(order['hist'].tolist(), order['word'].tolist())]
+            starts, lengths = _segments(order['hist'])
+            hist_first = np.repeat(np.minimum.reduceat(order['first'], starts), lengths)
+            line_order = np.lexsort((order['first'], hist_first))
+            for begin in range(0, len(line_order), 100000):
+                chunk = line_order[begin:begin + 100000]
+                probs = order['f'][chunk]
+                probs[probs == 0] = 1e-99  # f(<s>) is always 0
+                logprobs = map(log10, probs.tolist())
+                ngrams = [text[k] for k in chunk.tolist()]
+                if order['bow'] is None:
+                    lines = ['%.7f\t%s' % x for x in zip(logprobs, ngrams)]
+                else:
+                    lines = ['%.7f\t%s\t%.7f' % (p, t, log10(b)) if b == b else '%.7f\t%s' % (p, t)
+                             for p, t, b in zip(logprobs, ngrams, order['bow'][chunk].tolist())]
+                fout.write('\n'.join(lines) + '\n')
+            print('', file=fout)
+            prev_text = text
+        print('\\end\\', file=fout)
+
+
 if __name__ == "__main__":
 
-    ngram_counts = NgramCounts(args.ngram_order)
+    count_store = args.count_store
+    if count_store is None:
+        count_store = "array" if np is not None else "dict"
+    if count_store == "array":
+        if np is None:
+            sys.exit("make_kn_lm.py: -count-store array requires numpy")
+        ngram_counts = ArrayNgramCounts(args.ngram_order)
+    else:
+        if args.num_jobs > 1:
+            sys.exit("make_kn_lm.py: -num-jobs > 1 requires -count-store array")
+        ngram_counts = NgramCounts(args.ngram_order)
 
     if args.text is None:
+        if args.num_jobs > 1:
+            print("make_kn_lm.py: warning: -num-jobs needs -text; counting standard input "
+                  "in a single process", file=sys.stderr)
         ngram_counts.add_raw_counts_from_standard_input()
     else:
         assert os.path.isfile(args.text)
-        ngram_counts.add_raw_counts_from_file(args.text)
+        if args.num_jobs > 1:
+            ngram_counts.add_raw_counts_from_file_sharded(args.text, args.num_jobs)
+        else:
+            ngram_counts.add_raw_counts_from_file(args.text)
 
     ngram_counts.cal_discounting_constants()
     ngram_counts.cal_f()
@@ -5,10 +5,12 @@
 
 # see get_args() below for usage message.
 import argparse
+import io
 import os
 import sys
 import math
 import re
+from multiprocessing import Pool
 
 # The use of latin-1 encoding does not preclude reading utf-8.  latin-1
 # encoding means "treat words as sequences of bytes", and it is compatible
@@ -21,7 +23,8 @@ sys.stderr = open(2, 'w', encoding='latin-1', closefd=False)
 def get_args():
     parser = argparse.ArgumentParser(description="""This script creates the
        text form of a lexicon FST, to be compiled by fstcompile using the
-       appropriate symbol tables (phones.txt and words.txt) .  It will mostly
+       appropriate symbol tables (phones.txt and words.txt), or without them if
+       --isymbols and --osymbols are given.  It will mostly
        be invoked indirectly via utils/prepare_lang.sh.  The output goes to
        the stdout.""")
 
@@ -49,6 +52,18 @@ def get_args():
                         help="""If supplied, --left-context-phones must also be supplied.
                         List of user-defined nonterminal symbols such as #nonterm:contact_list,
                         one per line.  E.g. data/local/dict/nonterminals.txt.""")
+    parser.add_argument('--isymbols', type=str,
+                        help="""Symbol table of the phones (normally phones.txt).  If
+                        --isymbols and --osymbols are supplied, the phones and words are
+                        written as integers, so fstcompile needs no symbol tables (and
+                        has less to read).""")
+    parser.add_argument('--osymbols', type=str,
+                        help="""Symbol table of the words (normally words.txt); see
+                        --isymbols.""")
+    parser.add_argument('--num-jobs', dest='num_jobs', type=int, default=1,
+                        help="""Number of processes that write the arcs of different
+                        parts of the lexicon at the same time; the output is the same
+                        as with --num-jobs=1.""")
     parser.add_argument('lexiconp', type=str,
                         help="""Filename of lexicon with pronunciation probabilities
                         (normally lexiconp.txt), with lines of the form 'word prob p1 p2...',
@@ -116,8 +131,167 @@ def read_lexiconp(filename):
     return ans
 
 
+def read_symbol_table(filename):
+    """Reads a symbol table such as phones.txt or words.txt, with lines of the form
+    'symbol integer-id'.  Returns a dict from symbol to its integer id as a string,
+    e.g. {'<eps>': '0', 'a': '1', ... }."""
+    ans = {}
+    with open(filename, 'r', encoding='latin-1') as f:
+        for line in f:
+            a = line.split()
+            if len(a) != 2 or not a[1].isdigit():
+                print("{0}: error: found bad line '{1}' in symbol table {2}".format(
+                    sys.argv[0], line.strip(" \t\r\n"), filename), file=sys.stderr)
+                sys.exit(1)
+            ans[a[0]] = a[1]
+    return ans
+
+
+class FstTextWriter(object):
+    """Writes the text form of an FST, as read by fstcompile, to the stdout (or to
+    'file', if not None).  The lines are formatted into a buffer which is written
+    in large batches, which is much faster than a print() per arc.
+       isymbols, osymbols: if not None, dicts from phone and word symbols to their
+              integer ids (as strings), as returned by read_symbol_table(); the
+              labels are then written as integers.
+    """
+    def __init__(self, isymbols=None, osymbols=None, batch_size=65536, file=None):
+        self.isymbols = isymbols
+        self.osymbols = osymbols
+        self.batch_size = batch_size
+        self.file = file
+        self.lines = []
+        # the text form of the costs; there are only a few different costs in
+        # a lexicon FST, and formatting floats is slow.
+        self.cost_strings = {}
+
+    def write_arc(self, src, dest, phone, word, cost=None):
+        """Writes an arc; if cost is None, the arc is written without a cost
+        (i.e. with cost zero)."""
+        if self.isymbols is not None:
+            phone = self.map_symbol(self.isymbols, phone)
+        if self.osymbols is not None:
+            word = self.map_symbol(self.osymbols, word)
+        if cost is None:
+            self.lines.append("%d\t%d\t%s\t%s\n" % (src, dest, phone, word))
+            if len(self.lines) >= self.batch_size:
+                self.flush()
+            return
+        if cost == 0.0:
+            # -0.0 (from -math.log(1.0)) and 0.0 are equal as dict keys, but
+            # are written differently.
+            cost_string = '0.0' if math.copysign(1.0, cost) > 0 else '-0.0'
+        else:
+            cost_string = self.cost_strings.get(cost)
+            if cost_string is None:
+                cost_string = "{0}".format(cost)
+                self.cost_strings[cost] = cost_string
+        self.lines.append("%d\t%d\t%s\t%s\t%s\n" % (src, dest, phone, word, cost_string))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def write_final(self, state, final_cost):
+        self.lines.append("{0}\t{1}\n".format(state, final_cost))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def write_text(self, text):
+        """Writes text that is already in the text form of an FST, e.g. written
+        by another FstTextWriter."""
+        self.flush()
+        file = sys.stdout if self.file is None else self.file
+        file.write(text)
+
+    def flush(self):
+        file = sys.stdout if self.file is None else self.file
+        file.write(''.join(self.lines))
+        file.flush()
+        self.lines = []
+
+    def map_symbol(self, symbol_table, symbol):
+        """Raises ValueError if 'symbol' is not in the table; see
+        exit_unknown_symbol()."""
+        try:
+            return symbol_table[symbol]
+        except KeyError:
+            raise ValueError("symbol '{0}' is not in the symbol table".format(symbol))
+
+
+def exit_unknown_symbol(error):
+    """Prints the ValueError raised by FstTextWriter.map_symbol() and exits."""
+    print("{0}: error: {1}".format(sys.argv[0], error), file=sys.stderr)
+    sys.exit(1)
+
+
+def num_word_states(entry):
+    """Returns the number of states that write_word_arcs_no_silence() and
+    write_word_arcs_with_silence() allocate for a lexicon entry (word, pronprob,
+    pron): one per phone after the first."""
+    return max(len(entry[-1]) - 1, 0)
+
+
+def write_word_arcs(function, lexicon, next_state, writer, extra_args=(),
+                    num_states=num_word_states, num_jobs=1, shard_size=None):
+    """Calls function(lexicon, next_state, writer, *extra_args), which writes the
+    arcs for the words in 'lexicon' to 'writer', allocating states from
+    'next_state' onwards, and returns the updated next_state; and returns what
+    it returns.
+
+    If num_jobs > 1, the lexicon is split into contiguous shards of shard_size
+    entries (by default, about 4 shards per job), whose arcs are written by
+    num_jobs worker processes at the same time.  Each shard is given the range of
+    state ids that follows the one of the shard before it, with its size computed
+    from num_states(entry), the number of states 'function' allocates for an
+    entry; so the shards just need to be concatenated, and the output is the same
+    as with num_jobs=1.  'function' must be a module-level function, so that it
+    can be sent to the workers.
+    """
+    if num_jobs <= 1:
+        return function(lexicon, next_state, writer, *extra_args)
+    if shard_size is None:
+        shard_size = max(1, (len(lexicon) + 4 * num_jobs - 1) // (4 * num_jobs))
+
+    def shards():
+        first_state = next_state
+        for begin in range(0, len(lexicon), shard_size):
+            shard = lexicon[begin:begin + shard_size]
+            end_state = first_state + sum(map(num_states, shard))
+            yield function, shard, first_state, end_state, extra_args
+            first_state = end_state
+
+    pool = Pool(num_jobs, _init_worker, (writer.isymbols, writer.osymbols))
+    try:
+        for text, end_state in pool.imap(_write_shard, shards()):
+            writer.write_text(text)
+            next_state = end_state
+    except ValueError as e:
+        # a symbol of a shard is not in the symbol tables; the error is
+        # printed here, as it would be by main() with num_jobs=1.
+        pool.terminate()
+        exit_unknown_symbol(e)
+    finally:
+        pool.close()
+        pool.join()
+    return next_state
+
+
+def _init_worker(isymbols, osymbols):
+    global _worker_symbols
+    _worker_symbols = (isymbols, osymbols)
+
+
+def _write_shard(shard):
+    function, lexicon, first_state, end_state, extra_args = shard
+    output = io.StringIO()
+    writer = FstTextWriter(_worker_symbols[0], _worker_symbols[1], file=output)
+    next_state = function(lexicon, first_state, writer, *extra_args)
+    writer.flush()
+    assert next_state == end_state, "num_states() does not match " + function.__name__
+    return output.getvalue(), end_state
+
+
 def write_nonterminal_arcs(start_state, loop_state, next_state,
-                           nonterminals, left_context_phones):
+                           nonterminals, left_context_phones, writer):
     """This function relates to the grammar-decoding setup, see
     kaldi-asr.org/doc/grammar.html.  It is called from write_fst_no_silence
     and write_fst_silence, and writes to the stdout some extra arcs
@@ -133,22 +307,21 @@ def write_nonterminal_arcs(start_state, loop_state, next_state,
           strings, e.g. ['#nonterm:contact_list', ... ].
        left_context_phones: a list of phones that may appear as left-context,
           e.g. ['a', 'ah', ... '#nonterm_bos'].
+       writer: the FstTextWriter the arcs are written to.
     """
     shared_state = next_state
     next_state += 1
     final_state = next_state
     next_state += 1
 
-    print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-        src=start_state, dest=shared_state,
+    writer.write_arc(src=start_state, dest=shared_state,
         phone='#nonterm_begin', word='#nonterm_begin',
-        cost=0.0))
+        cost=0.0)
 
     for nonterminal in nonterminals:
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=loop_state, dest=shared_state,
+        writer.write_arc(src=loop_state, dest=shared_state,
             phone=nonterminal, word=nonterminal,
-            cost=0.0))
+            cost=0.0)
     # this_cost equals log(len(left_context_phones)) but the expression below
     # better captures the meaning.  Applying this cost to arcs keeps the FST
     # stochatic (sum-to-one, like an HMM), so that if we do weight pushing
@@ -157,20 +330,43 @@ def write_nonterminal_arcs(start_state, loop_state, next_state,
     this_cost = -math.log(1.0 / len(left_context_phones))
 
     for left_context_phone in left_context_phones:
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=shared_state, dest=loop_state,
-            phone=left_context_phone, word='<eps>', cost=this_cost))
+        writer.write_arc(src=shared_state, dest=loop_state,
+            phone=left_context_phone, word='<eps>', cost=this_cost)
     # arc from loop-state to a final-state with #nonterm_end as ilabel and olabel
-    print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-        src=loop_state, dest=final_state,
-        phone='#nonterm_end', word='#nonterm_end', cost=0.0))
-    print("{state}\t{final_cost}".format(
-        state=final_state, final_cost=0.0))
+    writer.write_arc(src=loop_state, dest=final_state,
+        phone='#nonterm_end', word='#nonterm_end', cost=0.0)
+    writer.write_final(final_state, 0.0)
     return next_state
 
 
 
-def write_fst_no_silence(lexicon, nonterminals=None, left_context_phones=None):
+def write_word_arcs_no_silence(lexicon, next_state, writer, loop_state):
+    """Writes the arcs for the words in 'lexicon' for write_fst_no_silence(),
+    allocating states from 'next_state' onwards; returns the updated next_state.
+    See also write_word_arcs()."""
+    for (word, pronprob, pron) in lexicon:
+        cost = -math.log(pronprob)
+        cur_state = loop_state
+        for i in range(len(pron) - 1):
+            writer.write_arc(src=cur_state,
+                dest=next_state,
+                phone=pron[i],
+                word=(word if i == 0 else '<eps>'),
+                cost=(cost if i == 0 else 0.0))
+            cur_state = next_state
+            next_state += 1
+
+        i = len(pron) - 1  # note: i == -1 if pron is empty.
+        writer.write_arc(src=cur_state,
+            dest=loop_state,
+            phone=(pron[i] if i >= 0 else '<eps>'),
+            word=(word if i <= 0 else '<eps>'),
+            cost=(cost if i <= 0 else 0.0))
+    return next_state
+
+
+def write_fst_no_silence(lexicon, nonterminals=None, left_context_phones=None,
+                         writer=None, num_jobs=1):
     """Writes the text format of L.fst to the standard output.  This version is for
     when --sil-prob=0.0, meaning there is no optional silence allowed.
 
@@ -182,43 +378,61 @@ def write_fst_no_silence(lexicon, nonterminals=None, left_context_phones=None):
      'left_context_phones', which also relates to grammar decoding, and must be
         supplied if 'nonterminals' is supplied is either None or a list of
         phones that may appear as left-context, e.g. ['a', 'ah', ... '#nonterm_bos'].
+     'writer', if not None, is the FstTextWriter to write to (e.g. to write
+        integer labels); by default the symbols are written as text.
+     'num_jobs' is the number of processes that write the arcs of the words,
+        see write_word_arcs().
     """
+    if writer is None:
+        writer = FstTextWriter()
 
     loop_state = 0
     next_state = 1  # the next un-allocated state, will be incremented as we go.
+    next_state = write_word_arcs(write_word_arcs_no_silence, lexicon, next_state,
+                                 writer, (loop_state,), num_jobs=num_jobs)
+
+    if nonterminals is not None:
+        next_state = write_nonterminal_arcs(
+            loop_state, loop_state, next_state,
+            nonterminals, left_context_phones, writer)
+
+    writer.write_final(loop_state, 0.0)
+    writer.flush()
+
+
+def write_word_arcs_with_silence(lexicon, next_state, writer,
+                                 loop_state, sil_state, sil_cost, no_sil_cost):
+    """Writes the arcs for the words in 'lexicon' for write_fst_with_silence(),
+    allocating states from 'next_state' onwards; returns the updated next_state.
+    See also write_word_arcs()."""
     for (word, pronprob, pron) in lexicon:
-        cost = -math.log(pronprob)
+        pron_cost = -math.log(pronprob)
         cur_state = loop_state
         for i in range(len(pron) - 1):
-            print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-                src=cur_state,
-                dest=next_state,
+            writer.write_arc(src=cur_state, dest=next_state,
                 phone=pron[i],
                 word=(word if i == 0 else '<eps>'),
-                cost=(cost if i == 0 else 0.0)))
+                cost=(pron_cost if i == 0 else 0.0))
             cur_state = next_state
             next_state += 1
 
         i = len(pron) - 1  # note: i == -1 if pron is empty.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
+        writer.write_arc(src=cur_state,
             dest=loop_state,
             phone=(pron[i] if i >= 0 else '<eps>'),
             word=(word if i <= 0 else '<eps>'),
-            cost=(cost if i <= 0 else 0.0)))
-
-    if nonterminals is not None:
-        next_state = write_nonterminal_arcs(
-            loop_state, loop_state, next_state,
-            nonterminals, left_context_phones)
-
-    print("{state}\t{final_cost}".format(
-        state=loop_state,
-        final_cost=0.0))
+            cost=no_sil_cost + (pron_cost if i <= 0 else 0.0))
+        writer.write_arc(src=cur_state,
+            dest=sil_state,
+            phone=(pron[i] if i >= 0 else '<eps>'),
+            word=(word if i <= 0 else '<eps>'),
+            cost=sil_cost + (pron_cost if i <= 0 else 0.0))
+    return next_state
 
 
 def write_fst_with_silence(lexicon, sil_prob, sil_phone, sil_disambig,
-                           nonterminals=None, left_context_phones=None):
+                           nonterminals=None, left_context_phones=None,
+                           writer=None, num_jobs=1):
     """Writes the text format of L.fst to the standard output.  This version is for
        when --sil-prob != 0.0, meaning there is optional silence
      'lexicon' is a list of 3-tuples (word, pron-prob, prons)
@@ -233,7 +447,13 @@ def write_fst_with_silence(lexicon, sil_prob, sil_phone, sil_disambig,
      'left_context_phones', which also relates to grammar decoding, and must be
         supplied if 'nonterminals' is supplied is either None or a list of
         phones that may appear as left-context, e.g. ['a', 'ah', ... '#nonterm_bos'].
+     'writer', if not None, is the FstTextWriter to write to (e.g. to write
+        integer labels); by default the symbols are written as text.
+     'num_jobs' is the number of processes that write the arcs of the words,
+        see write_word_arcs().
     """
+    if writer is None:
+        writer = FstTextWriter()
 
     assert sil_prob > 0.0 and sil_prob < 1.0
     sil_cost = -math.log(sil_prob)
@@ -246,61 +466,33 @@ def write_fst_with_silence(lexicon, sil_prob, sil_phone, sil_disambig,
     next_state = 3  # the next un-allocated state, will be incremented as we go.
 
 
-    print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-        src=start_state, dest=loop_state,
-        phone='<eps>', word='<eps>', cost=no_sil_cost))
-    print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-        src=start_state, dest=sil_state,
-        phone='<eps>', word='<eps>', cost=sil_cost))
+    writer.write_arc(src=start_state, dest=loop_state,
+        phone='<eps>', word='<eps>', cost=no_sil_cost)
+    writer.write_arc(src=start_state, dest=sil_state,
+        phone='<eps>', word='<eps>', cost=sil_cost)
     if sil_disambig is None:
-        print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-            src=sil_state, dest=loop_state,
-            phone=sil_phone, word='<eps>', cost=0.0))
+        writer.write_arc(src=sil_state, dest=loop_state,
+            phone=sil_phone, word='<eps>', cost=0.0)
     else:
         sil_disambig_state = next_state
         next_state += 1
-        print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-            src=sil_state, dest=sil_disambig_state,
-            phone=sil_phone, word='<eps>', cost=0.0))
-        print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-            src=sil_disambig_state, dest=loop_state,
-            phone=sil_disambig, word='<eps>', cost=0.0))
+        writer.write_arc(src=sil_state, dest=sil_disambig_state,
+            phone=sil_phone, word='<eps>', cost=0.0)
+        writer.write_arc(src=sil_disambig_state, dest=loop_state,
+            phone=sil_disambig, word='<eps>', cost=0.0)
 
 
-    for (word, pronprob, pron) in lexicon:
-        pron_cost = -math.log(pronprob)
-        cur_state = loop_state
-        for i in range(len(pron) - 1):
-            print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-                src=cur_state, dest=next_state,
-                phone=pron[i],
-                word=(word if i == 0 else '<eps>'),
-                cost=(pron_cost if i == 0 else 0.0)))
-            cur_state = next_state
-            next_state += 1
-
-        i = len(pron) - 1  # note: i == -1 if pron is empty.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
-            dest=loop_state,
-            phone=(pron[i] if i >= 0 else '<eps>'),
-            word=(word if i <= 0 else '<eps>'),
-            cost=no_sil_cost + (pron_cost if i <= 0 else 0.0)))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
-            dest=sil_state,
-            phone=(pron[i] if i >= 0 else '<eps>'),
-            word=(word if i <= 0 else '<eps>'),
-            cost=sil_cost + (pron_cost if i <= 0 else 0.0)))
+    next_state = write_word_arcs(write_word_arcs_with_silence, lexicon, next_state,
+                                 writer, (loop_state, sil_state, sil_cost, no_sil_cost),
+                                 num_jobs=num_jobs)
 
     if nonterminals is not None:
         next_state = write_nonterminal_arcs(
             start_state, loop_state, next_state,
-            nonterminals, left_context_phones)
+            nonterminals, left_context_phones, writer)
 
-    print("{state}\t{final_cost}".format(
-        state=loop_state,
-        final_cost=0.0))
+    writer.write_final(loop_state, 0.0)
+    writer.flush()
 
 
 
@@ -375,11 +567,17 @@ def main():
         nonterminals = read_nonterminals(args.nonterminals)
         left_context_phones = read_left_context_phones(args.left_context_phones)
 
-    if args.sil_prob == 0.0:
-          write_fst_no_silence(lexicon,
-                               nonterminals=nonterminals,
-                               left_context_phones=left_context_phones)
+    if (args.isymbols is None) != (args.osymbols is None):
+        print("{0}: --isymbols and --osymbols must be specified "
+              "together".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    if args.isymbols is None:
+        writer = FstTextWriter()
     else:
+        writer = FstTextWriter(read_symbol_table(args.isymbols),
+                               read_symbol_table(args.osymbols))
+
+    if args.sil_prob != 0.0:
         # Do some checking that the options make sense.
         if args.sil_prob < 0.0 or args.sil_prob >= 1.0:
             print("{0}: invalid value specified --sil-prob={1}".format(
@@ -395,10 +593,22 @@ def main():
             print("{0}: invalid value --sil-disambig='{1}' was specified."
                   "".format(sys.argv[0], args.sil_disambig), file=sys.stderr)
             sys.exit(1)
-        write_fst_with_silence(lexicon, args.sil_prob, args.sil_phone,
-                               args.sil_disambig,
-                               nonterminals=nonterminals,
-                               left_context_phones=left_context_phones)
+
+    try:
+        if args.sil_prob == 0.0:
+            write_fst_no_silence(lexicon,
+                                 nonterminals=nonterminals,
+                                 left_context_phones=left_context_phones,
+                                 writer=writer, num_jobs=args.num_jobs)
+        else:
+            write_fst_with_silence(lexicon, args.sil_prob, args.sil_phone,
+                                   args.sil_disambig,
+                                   nonterminals=nonterminals,
+                                   left_context_phones=left_context_phones,
+                                   writer=writer, num_jobs=args.num_jobs)
+    except ValueError as e:
+        # raised by FstTextWriter.map_symbol()
+        exit_unknown_symbol(e)
 
 
 
@@ -9,6 +9,7 @@ import os
 import sys
 import math
 import re
+from make_lexicon_fst import FstTextWriter, write_word_arcs
 
 # The use of latin-1 encoding does not preclude reading utf-8.  latin-1
 # encoding means "treat words as sequences of bytes", and it is compatible
@@ -62,6 +63,10 @@ def get_args():
                         help="""If supplied, --left-context-phones must also be supplied.
                         List of user-defined nonterminal symbols such as #nonterm:contact_list,
                         one per line.  E.g. data/local/dict/nonterminals.txt.""")
+    parser.add_argument('--num-jobs', dest='num_jobs', type=int, default=1,
+                        help="""Number of processes that write the arcs of different
+                        parts of the lexicon at the same time; the output is the same
+                        as with --num-jobs=1.""")
 
     args = parser.parse_args()
     return args
@@ -183,7 +188,7 @@ def read_lexiconp(filename):
 
 def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
                            next_state, sil_phone,
-                           nonterminals, left_context_phones):
+                           nonterminals, left_context_phones, writer):
     """This function relates to the grammar-decoding setup, see
     kaldi-asr.org/doc/grammar.html.  It is called from write_fst, and writes to
     the stdout some extra arcs in the lexicon FST that relate to nonterminal
@@ -203,16 +208,16 @@ def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
           strings, e.g. ['#nonterm:contact_list', ... ].
        left_context_phones: a list of phones that may appear as left-context,
           e.g. ['a', 'ah', ... '#nonterm_bos'].
+       writer: the FstTextWriter the arcs are written to.
     """
     shared_state = next_state
     next_state += 1
     final_state = next_state
     next_state += 1
 
-    print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-        src=start_state, dest=shared_state,
+    writer.write_arc(src=start_state, dest=shared_state,
         phone='#nonterm_begin', word='#nonterm_begin',
-        cost=0.0))
+        cost=0.0)
 
     for nonterminal in nonterminals:
         # What we are doing here could be viewed as a little lazy, by going to
@@ -223,10 +228,9 @@ def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
         # word-position-dependent phones are not used and some words end
         # in the optional-silence phone.
         for src in [sil_state, non_sil_state]:
-            print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-                src=src, dest=shared_state,
+            writer.write_arc(src=src, dest=shared_state,
                 phone=nonterminal, word=nonterminal,
-                cost=0.0))
+                cost=0.0)
 
     # this_cost equals log(len(left_context_phones)) but the expression below
     # better captures the meaning.  Applying this cost to arcs keeps the FST
@@ -244,9 +248,8 @@ def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
         # you have words that end in the optional-silence phone.
         dest = (sil_state if left_context_phone == sil_phone else non_sil_state)
 
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=shared_state, dest=dest,
-            phone=left_context_phone, word='<eps>', cost=this_cost))
+        writer.write_arc(src=shared_state, dest=dest,
+            phone=left_context_phone, word='<eps>', cost=this_cost)
 
     # arc from sil_state and non_sil_state to a final-state with #nonterm_end as
     # ilabel and olabel.  The costs on these arcs are zero because if you take
@@ -256,15 +259,66 @@ def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
     # lines above this, after reaching 'shared_state' because it saw the
     # user-defined nonterminal.
     for src in [sil_state, non_sil_state]:
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=src, dest=final_state,
-            phone='#nonterm_end', word='#nonterm_end', cost=0.0))
-    print("{state}\t{final_cost}".format(
-        state=final_state, final_cost=0.0))
+        writer.write_arc(src=src, dest=final_state,
+            phone='#nonterm_end', word='#nonterm_end', cost=0.0)
+    writer.write_final(final_state, 0.0)
     return next_state
 
+def num_word_states(entry):
+    """Returns the number of states that write_word_arcs_silprob() allocates for a
+    lexicon entry: one per phone (or one, if the pronunciation is empty)."""
+    return max(len(entry[-1]), 1)
+
+
+def write_word_arcs_silprob(lexicon, next_state, writer,
+                            non_sil_state, sil_state, sil_phone, sil_disambig):
+    """Writes the arcs for the words in 'lexicon' for write_fst(), allocating
+    states from 'next_state' onwards; returns the updated next_state.  See also
+    write_word_arcs() in make_lexicon_fst.py."""
+    for (word, pronprob, wordsilprob, silwordcorrection, nonsilwordcorrection, pron) in lexicon:
+        pron_cost = -math.log(pronprob)
+        word_to_sil_cost = -math.log(wordsilprob)
+        word_to_non_sil_cost = -math.log(1.0 - wordsilprob)
+        sil_to_word_cost = -math.log(silwordcorrection)
+        non_sil_to_word_cost = -math.log(nonsilwordcorrection)
+
+        if len(pron) == 0:
+            # this is not really expected but we try to handle it gracefully.
+            pron = ['<eps>']
+
+        new_state = next_state  # allocate a new state
+        next_state += 1
+        # Create transitions from both non_sil_state and sil_state to 'new_state',
+        # with the word label and the word's first phone on them
+        writer.write_arc(src=non_sil_state, dest=new_state,
+            phone=pron[0], word=word, cost=(pron_cost + non_sil_to_word_cost))
+        writer.write_arc(src=sil_state, dest=new_state,
+            phone=pron[0], word=word, cost=(pron_cost + sil_to_word_cost))
+        cur_state = new_state
+
+        # add states and arcs for all but the first phone.
+        for i in range(1, len(pron)):
+            new_state = next_state
+            next_state += 1
+            writer.write_arc(src=cur_state, dest=new_state,
+                phone=pron[i], word='<eps>')
+            cur_state = new_state
+
+        # ... and from there we return via two arcs to the silence and
+        # nonsilence state.  the silence-disambig symbol, if used,q
+        # goes on the nonsilence arc; this saves us having to insert an epsilon.
+        writer.write_arc(src=cur_state,  dest=non_sil_state,
+            phone=sil_disambig, word='<eps>',
+            cost=word_to_non_sil_cost)
+        writer.write_arc(src=cur_state, dest=sil_state,
+            phone=sil_phone, word='<eps>',
+            cost=word_to_sil_cost)
+    return next_state
+
+
 def write_fst(lexicon, silprobs, sil_phone, sil_disambig,
-              nonterminals = None, left_context_phones = None):
+              nonterminals = None, left_context_phones = None,
+              writer = None, num_jobs = 1):
     """Writes the text format of L.fst (or L_disambig.fst)  to the standard output.
      'lexicon' is a list of 5-tuples
      (word, pronprob, wordsilprob, silwordcorrection, nonsilwordcorrection, pron)
@@ -278,7 +332,13 @@ def write_fst(lexicon, silprobs, sil_phone, sil_disambig,
      'left_context_phones', which also relates to grammar decoding, and must be
         supplied if 'nonterminals' is supplied is either None or a list of
         phones that may appear as left-context, e.g. ['a', 'ah', ... '#nonterm_bos'].
+     'writer', if not None, is the FstTextWriter to write to.
+     'num_jobs' is the number of processes that write the arcs of the words,
+        see write_word_arcs() in make_lexicon_fst.py.
     """
+    if writer is None:
+        writer = FstTextWriter()
+
     silbeginprob, silendcorrection, nonsilendcorrection, siloverallprob = silprobs
     initial_sil_cost = -math.log(silbeginprob)
     initial_non_sil_cost = -math.log(1.0 - silbeginprob);
@@ -294,64 +354,24 @@ def write_fst(lexicon, silprobs, sil_phone, sil_disambig,
     # The one to the nonsilence state has the silence disambiguation symbol
     # (We always use that symbol on the *non*-silence-containing arcs, which
     # avoids having to introduce extra arcs).
-    print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-        src=start_state, dest=non_sil_state,
-        phone=sil_disambig, word='<eps>', cost=initial_non_sil_cost))
-    print('{src}\t{dest}\t{phone}\t{word}\t{cost}'.format(
-        src=start_state, dest=sil_state,
-        phone=sil_phone, word='<eps>', cost=initial_sil_cost))
-
-    for (word, pronprob, wordsilprob, silwordcorrection, nonsilwordcorrection, pron) in lexicon:
-        pron_cost = -math.log(pronprob)
-        word_to_sil_cost = -math.log(wordsilprob)
-        word_to_non_sil_cost = -math.log(1.0 - wordsilprob)
-        sil_to_word_cost = -math.log(silwordcorrection)
-        non_sil_to_word_cost = -math.log(nonsilwordcorrection)
-
-        if len(pron) == 0:
-            # this is not really expected but we try to handle it gracefully.
-            pron = ['<eps>']
+    writer.write_arc(src=start_state, dest=non_sil_state,
+        phone=sil_disambig, word='<eps>', cost=initial_non_sil_cost)
+    writer.write_arc(src=start_state, dest=sil_state,
+        phone=sil_phone, word='<eps>', cost=initial_sil_cost)
 
-        new_state = next_state  # allocate a new state
-        next_state += 1
-        # Create transitions from both non_sil_state and sil_state to 'new_state',
-        # with the word label and the word's first phone on them
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=non_sil_state, dest=new_state,
-            phone=pron[0], word=word, cost=(pron_cost + non_sil_to_word_cost)))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=sil_state, dest=new_state,
-            phone=pron[0], word=word, cost=(pron_cost + sil_to_word_cost)))
-        cur_state = new_state
-
-        # add states and arcs for all but the first phone.
-        for i in range(1, len(pron)):
-            new_state = next_state
-            next_state += 1
-            print("{src}\t{dest}\t{phone}\t<eps>".format(
-                src=cur_state, dest=new_state, phone=pron[i]))
-            cur_state = new_state
-
-        # ... and from there we return via two arcs to the silence and
-        # nonsilence state.  the silence-disambig symbol, if used,q
-        # goes on the nonsilence arc; this saves us having to insert an epsilon.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,  dest=non_sil_state,
-            phone=sil_disambig, word='<eps>',
-            cost=word_to_non_sil_cost))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state, dest=sil_state,
-            phone=sil_phone, word='<eps>',
-            cost=word_to_sil_cost))
+    next_state = write_word_arcs(write_word_arcs_silprob, lexicon, next_state, writer,
+                                 (non_sil_state, sil_state, sil_phone, sil_disambig),
+                                 num_states=num_word_states, num_jobs=num_jobs)
 
     if nonterminals is not None:
         next_state = write_nonterminal_arcs(
             start_state, sil_state, non_sil_state,
             next_state, sil_phone,
-            nonterminals, left_context_phones)
+            nonterminals, left_context_phones, writer)
 
-    print('{src}\t{cost}'.format(src=sil_state, cost=sil_end_correction_cost))
-    print('{src}\t{cost}'.format(src=non_sil_state, cost=non_sil_end_correction_cost))
+    writer.write_final(sil_state, sil_end_correction_cost)
+    writer.write_final(non_sil_state, non_sil_end_correction_cost)
+    writer.flush()
 
 def read_nonterminals(filename):
     """Reads the user-defined nonterminal symbols in 'filename', checks that
@@ -401,7 +421,7 @@ def main():
         left_context_phones = read_left_context_phones(args.left_context_phones)
 
     write_fst(lexicon, silprobs, args.sil_phone, args.sil_disambig,
-              nonterminals, left_context_phones)
+              nonterminals, left_context_phones, num_jobs=args.num_jobs)
 
 
 if __name__ == '__main__':
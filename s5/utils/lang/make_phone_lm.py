@@ -280,7 +280,7 @@ class NgramCounts(object):
         for n in reversed(list(range(args.no_backoff_ngram_order,
                                 args.ngram_order))):
             num_states_removed = 0
-            for hist, counts_for_hist in self.counts[n].items():
+            for hist, counts_for_hist in list(self.counts[n].items()):
                 l = len(counts_for_hist.word_to_count)
                 assert l > 0 and self.backoff_symbol in counts_for_hist.word_to_count
                 if l == 1 and not hist in protected_histories:  # only the backoff symbol has a count.
@@ -39,13 +39,21 @@
 import argparse
 import logging
 import math
+import os
+import sys
 
-import gzip
 from io import StringIO
 from collections import OrderedDict
 from collections import defaultdict
-from enum import Enum, unique
-import re
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'steps', 'libs'))
+import arpa as arpa_lib
 
 parser = argparse.ArgumentParser(description="""
     Prune an n-gram language model based on the relative entropy 
@@ -60,6 +68,16 @@ parser.add_argument("-threshold",
                     type=float,
                     default=1e-6,
                     help="Order of n-gram")
+parser.add_argument("-thresholds",
+                    type=str,
+                    default=None,
+                    help="Comma-separated list of thresholds, e.g. "
+                    "1e-8,1e-7,1e-6. If given, the model is pruned with each "
+                    "of them (instead of -threshold) computing the change in "
+                    "perplexity of each ngram only once, and the ngram counts "
+                    "for each threshold are printed to stdout. -write-lm "
+                    "must then contain '{threshold}', which is replaced with "
+                    "each threshold as written here.")
 parser.add_argument("-lm",
                     type=str,
                     default=None,
@@ -77,6 +95,21 @@ parser.add_argument("-encoding",
                     type=str,
                     default="utf-8",
                     help="Encoding of the arpa file")
+parser.add_argument("-arpa-cache",
+                    type=str,
+                    default=None,
+                    help="Directory of a binary cache of parsed arpa files, "
+                    "keyed by the hash of the file (see steps/libs/arpa_cache.py). "
+                    "Repeated runs on the same input skip parsing the text.")
+parser.add_argument("-kernel",
+                    type=str,
+                    default=None,
+                    choices=["numpy", "python"],
+                    help="How the change in perplexity of each ngram and the "
+                    "new backoff weights are computed: 'numpy' (in bulk, on "
+                    "arrays of word ids; the default when numpy is available) "
+                    "or 'python' (one ngram at a time). They agree up to "
+                    "floating-point rounding.")
 parser.add_argument("-verbose",
                     type=int,
                     default=2,
@@ -103,6 +136,12 @@ class Context(dict):
         super().__init__()
         self.log_bo = None
 
+    def copy(self):
+        context = Context()
+        context.update(self)
+        context.log_bo = self.log_bo
+        return context
+
 
 class Arpa:
     """
@@ -161,16 +200,30 @@ class Arpa:
         self._check_word(word)
         return word in self._vocabulary
 
+    def copy(self):
+        """
+        Returns a copy of this LM that can be pruned without modifying it.
+        """
+        lm = Arpa()
+        lm._unk = self._unk
+        lm._counts = OrderedDict(self._counts)
+        for order, h_dict in self._ngrams.items():
+            lm._ngrams[order] = defaultdict(Context)
+            lm._ngrams[order].update(
+                (h, context.copy()) for h, context in h_dict.items())
+        lm._vocabulary = set(self._vocabulary)
+        return lm
+
     def add_count(self, order, count):
         self._counts[order] = count
         self._ngrams[order - 1] = defaultdict(Context)
 
     def update_counts(self):
+        # an order that was pruned to nothing gets a count of 0 (it keeps its
+        # place in the \data\ section, with an empty section).
         for order in range(1, self.order() + 1):
-            count = sum(
+            self._counts[order] = sum(
                 [len(wlist) for _, wlist in self._ngrams[order - 1].items()])
-            if count > 0:
-                self._counts[order] = count
 
     def add_entry(self, ngram, p, bo=None, order=None):
         # Note: ngram is a tuple of strings, e.g. ("w1", "w2", "w3")
@@ -294,108 +347,28 @@ class Arpa:
         return self.base**self.log_s(sentence)
 
     def write(self, fp):
-        fp.write('\n\\data\\\n')
-        for order, count in self.counts():
-            fp.write('ngram {}={}\n'.format(order, count))
-        fp.write('\n')
-        for order, _ in self.counts():
-            fp.write('\\{}-grams:\n'.format(order))
-            for e in self._entries(order):
-                prob = e[0]
-                ngram = ' '.join(e[1])
-                if len(e) == 2:
-                    fp.write('{}\t{}\n'.format(prob, ngram))
-                elif len(e) == 3:
-                    backoff = e[2]
-                    fp.write('{}\t{}\t{}\n'.format(prob, ngram, backoff))
-                else:
-                    raise ValueError
-            fp.write('\n')
-        fp.write('\\end\\\n')
+        arpa_lib.write_arpa(
+            fp, self.counts(),
+            ((order, (e if len(e) == 3 else e + (None, ) for e in self._entries(order)))
+             for order, _ in self.counts()))
 
 
 class ArpaParser:
     """
     This is a class that implement a parser of an arpa file
     """
-    @unique
-    class State(Enum):
-        DATA = 1
-        COUNT = 2
-        HEADER = 3
-        ENTRY = 4
-
-    re_count = re.compile(r'^ngram (\d+)=(\d+)$')
-    re_header = re.compile(r'^\\(\d+)-grams:$')
-    re_entry = re.compile('^(-?\\d+(\\.\\d+)?([eE]-?\\d+)?)'
-                          '\t'
-                          '(\\S+( \\S+)*)'
-                          '(\t((-?\\d+(\\.\\d+)?)([eE]-?\\d+)?))?$')
-
     def _parse(self, fp):
-        self._result = []
-        self._state = self.State.DATA
-        self._tmp_model = None
-        self._tmp_order = None
-        for line in fp:
-            line = line.strip()
-            if self._state == self.State.DATA:
-                self._data(line)
-            elif self._state == self.State.COUNT:
-                self._count(line)
-            elif self._state == self.State.HEADER:
-                self._header(line)
-            elif self._state == self.State.ENTRY:
-                self._entry(line)
-        if self._state != self.State.DATA:
-            raise Exception(line)
-        return self._result
-
-    def _data(self, line):
-        if line == '\\data\\':
-            self._state = self.State.COUNT
-            self._tmp_model = Arpa()
-        else:
-            pass  # skip comment line
-
-    def _count(self, line):
-        match = self.re_count.match(line)
-        if match:
-            order = match.group(1)
-            count = match.group(2)
-            self._tmp_model.add_count(int(order), int(count))
-        elif not line:
-            self._state = self.State.HEADER  # there are no counts
-        else:
-            raise Exception(line)
-
-    def _header(self, line):
-        match = self.re_header.match(line)
-        if match:
-            self._state = self.State.ENTRY
-            self._tmp_order = int(match.group(1))
-        elif line == '\\end\\':
-            self._result.append(self._tmp_model)
-            self._state = self.State.DATA
-            self._tmp_model = None
-            self._tmp_order = None
-        elif not line:
-            pass  # skip empty line
-        else:
-            raise Exception(line)
-
-    def _entry(self, line):
-        match = self.re_entry.match(line)
-        if match:
-            p = self._float_or_int(match.group(1))
-            ngram = tuple(match.group(4).split(' '))
-            bo_match = match.group(7)
-            bo = self._float_or_int(bo_match) if bo_match else None
-            self._tmp_model.add_entry(ngram, p, bo, self._tmp_order)
-        elif not line:
-            self._state = self.State.HEADER  # last entry
-        else:
-            raise Exception(line)
+        result = []
+        reader = arpa_lib.ArpaReader(fp, value_type=self._float_or_int)
+        while reader.read_header():
+            model = Arpa()
+            for order, count in reader.counts:
+                model.add_count(order, count)
+            for order, entries in reader.sections(parse=True):
+                for p, ngram, bo in entries:
+                    model.add_entry(ngram, p, bo, order)
+            result.append(model)
+        return result
 
     @staticmethod
     def _float_or_int(s):
@@ -412,13 +385,8 @@ class ArpaParser:
 
     def loadf(self, path, encoding=None):
         """Deserialize path (.arpa, .gz) to a Python object."""
-        path = str(path)
-        if path.endswith('.gz'):
-            with gzip.open(path, mode='rt', encoding=encoding) as f:
-                return self.load(f)
-        else:
-            with open(path, mode='rt', encoding=encoding) as f:
-                return self.load(f)
+        with arpa_lib.open_arpa(str(path), encoding=encoding) as f:
+            return self.load(f)
 
     def loads(self, s):
         """Deserialize s (a str) to a Python object."""
@@ -431,13 +399,8 @@ class ArpaParser:
 
     def dumpf(self, obj, path, encoding=None):
         """Serialize obj to path in ARPA format (.arpa, .gz)."""
-        path = str(path)
-        if path.endswith('.gz'):
-            with gzip.open(path, mode='wt', encoding=encoding) as f:
-                return self.dump(obj, f)
-        else:
-            with open(path, mode='wt', encoding=encoding) as f:
-                self.dump(obj, f)
+        with arpa_lib.open_arpa(str(path), 'w', encoding=encoding) as f:
+            self.dump(obj, f)
 
     def dumps(self, obj):
         """Serialize obj to an ARPA formatted str."""
@@ -446,6 +409,49 @@ class ArpaParser:
             return f.getvalue()
 
 
+def load_arpa_from_cache(path, cache_dir, encoding=None):
+    """Load the model in path through the binary cache in cache_dir.
+
+    The entries are added in file order, as ArpaParser would, so the result
+    is the same Arpa object (including the int/float type of each value).
+    Raises ArpaCacheError if the file cannot be cached.
+    """
+    import arpa_cache as arpa_cache_lib
+    import numpy as np
+
+    cached = arpa_cache_lib.load_arpa_cache(path, cache_dir)
+    words = np.array(cached.decoded_words(encoding or 'utf-8'), dtype=object)
+
+    lm = Arpa()
+    for order, count in cached.counts:
+        lm.add_count(order, count)
+    lm._vocabulary = set(words.tolist())
+    for order, _ in cached.sections:
+        entries = cached.ngrams[order]
+        ids = np.asarray(entries['ids'])
+        columns = [words[ids[:, i]].tolist() for i in range(order)]
+        flags = np.asarray(entries['flags'])
+        log_p = np.asarray(entries['logp']).astype(object)
+        is_int = (flags & arpa_cache_lib.LOGP_IS_INT) != 0
+        log_p[is_int] = [int(p) for p in log_p[is_int]]
+
+        h_dict = lm._ngrams[order - 1]
+        histories = list(zip(*columns[:-1])) if order > 1 else [()] * len(ids)
+        for h, w, p in zip(histories, columns[-1], log_p.tolist()):
+            h_dict[h][w] = p
+
+        has_bow = np.flatnonzero(flags & arpa_cache_lib.HAS_BOW)
+        if len(has_bow) > 0:
+            log_bo = np.asarray(entries['bow'])[has_bow].astype(object)
+            is_int = (flags[has_bow] & arpa_cache_lib.BOW_IS_INT) != 0
+            log_bo[is_int] = [int(bo) for bo in log_bo[is_int]]
+            ngram_dict = lm._ngrams[order]
+            for ngram, bo in zip(zip(*[[c[k] for k in has_bow.tolist()] for c in columns]),
+                                 log_bo.tolist()):
+                ngram_dict[ngram].log_bo = bo
+    return lm
+
+
 def add_log_p(prev_log_sum, log_p, base):
     return math.log(base**log_p + base**prev_log_sum, base)
 
@@ -467,9 +473,330 @@ def compute_numerator_denominator(lm, h):
     return numerator, denominator
 
 
-def prune(lm, threshold, minorder):
+def compute_perp_changes(lm, h):
+    """
+    Returns a list with, for each word w seen after the context h (in the
+    order of lm._ngrams[len(h)][h]), the relative change in (training set)
+    perplexity caused by removing the ngram (h, w) from lm.
+
+    This only depends on the probabilities of the ngrams of order len(h) + 1
+    and lower under the context h, which prune() does not modify before it
+    processes h; so it is the same for any threshold.
+    """
+    # old backoff weight, BOW(h)
+    log_bow = lm._log_bo(h)
+    if log_bow is None:
+        log_bow = 0
+
+    # Compute numerator and denominator of the backoff weight,
+    # so that we can quickly compute the BOW adjustment due to
+    # leaving out one prob.
+    numerator, denominator = compute_numerator_denominator(lm, h)
+
+    # assert abs(math.log(numerator, lm.base) - math.log(denominator, lm.base) - h_dict[h].log_bo) < 1e-5
+
+    # Compute the marginal probability of the context, P(h)
+    h_log_p = lm.log_joint_prob(h)
+
+    perp_changes = []
+    for w, log_p in lm._ngrams[len(h)][h].items():
+        ngram = h + (w, )
+
+        # lower-order estimate for ngramProb, P(w|h')
+        backoff_prob = lm.log_p_raw(ngram[1:])
+
+        # Compute BOW after removing ngram, BOW'(h)
+        new_log_bow = math.log(numerator + lm.base ** log_p, lm.base) - \
+                      math.log(denominator + lm.base ** backoff_prob, lm.base)
+
+        # Compute change in entropy due to removal of ngram
+        delta_prob = backoff_prob + new_log_bow - log_p
+        delta_entropy = - (lm.base ** h_log_p) * \
+                        ((lm.base ** log_p) * delta_prob +
+                         numerator * (new_log_bow - log_bow))
+
+        # compute relative change in model (training set) perplexity
+        perp_change = lm.base**delta_entropy - 1.0
+
+        logging.debug("CONTEXT " + str(h) + " WORD " + w +
+                      " CONTEXTPROB %f " % h_log_p +
+                      " OLDPROB %f " % log_p + " NEWPROB %f " %
+                      (backoff_prob + new_log_bow) +
+                      " DELTA-H %f " % delta_entropy +
+                      " DELTA-LOGP %f " % delta_prob +
+                      " PPL-CHANGE %f " % perp_change)
+        perp_changes.append(perp_change)
+    return perp_changes
+
+
+def compute_all_perp_changes(lm, minorder, kernel='python'):
+    """
+    Returns a dict perp_changes[i][h] with the output of
+    compute_perp_changes(lm, h) for every context h of the i-grams that
+    prune(lm, threshold, minorder) would process.
+    """
+    if kernel == 'numpy':
+        return ArrayLM(lm).compute_all_perp_changes(minorder)
+    perp_changes = {}
+    for i in range(lm.order(), max(minorder - 1, 1), -1):
+        logging.info("computing the perplexity changes of %d-grams ..." % i)
+        perp_changes[i] = {
+            h: compute_perp_changes(lm, h)
+            for h in lm._ngrams[i - 1]
+        }
+    return perp_changes
+
+
+class _WordIds(dict):
+    def __missing__(self, word):
+        word_id = len(self)
+        self[word] = word_id
+        return word_id
+
+
+class ArrayLM:
+    """
+    A view of an Arpa object as numpy arrays, used by the 'numpy' kernel to
+    compute the changes in perplexity and the backoff weights of all the
+    ngrams of an order at once.
+
+    Every ngram of length k that is an entry, a context (a key of
+    lm._ngrams[k]) or a prefix of one is a node of level k, identified by its
+    position ('rank') in the sorted array self.keys[k] of the packed keys
+    rank(ngram[:-1]) * V + word_id(ngram[-1]), where V is the vocabulary
+    size.  self.prob[k] and self.bow[k] hold the log-prob and the log-backoff
+    weight of each node, or NaN if it has none.
+    """
+    def __init__(self, lm):
+        assert np is not None, "ArrayLM requires numpy"
+        self.base = lm.base
+        self.order = lm.order()
+        self.word_ids = _WordIds()
+        word_id = self.word_ids.__getitem__
+
+        # contexts[k] lists the keys of lm._ngrams[k] (ngrams of length k) in
+        # order; entry_*[k] describe the k-grams in the order of
+        # lm._ngrams[k - 1], context by context.
+        self.contexts = {}
+        self.context_words = {}
+        self.num_children = {}
+        self.entry_context = {}
+        self.entry_words = {}
+        self.entry_log_p = {}
+        for k in range(0, self.order + 1):
+            h_dict = lm._ngrams.get(k, {})
+            contexts = list(h_dict.keys())
+            self.contexts[k] = contexts
+            self.context_words[k] = np.fromiter(
+                map(word_id, chain.from_iterable(contexts)),
+                dtype=np.int64, count=len(contexts) * k).reshape(len(contexts), k)
+            num_children = np.fromiter(
+                map(len, h_dict.values()), dtype=np.int64, count=len(contexts))
+            self.num_children[k] = num_children
+            if k == self.order:
+                break
+            num_entries = int(num_children.sum())
+            self.entry_context[k + 1] = np.repeat(
+                np.arange(len(contexts)), num_children)
+            words = np.fromiter(
+                map(word_id, chain.from_iterable(h_dict.values())),
+                dtype=np.int64, count=num_entries)
+            self.entry_words[k + 1] = np.hstack(
+                [self.context_words[k][self.entry_context[k + 1]], words[:, None]])
+            self.entry_log_p[k + 1] = np.fromiter(
+                chain.from_iterable(c.values() for c in h_dict.values()),
+                dtype=np.float64, count=num_entries)
+
+        # prefixes of contexts that are neither entries nor contexts
+        # themselves (this only happens in unusual arpa files).
+        extra = defaultdict(set)
+        for k in range(self.order - 1, 1, -1):
+            for h in chain(self.contexts[k], extra[k]):
+                prefix = h[:-1]
+                if prefix not in lm._ngrams[k - 1] and \
+                        prefix not in extra[k - 1] and \
+                        lm._log_p(prefix) is None:
+                    extra[k - 1].add(prefix)
+        extra_words = {
+            k: np.array([[word_id(w) for w in h] for h in extra[k]],
+                        dtype=np.int64).reshape(len(extra[k]), k)
+            for k in range(1, self.order + 1)}
+
+        self.vocab_size = len(self.word_ids)
+        self.keys = {0: np.zeros(1, dtype=np.int64)}
+        self.prob = {0: np.full(1, np.nan)}
+        self.bow = {0: np.full(1, np.nan)}
+        self.context_ranks = {0: np.zeros(len(self.contexts[0]), dtype=np.int64)}
+        for k in range(1, self.order + 1):
+            entry_keys = self.context_ranks[k - 1][self.entry_context[k]] * \
+                self.vocab_size + self.entry_words[k][:, -1]
+            context_keys = self._child_keys(self.context_words[k])
+            self.keys[k] = np.unique(np.concatenate(
+                [entry_keys, context_keys, self._child_keys(extra_words[k])]))
+            self.prob[k] = np.full(len(self.keys[k]), np.nan)
+            self.prob[k][np.searchsorted(self.keys[k], entry_keys)] = \
+                self.entry_log_p[k]
+            self.context_ranks[k] = np.searchsorted(self.keys[k], context_keys)
+            self.bow[k] = np.full(len(self.keys[k]), np.nan)
+            if k < self.order:
+                log_bo = np.array(
+                    [c.log_bo for c in lm._ngrams[k].values()], dtype=np.float64)
+                self.bow[k][self.context_ranks[k]] = log_bo
+
+    def _child_keys(self, words):
+        # keys of the ngrams in the rows of words, whose prefixes must be nodes
+        prefix_ranks = self.lookup(words[:, :-1])
+        assert np.all(prefix_ranks >= 0)
+        return prefix_ranks * self.vocab_size + words[:, -1]
+
+    def lookup(self, words):
+        """
+        Returns the rank of the ngram in each row of words (an array of word
+        ids of shape (num_ngrams, k)) among the nodes of level k, or -1 if it
+        is not a node.
+        """
+        ranks = np.zeros(len(words), dtype=np.int64)
+        found = np.ones(len(words), dtype=bool)
+        for j in range(words.shape[1]):
+            keys = self.keys[j + 1]
+            if len(keys) == 0:
+                return np.full(len(words), -1, dtype=np.int64)
+            query = ranks * self.vocab_size + words[:, j]
+            pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+            found &= keys[pos] == query
+            ranks = np.where(found, pos, 0)
+        return np.where(found, ranks, -1)
+
+    @staticmethod
+    def _gather(values, ranks):
+        result = np.full(len(ranks), np.nan)
+        valid = ranks >= 0
+        result[valid] = values[ranks[valid]]
+        return result
+
+    def _log(self, x):
+        if not np.all(x > 0):
+            raise ValueError("math domain error")
+        return np.log(x) / math.log(self.base)
+
+    def log_p_raw(self, words):
+        """
+        Vectorized Arpa.log_p_raw() for the ngrams in the rows of words.
+        """
+        num_words = words.shape[1]
+        log_p = np.zeros(len(words))
+        todo = np.arange(len(words))
+        for start in range(num_words):
+            p = self._gather(self.prob[num_words - start],
+                             self.lookup(words[todo, start:]))
+            found = ~np.isnan(p)
+            log_p[todo[found]] += p[found]
+            todo = todo[~found]
+            if len(todo) == 0:
+                break
+            if start == num_words - 1:
+                raise KeyError(tuple(words[todo[0]]))
+            log_bo = self._gather(self.bow[num_words - start - 1],
+                                  self.lookup(words[todo, start:-1]))
+            log_p[todo] += np.where(np.isnan(log_bo), 0.0, log_bo)
+        return log_p
+
+    def log_joint_prob(self, words):
+        """
+        Vectorized Arpa.log_joint_prob() for the ngrams in the rows of words.
+        """
+        log_joint_p = np.zeros(len(words))
+        for j in range(words.shape[1], 0, -1):
+            prefix = words[:, :j]
+            if j == 1 and words.shape[1] > 1 and Arpa.SOS in self.word_ids:
+                # P(<s>) = 0, so use P(</s>) instead, as Arpa.log_joint_prob()
+                is_sos = prefix[:, 0] == self.word_ids[Arpa.SOS]
+                if np.any(is_sos):
+                    if Arpa.EOS not in self.word_ids:
+                        raise KeyError((Arpa.EOS, ))
+                    prefix = np.where(is_sos[:, None],
+                                      self.word_ids[Arpa.EOS], prefix)
+            log_joint_p += self.log_p_raw(prefix)
+        return log_joint_p
+
+    def _numerator_denominator(self, i, p, backoff_p):
+        # vectorized compute_numerator_denominator() for every context of
+        # the i-grams, given the probabilities of their i-grams and of the
+        # corresponding lower-order estimates.
+        num_contexts = len(self.contexts[i - 1])
+        numerator = 1.0 - np.bincount(
+            self.entry_context[i], weights=p, minlength=num_contexts)
+        denominator = 1.0 - np.bincount(
+            self.entry_context[i], weights=backoff_p, minlength=num_contexts)
+        return numerator, denominator
+
+    def compute_all_perp_changes(self, minorder):
+        """
+        Same as compute_all_perp_changes(lm, minorder) with the 'python'
+        kernel (see compute_perp_changes()), for the lm this was built from.
+        """
+        perp_changes = {}
+        for i in range(self.order, max(minorder - 1, 1), -1):
+            logging.info("computing the perplexity changes of %d-grams ..." % i)
+            ctx = self.entry_context[i]
+            log_p = self.entry_log_p[i]
+            p = self.base ** log_p
+
+            # lower-order estimate for ngramProb, P(w|h')
+            backoff_log_p = self.log_p_raw(self.entry_words[i][:, 1:])
+            backoff_p = self.base ** backoff_log_p
+
+            numerator, denominator = self._numerator_denominator(
+                i, p, backoff_p)
+            numerator = numerator[ctx]
+            log_bow = self._gather(self.bow[i - 1], self.context_ranks[i - 1])
+            log_bow = np.where(np.isnan(log_bow), 0.0, log_bow)[ctx]
+            h_p = self.base ** self.log_joint_prob(self.context_words[i - 1])
+
+            new_log_bow = self._log(numerator + p) - \
+                self._log(denominator[ctx] + backoff_p)
+            delta_prob = backoff_log_p + new_log_bow - log_p
+            delta_entropy = -h_p[ctx] * \
+                (p * delta_prob + numerator * (new_log_bow - log_bow))
+            values = (self.base ** delta_entropy - 1.0).tolist()
+
+            ends = np.cumsum(self.num_children[i - 1]).tolist()
+            perp_changes[i] = {
+                h: values[start:end]
+                for h, start, end in zip(self.contexts[i - 1], [0] + ends, ends)
+            }
+        return perp_changes
+
+    def recompute_backoff_weights(self, lm, minorder):
+        """
+        Sets the backoff weight of every context of order minorder - 1 and
+        higher in lm (the lm this was built from) as prune() does.
+        """
+        for i in range(max(minorder - 1, 1) + 1, self.order + 1):
+            p = self.base ** self.entry_log_p[i]
+            backoff_p = self.base ** self.log_p_raw(self.entry_words[i][:, 1:])
+            numerator, denominator = self._numerator_denominator(
+                i, p, backoff_p)
+            new_log_bow = self._log(numerator) - self._log(denominator)
+            # later orders back off to these contexts
+            self.bow[i - 1][self.context_ranks[i - 1]] = new_log_bow
+            h_dict = lm._ngrams[i - 1]
+            for h, log_bo in zip(self.contexts[i - 1], new_log_bow.tolist()):
+                h_dict[h].log_bo = log_bo
+
+
+def prune(lm, threshold, minorder, perp_changes=None, kernel='python'):
     # Reference:
     # https://github.com/BitSpeech/SRILM/blob/d571a4424fb0cf08b29fbfccfddd092ea969eae3/lm/src/NgramLM.cc#L2330
+    #
+    # If perp_changes is given, it is the output of
+    # compute_all_perp_changes() on the unpruned lm; it is used instead of
+    # computing the change in perplexity of each ngram again (see
+    # prune_sweep()).  With kernel='numpy', the changes in perplexity and the
+    # new backoff weights are computed with ArrayLM.
+
+    if perp_changes is None and kernel == 'numpy':
+        perp_changes = compute_all_perp_changes(lm, minorder, kernel)
 
     for i in range(lm.order(), max(minorder - 1, 1),
                    -1):  # i is the order of the ngram (h, w)
@@ -478,43 +805,17 @@ def prune(lm, threshold, minorder):
 
         h_dict = lm._ngrams[i - 1]
         for h in list(h_dict.keys()):
-            # old backoff weight, BOW(h)
-            log_bow = lm._log_bo(h)
-            if log_bow is None:
-                log_bow = 0
-
-            # Compute numerator and denominator of the backoff weight,
-            # so that we can quickly compute the BOW adjustment due to
-            # leaving out one prob.
-            numerator, denominator = compute_numerator_denominator(lm, h)
-
-            # assert abs(math.log(numerator, lm.base) - math.log(denominator, lm.base) - h_dict[h].log_bo) < 1e-5
-
-            # Compute the marginal probability of the context, P(h)
-            h_log_p = lm.log_joint_prob(h)
+            if perp_changes is None:
+                h_perp_changes = compute_perp_changes(lm, h)
+            else:
+                h_perp_changes = perp_changes[i][h]
 
             all_pruned = True
             pruned_w_set = set()
 
-            for w, log_p in h_dict[h].items():
+            for w, perp_change in zip(h_dict[h], h_perp_changes):
                 ngram = h + (w, )
 
-                # lower-order estimate for ngramProb, P(w|h')
-                backoff_prob = lm.log_p_raw(ngram[1:])
-
-                # Compute BOW after removing ngram, BOW'(h)
-                new_log_bow = math.log(numerator + lm.base ** log_p, lm.base) - \
-                              math.log(denominator + lm.base ** backoff_prob, lm.base)
-
-                # Compute change in entropy due to removal of ngram
-                delta_prob = backoff_prob + new_log_bow - log_p
-                delta_entropy = - (lm.base ** h_log_p) * \
-                                ((lm.base ** log_p) * delta_prob +
-                                 numerator * (new_log_bow - log_bow))
-
-                # compute relative change in model (training set) perplexity
-                perp_change = lm.base**delta_entropy - 1.0
-
                 pruned = threshold > 0 and perp_change < threshold
 
                 # Make sure we don't prune ngrams whose backoff nodes are needed
@@ -523,14 +824,8 @@ def prune(lm, threshold, minorder):
                         len(lm._ngrams[len(ngram)][ngram]) > 0:
                     pruned = False
 
-                logging.debug("CONTEXT " + str(h) + " WORD " + w +
-                              " CONTEXTPROB %f " % h_log_p +
-                              " OLDPROB %f " % log_p + " NEWPROB %f " %
-                              (backoff_prob + new_log_bow) +
-                              " DELTA-H %f " % delta_entropy +
-                              " DELTA-LOGP %f " % delta_prob +
-                              " PPL-CHANGE %f " % perp_change + " PRUNED " +
-                              str(pruned))
+                logging.debug("CONTEXT %s WORD %s PPL-CHANGE %f PRUNED %s",
+                              h, w, perp_change, pruned)
 
                 if pruned:
                     pruned_w_set.add(w)
@@ -563,14 +858,17 @@ def prune(lm, threshold, minorder):
         logging.info("pruned %d %d-grams" % (count_pruned_ngrams, i))
 
     # recompute backoff weights
-    for i in range(max(minorder - 1, 1) + 1,
-                   lm.order() +
-                   1):  # be careful of this order: from low- to high-order
-        for h in lm._ngrams[i - 1]:
-            numerator, denominator = compute_numerator_denominator(lm, h)
-            new_log_bow = math.log(numerator, lm.base) - math.log(
-                denominator, lm.base)
-            lm._ngrams[len(h)][h].log_bo = new_log_bow
+    if kernel == 'numpy':
+        ArrayLM(lm).recompute_backoff_weights(lm, minorder)
+    else:
+        for i in range(max(minorder - 1, 1) + 1,
+                       lm.order() +
+                       1):  # be careful of this order: from low- to high-order
+            for h in lm._ngrams[i - 1]:
+                numerator, denominator = compute_numerator_denominator(lm, h)
+                new_log_bow = math.log(numerator, lm.base) - math.log(
+                    denominator, lm.base)
+                lm._ngrams[len(h)][h].log_bo = new_log_bow
 
     # update counts
     lm.update_counts()
@@ -578,6 +876,23 @@ def prune(lm, threshold, minorder):
     return
 
 
+def prune_sweep(lm, thresholds, minorder, kernel='python'):
+    """
+    Prunes a copy of lm with each threshold in thresholds, and yields
+    (threshold, pruned_lm) pairs; each pruned_lm is the same as what
+    prune(lm, threshold, minorder) would give.  The change in perplexity of
+    each ngram does not depend on the threshold, so it is computed only once
+    and lm itself is not modified.
+    """
+    perp_changes = compute_all_perp_changes(lm, minorder, kernel)
+    for threshold in thresholds:
+        logging.info("Pruning a copy of the model with threshold=%.3E..." %
+                     threshold)
+        pruned_lm = lm.copy()
+        prune(pruned_lm, threshold, minorder, perp_changes, kernel)
+        yield threshold, pruned_lm
+
+
 def check_h_is_valid(lm, h):
     sum_under_h = sum(
         [lm.base**lm.log_p_raw(h + (w, )) for w in lm.vocabulary(sort=False)])
@@ -602,19 +917,61 @@ def compare_two_apras(path1, path2):
 
 
 if __name__ == '__main__':
+    kernel = args.kernel
+    if kernel is None:
+        kernel = "numpy" if np is not None else "python"
+    if kernel == "numpy" and np is None:
+        sys.exit("ngram_entropy_pruning.py: -kernel numpy requires numpy")
+
     # load an arpa file
     logging.info("Loading the arpa file from %s" % args.lm)
     parser = ArpaParser()
-    models = parser.loadf(args.lm, encoding=default_encoding)
-    lm = models[0]  # ARPA files may contain several models.
+    lm = None
+    if args.arpa_cache is not None:
+        try:
+            lm = load_arpa_from_cache(args.lm, args.arpa_cache, encoding=default_encoding)
+            logging.info("Loaded the model through the arpa cache in %s" % args.arpa_cache)
+        except Exception as e:
+            # e.g. the file is not in the canonical layout, or numpy is missing
+            logging.warning("Cannot use the arpa cache (%s); parsing the text" % e)
+    if lm is None:
+        models = parser.loadf(args.lm, encoding=default_encoding)
+        lm = models[0]  # ARPA files may contain several models.
     logging.info("Stats before pruning:")
     for i, cnt in lm.counts():
         logging.info("ngram %d=%d" % (i, cnt))
 
+    if args.thresholds is not None:
+        threshold_strs = [t.strip() for t in args.thresholds.split(',') if t.strip()]
+        thresholds = [float(t) for t in threshold_strs]
+        if args.write_lm is None or '{threshold}' not in args.write_lm:
+            sys.exit("ngram_entropy_pruning.py: with -thresholds, -write-lm "
+                     "must contain '{threshold}'")
+
+        orders = [i for i, _ in lm.counts()]
+        print('\t'.join(['# threshold'] + ['%d-grams' % i for i in orders] +
+                        ['total']))
+        for threshold_str, (threshold, pruned_lm) in zip(
+                threshold_strs, prune_sweep(lm, thresholds, args.minorder,
+                                           kernel)):
+            counts = dict(pruned_lm.counts())
+            logging.info("Stats after pruning with threshold=%s:" % threshold_str)
+            for i, cnt in pruned_lm.counts():
+                logging.info("ngram %d=%d" % (i, cnt))
+            write_lm = args.write_lm.replace('{threshold}', threshold_str)
+            logging.info("Saving the pruned arpa file to %s" % write_lm)
+            parser.dumpf(pruned_lm, write_lm, encoding=default_encoding)
+            print('\t'.join([threshold_str] +
+                            [str(counts.get(i, 0)) for i in orders] +
+                            [str(sum(counts.values()))]))
+            sys.stdout.flush()
+        logging.info("Done.")
+        sys.exit(0)
+
     # prune it, the language model will be modified in-place
     logging.info("Start pruning the model with threshold=%.3E..." %
                  args.threshold)
-    prune(lm, args.threshold, args.minorder)
+    prune(lm, args.threshold, args.minorder, kernel=kernel)
 
     # validate_lm(lm)
 
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Apache 2.0.
+
+# Tests for ngram_entropy_pruning.py.  Run with:
+#   python3 utils/lang/test_ngram_entropy_pruning.py
+# (or with pytest).
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+LANG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_data_counts(path):
+    """Returns the 'ngram N=count' lines of the \\data\\ section of an ARPA
+    file as a dict from N to count."""
+    counts = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('ngram '):
+                order, count = line[len('ngram '):].split('=')
+                counts[int(order)] = int(count)
+            elif line.startswith('\\1-grams:'):
+                break
+    return counts
+
+
+def count_entries(path):
+    """Returns the number of entries in each '\\N-grams:' section of an ARPA
+    file, as a dict from N to count."""
+    counts = {}
+    order = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('\\') and line.endswith('-grams:'):
+                order = int(line[1:-len('-grams:')])
+                counts[order] = 0
+            elif line == '\\end\\':
+                order = None
+            elif line and order is not None:
+                counts[order] += 1
+    return counts
+
+
+class ThresholdSweepTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        rng = random.Random(3)
+        words = ['w{0}'.format(i) for i in range(40)]
+        text = os.path.join(cls.dir, 'text')
+        with open(text, 'w', encoding='utf-8') as f:
+            for _ in range(300):
+                f.write(' '.join(rng.choice(words)
+                                 for _ in range(rng.randint(3, 9))) + '\n')
+        cls.lm = os.path.join(cls.dir, 'lm.arpa')
+        subprocess.check_call(
+            [sys.executable, os.path.join(LANG_DIR, 'make_kn_lm.py'),
+             '-ngram-order', '3', '-text', text, '-lm', cls.lm],
+            stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def prune(self, *options):
+        return subprocess.check_output(
+            [sys.executable, os.path.join(LANG_DIR, 'ngram_entropy_pruning.py'),
+             '-lm', self.lm] + list(options),
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    def test_orders_pruned_to_empty(self):
+        # with the larger thresholds all the 2-grams and 3-grams are pruned;
+        # the table and the \data\ sections must count what is left.
+        write_lm = os.path.join(self.dir, 'pruned.{threshold}.arpa')
+        output = self.prune('-thresholds', '1e-5,1e-2,1e-1', '-write-lm', write_lm)
+        rows = [line.split('\t') for line in output.splitlines()
+                if not line.startswith('#')]
+        self.assertEqual([row[0] for row in rows], ['1e-5', '1e-2', '1e-1'])
+        totals = []
+        for row in rows:
+            path = write_lm.replace('{threshold}', row[0])
+            entries = count_entries(path)
+            self.assertEqual(read_data_counts(path), entries)
+            self.assertEqual([int(c) for c in row[1:-1]],
+                             [entries[order] for order in sorted(entries)])
+            self.assertEqual(int(row[-1]), sum(entries.values()))
+            totals.append(int(row[-1]))
+        self.assertEqual(entries[2], 0)
+        self.assertEqual(entries[3], 0)
+        self.assertGreater(entries[1], 0)
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+    def test_single_threshold_pruned_to_empty(self):
+        pruned = os.path.join(self.dir, 'pruned.arpa')
+        self.prune('-threshold', '1e-1', '-write-lm', pruned)
+        entries = count_entries(pruned)
+        self.assertEqual(read_data_counts(pruned), entries)
+        self.assertEqual(entries[3], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
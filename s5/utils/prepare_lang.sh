@@ -67,6 +67,8 @@ extra_word_disambig_syms=        # if set, add disambiguation symbols from this
 num_extra_phone_disambig_syms=1 # Standard one phone disambiguation symbol is used for optional silence.
                                 # Increasing this number does not harm, but is only useful if you later
                                 # want to introduce this labels to L_disambig.fst
+nj=1                            # number of processes used to write the arcs of L.fst
+                                # and L_disambig.fst (the result is the same for any nj)
 
 
 # end configuration sections
@@ -101,6 +103,8 @@ if [ $# -ne 4 ]; then
   echo "     --extra-word-disambig-syms <filename>           # default: \"\"; if not empty, add disambiguation symbols"
   echo "                                                     # from this file (one per line) to phones/disambig.txt,"
   echo "                                                     # phones/wdisambig.txt and words.txt"
+  echo "     --nj <number of jobs>                           # default: 1; number of processes used to write"
+  echo "                                                     # the lexicon FSTs (useful for very large lexicons)."
   exit 1;
 fi
 
@@ -455,16 +459,16 @@ if $silprob; then
   # Add silence probabilities (models the prob. of silence before and after each
   # word).  On some setups this helps a bit.  See utils/dict_dir_add_pronprobs.sh
   # and where it's called in the example scripts (run.sh).
-  utils/lang/make_lexicon_fst_silprob.py $grammar_opts --sil-phone=$silphone \
+  utils/lang/make_lexicon_fst_silprob.py $grammar_opts --num-jobs=$nj --sil-phone=$silphone \
          $tmpdir/lexiconp_silprob.txt $srcdir/silprob.txt | \
      fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
        --keep_isymbols=false --keep_osymbols=false |   \
      fstarcsort --sort_type=olabel > $dir/L.fst || exit 1;
 else
-  utils/lang/make_lexicon_fst.py $grammar_opts --sil-prob=$sil_prob --sil-phone=$silphone \
+  utils/lang/make_lexicon_fst.py $grammar_opts --num-jobs=$nj --sil-prob=$sil_prob --sil-phone=$silphone \
+            --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
             $tmpdir/lexiconp.txt | \
-    fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
-      --keep_isymbols=false --keep_osymbols=false | \
+    fstcompile | \
     fstarcsort --sort_type=olabel > $dir/L.fst || exit 1;
 fi
 
@@ -531,7 +535,7 @@ utils/gen_topo.pl $num_nonsil_states $num_sil_states $nonsilphonelist $silphonel
 # disambiguation symbols from G.fst.
 
 if $silprob; then
-  utils/lang/make_lexicon_fst_silprob.py $grammar_opts \
+  utils/lang/make_lexicon_fst_silprob.py $grammar_opts --num-jobs=$nj \
      --sil-phone=$silphone --sil-disambig='#'$ndisambig \
      $tmpdir/lexiconp_silprob_disambig.txt $srcdir/silprob.txt | \
      fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
@@ -539,11 +543,11 @@ if $silprob; then
      fstaddselfloops  $dir/phones/wdisambig_phones.int $dir/phones/wdisambig_words.int | \
      fstarcsort --sort_type=olabel > $dir/L_disambig.fst || exit 1;
 else
-  utils/lang/make_lexicon_fst.py $grammar_opts \
+  utils/lang/make_lexicon_fst.py $grammar_opts --num-jobs=$nj \
        --sil-prob=$sil_prob --sil-phone=$silphone --sil-disambig='#'$ndisambig \
+       --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
          $tmpdir/lexiconp_disambig.txt | \
-     fstcompile --isymbols=$dir/phones.txt --osymbols=$dir/words.txt \
-       --keep_isymbols=false --keep_osymbols=false |   \
+     fstcompile | \
      fstaddselfloops  $dir/phones/wdisambig_phones.int $dir/phones/wdisambig_words.int | \
      fstarcsort --sort_type=olabel > $dir/L_disambig.fst || exit 1;
 fi
@@ -3,8 +3,11 @@
 # Copyright 2012 Mirko Hannemann BUT, mirko.hannemann@gmail.com
 
 from __future__ import print_function
+import os
 import sys
-import codecs # for UTF-8/unicode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'steps', 'libs'))
+import arpa as arpa_lib
 
 if len(sys.argv) != 2:
     print('usage: reverse_arpa arpa.in')
@@ -33,90 +36,79 @@ arpaname = sys.argv[1]
 
 # read language model in ARPA format
 try:
-  file = codecs.open(arpaname, "r", "utf-8")
+  file = arpa_lib.open_arpa(arpaname, encoding="utf-8")
 except IOError:
   print('file not found: ' + arpaname)
   sys.exit()
+reader = arpa_lib.ArpaReader(file)
 
-text=file.readline()
-while (text and text[:6] != "\\data\\"): text=file.readline()
-if not text:
-  print("invalid ARPA file")
-  sys.exit()
-#print text,
-while (text and text[:5] != "ngram"): text=file.readline()
-
-# get ngram counts
-cngrams=[]
-n=0
-while (text and text[:5] == "ngram"):
-  ind = text.split("=")
-  counts = int(ind[1].strip())
-  r = ind[0].split()
-  read_n = int(r[1].strip())
-  if read_n != n+1:
-    print("invalid ARPA file: {}".format(text))
-    sys.exit()
-  n = read_n
-  cngrams.append(counts)
-  #print text,
-  text=file.readline()
-
-# read all n-grams order by order
-sentprob = 0.0 # sentence begin unigram
-ngrams=[]
-inf=float("inf")
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  while (text and "-grams:" not in text): text=file.readline()
-  if n != int(text[1]):
-    print("invalid ARPA file:{}".format(text))
+try:
+  if not reader.read_header():
+    print("invalid ARPA file")
     sys.exit()
-  #print text,cngrams[n-1]
-  this_ngrams={} # stores all read ngrams
-  for ng in range(cngrams[n-1]):
-    while (text and len(text.split())<2):
-      text=file.readline()
-      if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))):
-      break # to deal with incorrect ARPA files
-    entry = text.split()
-    prob = float(entry[0])
-    if len(entry)>n+1:
-      back = float(entry[-1])
-      words = entry[1:n+1]
-    else:
-      back = 0.0
-      words = entry[1:]
-    ngram = " ".join(words)
-    if (n==1) and words[0]=="<s>":
-      sentprob = prob
-      prob = 0.0
-    this_ngrams[ngram] = (prob,back)
-    #print prob,ngram.encode("utf-8"),back
-
-    for x in range(n-1,0,-1):
-      # add all missing backoff ngrams for reversed lm
-      l_ngram = " ".join(words[:x]) # shortened ngram
-      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
-      if l_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][l_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", l_ngram, "inf"
-      if r_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][r_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", r_ngram, "inf",x,n,h_ngram
-
-      # add all missing backoff ngrams for forward lm
-      h_ngram = " ".join(words[n-x:]) # shortened history
-      if h_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][h_ngram] = (0.0,inf)
-        #print "create inf", h_ngram, "0.0"
-    text=file.readline()
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-  ngrams.append(this_ngrams)
-
-while (text and text[:5] != "\\end\\"): text=file.readline()
-if not text:
-  print("invalid ARPA file")
+
+  # get ngram counts
+  cngrams=[]
+  for read_n, counts in reader.counts:
+    if read_n != len(cngrams)+1:
+      print("invalid ARPA file: ngram {}={}".format(read_n, counts))
+      sys.exit()
+    cngrams.append(counts)
+
+  # read all n-grams order by order
+  sentprob = 0.0 # sentence begin unigram
+  ngrams=[]
+  inf=float("inf")
+  sections = reader.sections()
+  for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
+    read_n, lines = next(sections, (None, None))
+    if n != read_n:
+      print("invalid ARPA file: expected \\{}-grams:".format(n))
+      sys.exit()
+    #print text,cngrams[n-1]
+    this_ngrams={} # stores all read ngrams
+    num_read = 0
+    for text in lines:
+      entry = text.split()
+      if len(entry)<2: continue
+      if num_read == cngrams[n-1]: break # to deal with incorrect ARPA files
+      num_read += 1
+      prob = float(entry[0])
+      if len(entry)>n+1:
+        back = float(entry[-1])
+        words = entry[1:n+1]
+      else:
+        back = 0.0
+        words = entry[1:]
+      ngram = " ".join(words)
+      if (n==1) and words[0]=="<s>":
+        sentprob = prob
+        prob = 0.0
+      this_ngrams[ngram] = (prob,back)
+      #print prob,ngram.encode("utf-8"),back
+
+      for x in range(n-1,0,-1):
+        # add all missing backoff ngrams for reversed lm
+        l_ngram = " ".join(words[:x]) # shortened ngram
+        r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
+        if l_ngram not in ngrams[x-1]: # create missing ngram
+          ngrams[x-1][l_ngram] = (0.0,inf)
+          #print ngram, "create 0.0", l_ngram, "inf"
+        if r_ngram not in ngrams[x-1]: # create missing ngram
+          ngrams[x-1][r_ngram] = (0.0,inf)
+          #print ngram, "create 0.0", r_ngram, "inf",x,n,h_ngram
+
+        # add all missing backoff ngrams for forward lm
+        h_ngram = " ".join(words[n-x:]) # shortened history
+        if h_ngram not in ngrams[x-1]: # create missing ngram
+          ngrams[x-1][h_ngram] = (0.0,inf)
+          #print "create inf", h_ngram, "0.0"
+    ngrams.append(this_ngrams)
+
+  # skip any further sections, up to \end\
+  for read_n, lines in sections: pass
+except arpa_lib.ArpaFormatError as e:
+  print("invalid ARPA file: {}".format(e))
   sys.exit()
 file.close()
 #print text,